@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
-from .models import UserProfile, Photo, Tag, PhotoInteraction
+from .models import UserProfile, Photo, Tag, PhotoInteraction, Job, Blob, UploadSession
 
 User = get_user_model()
 
@@ -14,4 +14,44 @@ class CustomUserAdmin(admin.ModelAdmin):
 admin.site.register(UserProfile)
 admin.site.register(Photo)
 admin.site.register(Tag)
-admin.site.register(PhotoInteraction)
+
+
+@admin.register(PhotoInteraction)
+class PhotoInteractionAdmin(admin.ModelAdmin):
+	"""
+	Read-only: interactions are written through PhotoInteraction.toggle()
+	and pic_me.interactions, which keep the photo counters and scores.
+	"""
+	list_display = ('user', 'photo', 'interaction_type', 'created_at')
+	list_filter = ('interaction_type',)
+	list_select_related = ('user', 'photo')
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def has_delete_permission(self, request, obj=None):
+		return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+	list_display = ('id', 'kind', 'status', 'attempts', 'run_after', 'finished_at')
+	list_filter = ('status', 'kind')
+	readonly_fields = ('locked_by', 'locked_until', 'last_error', 'created_at', 'updated_at', 'finished_at')
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+	list_display = ('name', 'size', 'refcount', 'processed', 'updated_at')
+	list_filter = ('processed',)
+	search_fields = ('name',)
+	readonly_fields = ('renditions', 'created_at', 'updated_at')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+	list_display = ('id', 'user', 'filename', 'size', 'updated_at')
+	readonly_fields = ('sha256', 'created_at', 'updated_at')
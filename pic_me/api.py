@@ -0,0 +1,284 @@
+"""
+Read-only JSON API (``/api/v1/``) for photos, tags and interaction counts.
+
+Queries load only the columns a response needs. Every response carries an
+``ETag`` and, for photos, a ``Last-Modified`` derived from
+``Photo.updated_at``, which is touched whenever a photo's representation
+changes (see ``fragments.bump_photos``). Conditional requests are checked
+before the expensive part of a response is built, so polling clients get a
+cheap ``304 Not Modified`` while nothing changed.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import facets, fragments
+from .models import Photo, Tag
+from .pagination import InvalidCursor, paginate_keyset
+from .views import GALLERY_SORTS, filter_gallery, sort_gallery
+
+MAX_PAGE_SIZE = 100
+
+PHOTO_FIELDS = (
+    'id', 'title', 'description', 'image', 'renditions', 'like_count', 'dislike_count',
+    'created_at', 'updated_at', 'uploaded_by__username',
+)
+SCORE_FIELDS = ('score__top', 'score__trending')
+
+
+def _etag(*parts):
+    digest = hashlib.sha256(json.dumps(parts, cls=DjangoJSONEncoder).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _last_modified(updated):
+    return int(max(updated).timestamp()) if updated else None
+
+
+def _conditional(request, etag, last_modified=None):
+    """
+    Return a 304 response if the client's copy is current, else None.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        _stamp(response, etag, last_modified)
+    return response
+
+
+def _stamp(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep responses but must revalidate them
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _photo_queryset():
+    return (
+        Photo.objects
+        .select_related('uploaded_by')
+        .only(*PHOTO_FIELDS)
+    )
+
+
+def _serialize_photo(request, photo, detail=False):
+    data = {
+        'id': photo.pk,
+        'title': photo.title,
+        'description': photo.description,
+        'uploaded_by': photo.uploaded_by.username,
+        'tags': [{'name': tag.name, 'slug': tag.slug} for tag in photo.tags.all()],
+        'like_count': photo.like_count,
+        'dislike_count': photo.dislike_count,
+        'created_at': photo.created_at,
+        'updated_at': photo.updated_at,
+        'url': request.build_absolute_uri(reverse('api_photo_detail', args=[photo.pk])),
+        'image': request.build_absolute_uri(photo.image.url),
+        'thumbnail': request.build_absolute_uri(photo.thumbnail_url),
+    }
+    if detail:
+        data['medium'] = request.build_absolute_uri(photo.medium_url)
+        data['renditions'] = {
+            name: {
+                'width': photo.renditions[name]['width'],
+                'height': photo.renditions[name]['height'],
+                **{
+                    format_key: request.build_absolute_uri(photo.rendition_url(name, format_key))
+                    for format_key in ('jpeg', 'webp')
+                },
+            }
+            for name in photo.renditions
+            if name != 'source' and photo.rendition_url(name)
+        }
+    return data
+
+
+def _prefetch_tags(photos):
+    prefetch_related_objects(photos, Prefetch('tags', queryset=Tag.objects.only('id', 'name', 'slug')))
+
+
+def _selected_slugs(request):
+    return list(dict.fromkeys(slug for slug in request.GET.getlist('tag') if slug))
+
+
+def _too_many_tags(slugs):
+    """
+    A 400 response if more tags are selected than ``PICME_TAG_FACET_MAX_SELECTED``.
+    """
+    if len(slugs) > settings.PICME_TAG_FACET_MAX_SELECTED:
+        return JsonResponse(
+            {'error': f'At most {settings.PICME_TAG_FACET_MAX_SELECTED} tags can be selected.'}, status=400,
+        )
+    return None
+
+
+def _match(request):
+    return facets.MATCH_ANY if request.GET.get('match') == facets.MATCH_ANY else facets.MATCH_ALL
+
+
+def _limit(request, default=None):
+    try:
+        return max(int(request.GET['limit']), 0)
+    except (KeyError, ValueError):
+        return default
+
+
+def photo_list(request):
+    """
+    Paginated photos, newest first. Accepts ``tag`` (slug, repeatable, at
+    most ``PICME_TAG_FACET_MAX_SELECTED``),
+    ``match`` (``all`` or ``any`` of the tags), ``search``, ``sort``
+    (``new``, ``trending``, ``top`` or ``relevance`` to the search),
+    ``cursor`` (from ``next``) and
+    ``page_size``.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        page_size = min(int(request.GET.get('page_size', settings.PICME_GALLERY_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = settings.PICME_GALLERY_PAGE_SIZE
+    page_size = max(page_size, 1)
+
+    slugs = _selected_slugs(request)
+    too_many = _too_many_tags(slugs)
+    if too_many is not None:
+        return too_many
+
+    photos = filter_gallery(
+        _photo_queryset(), slugs, request.GET.get('search'), _match(request), request.GET.get('sort'),
+    )
+    photos, ordering = sort_gallery(photos, request.GET.get('sort'), request.GET.get('search'))
+    if ordering in (GALLERY_SORTS['trending'], GALLERY_SORTS['top']):
+        photos = photos.only(*PHOTO_FIELDS, *SCORE_FIELDS)
+    try:
+        page = paginate_keyset(photos, ordering, cursor=request.GET.get('cursor'), page_size=page_size)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+
+    # The page rows alone decide whether the client's copy is current;
+    # tags and URLs are only built for a full response
+    tags_version = fragments.get_version(fragments.TAGS_VERSION)
+    etag = _etag(tags_version, page.next_cursor, [(photo.pk, photo.updated_at) for photo in page.items])
+    last_modified = _last_modified([photo.updated_at for photo in page.items])
+    not_modified = _conditional(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    _prefetch_tags(page.items)
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    response = JsonResponse({
+        'results': [_serialize_photo(request, photo) for photo in page.items],
+        'next': next_url,
+    })
+    return _stamp(response, etag, last_modified)
+
+
+def photo_detail(request, id):
+    """
+    A single photo with all its renditions.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    updated_at = Photo.objects.filter(pk=id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        raise Http404('No such photo.')
+    tags_version = fragments.get_version(fragments.TAGS_VERSION)
+    etag = _etag(id, updated_at, tags_version)
+    last_modified = _last_modified([updated_at])
+    not_modified = _conditional(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    photo = _photo_queryset().filter(pk=id).first()
+    if photo is None:
+        raise Http404('No such photo.')
+    _prefetch_tags([photo])
+    return _stamp(JsonResponse(_serialize_photo(request, photo, detail=True)), etag, last_modified)
+
+
+def photo_counts(request, id):
+    """
+    Like/dislike counts of a photo; the cheapest endpoint to poll.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    counts = Photo.objects.filter(pk=id).values('id', 'like_count', 'dislike_count', 'updated_at').first()
+    if counts is None:
+        raise Http404('No such photo.')
+    etag = _etag(id, counts['updated_at'])
+    last_modified = _last_modified([counts['updated_at']])
+    not_modified = _conditional(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    return _stamp(JsonResponse(counts), etag, last_modified)
+
+
+def tag_list(request):
+    """
+    All tags with the number of photos carrying them, by name, or most used
+    first with ``order=count`` (for a tag cloud). Accepts ``limit``.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    ordering = ('-photo_count', 'name') if request.GET.get('order') == 'count' else ('name',)
+    tags = Tag.objects.order_by(*ordering).values('id', 'name', 'slug', 'photo_count')
+    limit = _limit(request)
+    tags = list(tags[:limit] if limit is not None else tags)
+    etag = _etag(tags)
+    not_modified = _conditional(request, etag)
+    if not_modified is not None:
+        return not_modified
+    return _stamp(JsonResponse({'results': tags}), etag)
+
+
+def tag_facets(request):
+    """
+    Refinements of a tag selection (``tag``, repeatable, and ``match``):
+    the number of photos matching it and, for the most frequent other tags,
+    the number there would be with that tag added. Accepts ``limit``.
+    Selections are capped at ``PICME_TAG_FACET_MAX_SELECTED`` tags, and a
+    full selection has no refinements.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    slugs = _selected_slugs(request)
+    too_many = _too_many_tags(slugs)
+    if too_many is not None:
+        return too_many
+    match = _match(request)
+    selected = list(Tag.objects.filter(slug__in=slugs).only('id', 'name', 'slug', 'photo_count'))
+    if len(selected) < len(slugs) and match == facets.MATCH_ALL:
+        # An unknown tag matches nothing, as in the gallery
+        total, refinements = 0, []
+    else:
+        limit = _limit(request, settings.PICME_TAG_FACET_LIMIT)
+        if len(slugs) >= settings.PICME_TAG_FACET_MAX_SELECTED:
+            limit = 0
+        total, refinements = facets.facet_counts(selected, match, limit=limit)
+    data = {
+        'selected': [{'id': tag.pk, 'name': tag.name, 'slug': tag.slug} for tag in selected],
+        'match': match,
+        'total': total,
+        'results': [
+            {'id': tag.pk, 'name': tag.name, 'slug': tag.slug, 'count': tag.facet_count}
+            for tag in refinements
+        ],
+    }
+    etag = _etag(data)
+    not_modified = _conditional(request, etag)
+    if not_modified is not None:
+        return not_modified
+    return _stamp(JsonResponse(data), etag)
@@ -7,4 +7,23 @@ class PicMeConfig(AppConfig):
     
     def ready(self):
         import pic_me.models  # This ensures signals are loaded
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from PIL import Image
+
+        from pic_me import querybudget
+
+        connection_created.connect(querybudget.install, dispatch_uid='picme-querybudget')
+
+        # Pillow refuses to decode images over twice this (see pic_me.ingest)
+        Image.MAX_IMAGE_PIXELS = settings.PICME_IMAGE_MAX_PIXELS
+
+        if settings.PICME_INTERACTION_WRITE_BEHIND:
+            from pic_me import writebehind
+
+            # Start the flusher (and replay a crashed process's journal) with
+            # the first request rather than in management commands
+            request_started.connect(writebehind.start_on_request, dispatch_uid='picme-writebehind')
 
@@ -0,0 +1,86 @@
+"""
+Square avatar variants of profile pictures.
+
+Saving a profile picture creates centre-cropped 32, 64 and 128 pixel
+copies (``UserProfile.avatars``, in the format of ``Photo.renditions``),
+right away or in the ``profile.avatars`` job. Their names carry a digest
+of their content, so ``serve_media`` marks them immutable, and templates
+(``{% avatar %}``) build their URLs from the profile row alone without
+opening the original.
+
+Users without a picture, or whose avatars are not generated yet, get an
+identicon instead: a symmetric 5x5 pattern derived from the user id,
+drawn on demand by ``views.identicon`` at a URL that never changes
+meaning.
+"""
+import hashlib
+from functools import lru_cache
+from io import BytesIO
+
+from django.urls import reverse
+from PIL import ImageDraw
+
+AVATAR_SIZES = (32, 64, 128)
+
+# Rendition name -> (width, height, crop), see pic_me.renditions
+AVATAR_SPECS = {f'avatar_{size}': (size, size, True) for size in AVATAR_SIZES}
+
+# Bumped when the identicon drawing changes, so cached images are replaced
+IDENTICON_VERSION = 1
+IDENTICON_GRID = 5
+IDENTICON_BACKGROUND = (243, 244, 246)
+
+
+def generate_avatars(field_file):
+    """
+    Create and store every avatar size of a profile picture.
+    """
+    from .renditions import generate_renditions
+
+    return generate_renditions(field_file, AVATAR_SPECS)
+
+
+def nearest_size(size):
+    """
+    The smallest avatar size covering ``size`` pixels.
+    """
+    return next((candidate for candidate in AVATAR_SIZES if candidate >= size), AVATAR_SIZES[-1])
+
+
+def identicon_seed(user_id):
+    return hashlib.sha256(f'picme-identicon:{IDENTICON_VERSION}:{user_id}'.encode()).hexdigest()[:12]
+
+
+def identicon_url(user_id, size):
+    return reverse('identicon', args=[identicon_seed(user_id), nearest_size(size)])
+
+
+@lru_cache(maxsize=256)
+def identicon(seed, size):
+    """
+    PNG bytes of the identicon for ``seed`` at ``size`` pixels.
+    """
+    from .models import Photo
+
+    digest = hashlib.sha256(seed.encode()).digest()
+    color = (digest[0] // 2 + 40, digest[1] // 2 + 40, digest[2] // 2 + 40)
+    image = Photo.create_placeholder_image(size, size, color=IDENTICON_BACKGROUND)
+    draw = ImageDraw.Draw(image)
+
+    # Cells are mirrored around the middle column; one bit per cell
+    cell = size // (IDENTICON_GRID + 1)
+    margin = (size - cell * IDENTICON_GRID) // 2
+    half = (IDENTICON_GRID + 1) // 2
+    bits = int.from_bytes(digest[3:7], 'big')
+    for row in range(IDENTICON_GRID):
+        for col in range(half):
+            if not bits >> (row * half + col) & 1:
+                continue
+            for x in {col, IDENTICON_GRID - 1 - col}:
+                left = margin + x * cell
+                top = margin + row * cell
+                draw.rectangle([left, top, left + cell - 1, top + cell - 1], fill=color)
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
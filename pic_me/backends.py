@@ -1,6 +1,10 @@
+import time
+
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth import get_user_model
 
+from . import hashers, metrics, usercache
+
 
 class CustomAuthBackend(BaseBackend):
     """
@@ -12,33 +16,75 @@ class CustomAuthBackend(BaseBackend):
         """
         Authenticate a user by email and password.
         Returns the user object if authentication is successful, None otherwise.
+        Outdated password hashes are upgraded by check_password().
         """
         UserModel = get_user_model()
         
         if email is None or password is None:
             return None
         
+        started = time.perf_counter()
         try:
             user = UserModel.objects.get(email=email)
-            if user.check_password(password) and self.user_can_authenticate(user):
-                return user
         except UserModel.DoesNotExist:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            UserModel().set_password(password)
+            self._record(started, None, authenticated=False)
             return None
-        
+
+        stored = user.password
+        hash_started = time.perf_counter()
+        is_correct = user.check_password(password)
+        self._record(started, hash_started, authenticated=is_correct, rehashed=user.password != stored)
+        if is_correct and self.user_can_authenticate(user):
+            return user
         return None
 
-    def get_user(self, user_id):
+    async def aauthenticate(self, request, email=None, password=None, **kwargs):
         """
-        Retrieve a user object by user ID.
-        Returns the user object if found, None otherwise.
+        Async authenticate(); the password hashing runs in the hashing
+        thread pool (see pic_me.hashers) instead of on the event loop.
         """
         UserModel = get_user_model()
-        
+
+        if email is None or password is None:
+            return None
+
+        started = time.perf_counter()
         try:
-            return UserModel.objects.get(pk=user_id)
+            user = await UserModel.objects.aget(email=email)
         except UserModel.DoesNotExist:
+            await hashers.amake_password(password)
+            self._record(started, None, authenticated=False)
             return None
 
+        hash_started = time.perf_counter()
+        is_correct, rehashed = await hashers.acheck_password(user, password)
+        self._record(started, hash_started, authenticated=is_correct, rehashed=rehashed)
+        if is_correct and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def _record(self, started, hash_started, authenticated, rehashed=False):
+        finished = time.perf_counter()
+        metrics.observe('auth.login_seconds', finished - started)
+        if hash_started is not None:
+            metrics.observe('auth.password_check_seconds', finished - hash_started)
+        metrics.increment('auth.logins' if authenticated else 'auth.failures')
+        if rehashed:
+            metrics.increment('auth.rehashes')
+
+    def get_user(self, user_id):
+        """
+        Retrieve a user object by user ID.
+        Returns the user object if found and active, None otherwise.
+        Served from a short-lived cache, see pic_me.usercache.
+        """
+        user = usercache.get_user(user_id)
+        if user is not None and self.user_can_authenticate(user):
+            return user
+        return None
+
     def user_can_authenticate(self, user):
         """
         Check if the user account is active.
@@ -0,0 +1,219 @@
+"""
+Tag facet counts from maintained aggregates.
+
+``Tag.photo_count`` holds the number of photos carrying a tag, and
+``TagPair`` the number of photos carrying both tags of a pair (stored in
+both directions). The ``m2m_changed`` and ``Photo`` delete handlers in
+``models.py`` keep them current: ``snapshot()`` reads the tag sets of the
+affected photos before a change, and ``record()`` applies the difference
+after it. Bulk writes that skip the signals call ``record()`` themselves.
+``manage.py rebuild_tag_counts`` recomputes everything from the join
+table.
+
+``facet_counts()`` answers "how many photos would the result have with
+this tag too". For no selection, or a single selected tag, the answer
+comes from the aggregates alone. Pair counts cannot be combined into
+counts of three or more tags, so for larger selections it counts the tags
+of the matching photos, through the (tag, photo) index, rather than
+grouping the whole join table. The views cap the selection at
+``PICME_TAG_FACET_MAX_SELECTED`` tags, which bounds that work.
+"""
+from collections import Counter
+from functools import reduce
+from itertools import permutations
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .pagination import filter_pk_in
+
+MATCH_ALL = 'all'
+MATCH_ANY = 'any'
+
+
+def _through():
+    from .models import Photo
+
+    return Photo.tags.through
+
+
+def snapshot(photo_ids):
+    """
+    Current tag ids of each photo, as ``{photo_id: set(tag_ids)}``.
+    """
+    tags = {photo_id: set() for photo_id in photo_ids}
+    rows = _through().objects.filter(photo_id__in=tags).values_list('photo_id', 'tag_id')
+    for photo_id, tag_id in rows:
+        tags[photo_id].add(tag_id)
+    return tags
+
+
+def _deltas(before, after):
+    tag_deltas = Counter()
+    pair_deltas = Counter()
+    for photo_id in set(before) | set(after):
+        old = before.get(photo_id, set())
+        new = after.get(photo_id, set())
+        if old == new:
+            continue
+        tag_deltas.update(new - old)
+        tag_deltas.subtract(old - new)
+        pair_deltas.update(pair for pair in permutations(new, 2) if not (pair[0] in old and pair[1] in old))
+        pair_deltas.subtract(pair for pair in permutations(old, 2) if not (pair[0] in new and pair[1] in new))
+    return (
+        {tag_id: delta for tag_id, delta in tag_deltas.items() if delta},
+        {pair: delta for pair, delta in pair_deltas.items() if delta},
+    )
+
+
+def record(before, after):
+    """
+    Apply the change of photos' tag sets from ``before`` to ``after`` (both
+    ``{photo_id: set(tag_ids)}``) to the counts.
+    """
+    from .models import Tag, TagPair
+
+    tag_deltas, pair_deltas = _deltas(before, after)
+    if not tag_deltas and not pair_deltas:
+        return
+    with transaction.atomic():
+        if tag_deltas:
+            Tag.objects.filter(pk__in=tag_deltas).update(photo_count=F('photo_count') + Case(
+                *[When(pk=tag_id, then=Value(delta)) for tag_id, delta in tag_deltas.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+        if pair_deltas:
+            # Pairs whose tag was deleted meanwhile are skipped
+            existing = set(Tag.objects.filter(pk__in={tag_id for pair in pair_deltas for tag_id in pair})
+                           .values_list('pk', flat=True))
+            pair_deltas = {
+                pair: delta for pair, delta in pair_deltas.items() if pair[0] in existing and pair[1] in existing
+            }
+            if not pair_deltas:
+                return
+            TagPair.objects.bulk_create(
+                [
+                    TagPair(tag_id=tag_id, other_id=other_id)
+                    for (tag_id, other_id), delta in pair_deltas.items()
+                    if delta > 0
+                ],
+                ignore_conflicts=True,
+            )
+            affected = reduce(or_, (Q(tag_id=tag_id, other_id=other_id) for tag_id, other_id in pair_deltas))
+            TagPair.objects.filter(affected).update(count=F('count') + Case(
+                *[
+                    When(tag_id=tag_id, other_id=other_id, then=Value(delta))
+                    for (tag_id, other_id), delta in pair_deltas.items()
+                ],
+                default=Value(0), output_field=IntegerField(),
+            ))
+            TagPair.objects.filter(affected, count__lte=0).delete()
+
+
+def rebuild():
+    """
+    Recompute every tag count and pair count from the join table.
+    """
+    from .models import Tag, TagPair
+
+    Through = _through()
+    with transaction.atomic():
+        counts = (
+            Through.objects.filter(tag_id=OuterRef('pk')).order_by()
+            .values('tag_id').annotate(total=Count('photo_id')).values('total')
+        )
+        tags = Tag.objects.update(photo_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+        pairs = Counter()
+        tags_by_photo = {}
+        for photo_id, tag_id in Through.objects.order_by('photo_id').values_list('photo_id', 'tag_id').iterator():
+            tags_by_photo.setdefault(photo_id, []).append(tag_id)
+        for tag_ids in tags_by_photo.values():
+            pairs.update(permutations(tag_ids, 2))
+        TagPair.objects.all().delete()
+        TagPair.objects.bulk_create(
+            [TagPair(tag_id=tag_id, other_id=other_id, count=total) for (tag_id, other_id), total in pairs.items()],
+            batch_size=1000,
+        )
+    return tags, len(pairs)
+
+
+def matching_photos(photos, slugs, match=MATCH_ALL):
+    """
+    Restrict a Photo queryset to photos carrying all (or any) of the tags
+    with the given slugs. The filter leaves the plan to the queryset's
+    ordering, see ``pagination.filter_pk_in()``.
+    """
+    if not slugs:
+        return photos
+    Through = _through()
+    if match == MATCH_ANY:
+        return filter_pk_in(photos, Through.objects.filter(tag__slug__in=slugs).values('photo_id'))
+    for slug in slugs:
+        photos = filter_pk_in(photos, Through.objects.filter(tag__slug=slug).values('photo_id'))
+    return photos
+
+
+def _matching_photo_ids(tag_ids, match):
+    # Ids of the photos matching a selection, from the (tag, photo) index
+    Through = _through()
+    if match == MATCH_ANY:
+        return Through.objects.filter(tag_id__in=tag_ids).values('photo_id').distinct()
+    photo_ids = Through.objects.filter(tag_id=tag_ids[0])
+    for tag_id in tag_ids[1:]:
+        photo_ids = photo_ids.filter(photo_id__in=Through.objects.filter(tag_id=tag_id).values('photo_id'))
+    return photo_ids.values('photo_id')
+
+
+def facet_counts(selected, match=MATCH_ALL, limit=None):
+    """
+    Counts for refining a selection of ``Tag`` objects.
+
+    Returns ``(total, tags)``: the number of photos matching the selection
+    (None without one) and the unselected tags, most frequent first, each
+    with ``facet_count`` set to the size of the result if it were added to
+    the selection. Tags that would empty an ``all`` selection are left out.
+    With ``limit=0`` only the total is computed.
+    """
+    from .models import Tag, TagPair
+
+    tag_ids = [tag.pk for tag in selected]
+    tags = Tag.objects.exclude(pk__in=tag_ids)
+    if not tag_ids:
+        tags = list(tags.filter(photo_count__gt=0).order_by('-photo_count', 'name')[:limit])
+        for tag in tags:
+            tag.facet_count = tag.photo_count
+        return None, tags
+
+    if len(tag_ids) == 1:
+        total = selected[0].photo_count
+        if limit == 0:
+            return total, []
+        overlap = dict(TagPair.objects.filter(tag_id=tag_ids[0]).values_list('other_id', 'count'))
+    else:
+        matching = _matching_photo_ids(tag_ids, match)
+        if len(tag_ids) == 2 and match == MATCH_ALL:
+            pair = TagPair.objects.filter(tag_id=tag_ids[0], other_id=tag_ids[1])
+            total = pair.values_list('count', flat=True).first() or 0
+        else:
+            total = matching.count()
+        if limit == 0:
+            return total, []
+        overlap = dict(
+            _through().objects.filter(photo_id__in=matching).exclude(tag_id__in=tag_ids)
+            .values('tag_id').annotate(total=Count('photo_id')).values_list('tag_id', 'total')
+        )
+
+    if match == MATCH_ANY:
+        # |result ∪ tag| = |result| + |tag| - |result ∩ tag|
+        tags = list(tags.filter(photo_count__gt=0))
+        for tag in tags:
+            tag.facet_count = total + tag.photo_count - overlap.get(tag.pk, 0)
+    else:
+        tags = list(tags.filter(pk__in=[tag_id for tag_id, count in overlap.items() if count > 0]))
+        for tag in tags:
+            tag.facet_count = overlap[tag.pk]
+    tags.sort(key=lambda tag: (-tag.facet_count, tag.name))
+    return total, tags[:limit]
@@ -0,0 +1,100 @@
+"""
+Versioned fragment cache for the gallery.
+
+Rendered HTML fragments (one per photo card, plus the tag dropdown) are
+stored in the ``PICME_FRAGMENT_CACHE_ALIAS`` cache under keys that embed a
+version. Versions live in the database, not in the cache: a photo's version
+is its ``Photo.cache_version`` column and the tag list version is the
+``tags`` row of ``CacheVersion``. The signal handlers in ``models.py`` bump
+them on every relevant write, so a cached fragment can never be served for
+data that changed - stale entries are simply no longer looked up and expire.
+
+Versions are bumped to ``max(version + 1, now in microseconds)`` which keeps
+them unique even if a concurrent ``save()`` writes back an older value.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import metrics
+
+TAGS_VERSION = 'tags'
+
+
+def _cache():
+    return caches[settings.PICME_FRAGMENT_CACHE_ALIAS]
+
+
+def bumped(field):
+    """Expression bumping a version column, see the module docstring."""
+    return Greatest(F(field) + 1, Value(time.time_ns() // 1000))
+
+
+def bump_photos(photo_ids):
+    """
+    Invalidate the cached cards of the given photos. Also touches
+    ``updated_at``, which the JSON API uses for ETag/Last-Modified.
+    """
+    from .models import Photo
+
+    photo_ids = list(photo_ids)
+    if photo_ids:
+        Photo.objects.filter(pk__in=photo_ids).update(
+            cache_version=bumped('cache_version'), updated_at=timezone.now(),
+        )
+
+
+def bump_all_photos():
+    """
+    Invalidate every cached photo card (e.g. after a bulk counter rebuild).
+    """
+    from .models import Photo
+
+    Photo.objects.update(cache_version=bumped('cache_version'), updated_at=timezone.now())
+
+
+def bump_version(name):
+    """
+    Invalidate every fragment depending on the named version.
+    """
+    from .models import CacheVersion
+
+    if not CacheVersion.objects.filter(name=name).update(version=bumped('version')):
+        CacheVersion.objects.get_or_create(name=name, defaults={'version': time.time_ns() // 1000})
+
+
+def get_version(name):
+    from .models import CacheVersion
+
+    return CacheVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def photo_card_key(photo, tags_version):
+    return f'picme:{settings.PICME_FRAGMENT_VERSION}:card:{photo.pk}:{photo.cache_version}:{tags_version}'
+
+
+def tag_list_key(tags_version, selected_tag):
+    return f'picme:{settings.PICME_FRAGMENT_VERSION}:tags:{tags_version}:{selected_tag or ""}'
+
+
+def get_many(keys):
+    """
+    Fetch several fragments in one cache round-trip.
+    Returns a dict of the keys that were found.
+    """
+    found = _cache().get_many(keys)
+    metrics.increment('fragments.hits', len(found))
+    metrics.increment('fragments.misses', len(keys) - len(found))
+    return found
+
+
+def get(key):
+    return get_many([key]).get(key)
+
+
+def store(key, html):
+    _cache().set(key, html, settings.PICME_FRAGMENT_CACHE_TIMEOUT)
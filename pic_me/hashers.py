@@ -0,0 +1,115 @@
+"""
+Password hashers with work factors taken from settings.
+
+``PICME_PASSWORD_HASHER`` picks the hasher new passwords are stored with
+(``scrypt``, memory-hard and from the standard library, or ``pbkdf2``). The
+other one stays in ``PASSWORD_HASHERS`` so existing hashes keep verifying.
+Django re-encodes a password on the next successful login whenever its
+algorithm or cost differs from the preferred hasher, so changing the
+settings upgrades accounts transparently.
+
+Hashing is pure CPU and releases the GIL. ``acheck_password()`` runs it in a
+thread pool (``PICME_PASSWORD_HASH_THREADS``) so async callers never block
+the event loop.
+"""
+import asyncio
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher, ScryptPasswordHasher, make_password, verify_password,
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    scrypt with the cost from ``PICME_SCRYPT_*``. Stored hashes keep their
+    own parameters, so raising the cost only affects new and rehashed ones.
+    """
+
+    @property
+    def work_factor(self):
+        return settings.PICME_SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.PICME_SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.PICME_SCRYPT_PARALLELISM
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        self._check_encode_args(password, salt)
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = hashlib.scrypt(
+            password.encode(),
+            salt=salt.encode(),
+            n=n,
+            r=r,
+            p=p,
+            # OpenSSL refuses more than 32 MiB by default; allow what the
+            # parameters need (128 * r * (n + p) bytes) plus some headroom
+            maxmem=128 * r * (n + p) + 2 * 1024 * 1024,
+            dklen=64,
+        )
+        hash_ = base64.b64encode(hash_).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash_)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with ``PICME_PBKDF2_ITERATIONS`` (Django's default if 0).
+    """
+
+    @property
+    def iterations(self):
+        return settings.PICME_PBKDF2_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+def hash_executor():
+    """
+    Return the dedicated hashing pool, or None to use the event loop's
+    default executor (``PICME_PASSWORD_HASH_THREADS = 0``).
+    """
+    global _executor
+    if settings.PICME_PASSWORD_HASH_THREADS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PICME_PASSWORD_HASH_THREADS,
+                thread_name_prefix='picme-hash',
+            )
+    return _executor
+
+
+async def acheck_password(user, raw_password):
+    """
+    Async ``user.check_password()`` that hashes in the thread pool and
+    stores an upgraded hash when the preferred hasher or its cost changed.
+    Returns ``(is_correct, rehashed)``.
+    """
+    loop = asyncio.get_running_loop()
+    is_correct, must_update = await loop.run_in_executor(
+        hash_executor(), verify_password, raw_password, user.password,
+    )
+    if not (is_correct and must_update):
+        return is_correct, False
+    user.password = await loop.run_in_executor(hash_executor(), make_password, raw_password)
+    await user.asave(update_fields=['password'])
+    return True, True
+
+
+async def amake_password(raw_password):
+    """``make_password()`` in the hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor(), make_password, raw_password)
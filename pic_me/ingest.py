@@ -0,0 +1,155 @@
+"""
+Bounded decoding of untrusted images.
+
+A file extension says nothing about what decoding the file costs: a small
+PNG can declare 20000x20000 pixels, a GIF thousands of frames. Code that
+decodes uploads goes through this module:
+
+- ``inspect()`` reads only the header and, for GIFs, walks the frame
+  blocks without decompressing them. It rejects files over the byte, pixel
+  or frame limits (``PICME_IMAGE_MAX_BYTES``, ``PICME_IMAGE_MAX_PIXELS``,
+  ``PICME_IMAGE_MAX_FRAMES``) with ``ImageRejected``.
+- ``open_image()`` inspects a file, then opens it for decoding. When only a
+  smaller size is needed it asks the JPEG decoder for a reduced scale
+  (``draft()``), so a decode holds one frame of at most the pixel limit.
+- ``validate_image_file`` applies the same checks as a model field
+  validator, so forms reject such files before they are stored.
+
+Only the JPEG, PNG and GIF decoders are enabled. ``PicMeConfig.ready()``
+also lowers Pillow's own decompression bomb limit to the pixel limit, for
+any decode that bypasses this module.
+"""
+import os
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from PIL import Image, UnidentifiedImageError
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF')
+
+ImageInfo = namedtuple('ImageInfo', 'format width height frames size')
+
+
+class ImageRejected(ValueError):
+    """The file is not an allowed image, or decoding it would exceed a limit."""
+
+
+def _file_size(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    return fileobj.tell()
+
+
+def _skip_sub_blocks(fileobj):
+    while True:
+        length = fileobj.read(1)
+        if not length or length == b'\0':
+            return
+        fileobj.seek(length[0], os.SEEK_CUR)
+
+
+def _color_table_size(flags):
+    return 3 << ((flags & 0x07) + 1) if flags & 0x80 else 0
+
+
+def _scan_gif(fileobj, max_frames, max_pixels):
+    """
+    Count the frames of a GIF by skipping over their data, checking each
+    frame's size on the way. Stops once the frame limit is exceeded.
+    """
+    # Header (6 bytes), logical screen width and height, then its flags
+    fileobj.seek(10)
+    flags = fileobj.read(3)[:1]
+    if not flags:
+        raise ImageRejected('The GIF is truncated.')
+    fileobj.seek(_color_table_size(flags[0]), os.SEEK_CUR)
+
+    frames = 0
+    while True:
+        introducer = fileobj.read(1)
+        if introducer == b'!':
+            # Extension: label, then data sub-blocks
+            fileobj.read(1)
+            _skip_sub_blocks(fileobj)
+        elif introducer == b',':
+            descriptor = fileobj.read(9)
+            if len(descriptor) < 9:
+                break
+            width = int.from_bytes(descriptor[4:6], 'little')
+            height = int.from_bytes(descriptor[6:8], 'little')
+            if width * height > max_pixels:
+                raise ImageRejected(f'A frame is {width}x{height} pixels; the limit is {max_pixels} pixels.')
+            fileobj.seek(_color_table_size(descriptor[8]) + 1, os.SEEK_CUR)
+            _skip_sub_blocks(fileobj)
+            frames += 1
+            if frames > max_frames:
+                raise ImageRejected(f'The image has more than {max_frames} frames.')
+        else:
+            # Trailer, end of file or trailing garbage, where decoders stop too
+            break
+    return frames
+
+
+def inspect(fileobj):
+    """
+    Check an image file against the limits without decoding its pixels.
+    Returns an ``ImageInfo`` and leaves the file at its start.
+    """
+    size = _file_size(fileobj)
+    if size > settings.PICME_IMAGE_MAX_BYTES:
+        raise ImageRejected(f'The file is {size} bytes; the limit is {settings.PICME_IMAGE_MAX_BYTES} bytes.')
+    fileobj.seek(0)
+    try:
+        image = Image.open(fileobj, formats=ALLOWED_FORMATS)
+    except UnidentifiedImageError as exc:
+        raise ImageRejected('The file is not a JPEG, PNG or GIF image.') from exc
+    except Image.DecompressionBombError as exc:
+        raise ImageRejected(str(exc)) from exc
+
+    max_pixels = settings.PICME_IMAGE_MAX_PIXELS
+    max_frames = settings.PICME_IMAGE_MAX_FRAMES
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageRejected(f'The image is {width}x{height} pixels; the limit is {max_pixels} pixels.')
+    if image.format == 'GIF':
+        frames = _scan_gif(fileobj, max_frames, max_pixels)
+    else:
+        # APNG declares its frame count in the header
+        frames = getattr(image, 'n_frames', 1)
+        if frames > max_frames:
+            raise ImageRejected(f'The image has {frames} frames; the limit is {max_frames}.')
+    fileobj.seek(0)
+    return ImageInfo(image.format, width, height, frames, size)
+
+
+def open_image(fileobj, draft=None):
+    """
+    Inspect an image file and open it for decoding.
+
+    Args:
+        fileobj: A seekable binary file
+        draft: Optional ``(mode, (width, height))``; JPEGs are then decoded
+               at the smallest scale still covering that size
+    """
+    inspect(fileobj)
+    image = Image.open(fileobj, formats=ALLOWED_FORMATS)
+    if draft and image.format == 'JPEG':
+        image.draft(*draft)
+    return image
+
+
+def validate_image_file(value):
+    """
+    Model field validator applying ``inspect()`` to new uploads.
+    """
+    if getattr(value, '_committed', True):
+        # Already stored, and checked when it was uploaded
+        return
+    fileobj = value.file
+    position = fileobj.tell()
+    try:
+        inspect(fileobj)
+    except (ImageRejected, OSError) as exc:
+        raise ValidationError(str(exc), code='image_rejected') from exc
+    finally:
+        fileobj.seek(position)
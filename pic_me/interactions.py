@@ -0,0 +1,206 @@
+"""
+Batched like/dislike writes.
+
+``apply_operations()`` takes a list of ``(photo_id, interaction_type)``
+operations from one user and gives them the same toggle/flip semantics as
+``PhotoInteraction.toggle()``. Repeated operations on one photo are folded
+into a single final state first. The final states are then written in one
+transaction:
+- one lock on the rows of the users involved (see ``lock_users()``)
+- one locking read of the existing rows
+- one bulk upsert
+- one bulk delete
+- one UPDATE adjusting every affected photo's counters (and its fragment
+  version, since bulk writes skip the signals), and one for their scores
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import fragments, scores
+
+INTERACTION_TYPES = ('like', 'dislike')
+
+
+class InvalidOperation(ValueError):
+    """An operation names an unknown photo or interaction type."""
+
+
+def photo_id(value):
+    """
+    Validate a photo id from a request: an integer (or a string of digits)
+    that fits the primary key column.
+    """
+    from .models import Photo
+
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidOperation(f'Invalid photo id {value!r}.')
+    _, largest = connection.ops.integer_field_range(Photo._meta.pk.get_internal_type())
+    if not 1 <= value <= largest:
+        raise InvalidOperation(f'Invalid photo id {value!r}.')
+    return value
+
+
+def fold(state, interaction_types):
+    """
+    Apply toggle semantics to a state: repeating the current type clears
+    it, any other type replaces it.
+    """
+    for interaction_type in interaction_types:
+        state = None if state == interaction_type else interaction_type
+    return state
+
+
+def lock_users(user_ids):
+    """
+    Lock the rows of the given users until the end of the transaction.
+
+    Every write of interactions takes this lock first. ``select_for_update()``
+    cannot lock interaction rows that do not exist yet, and an upsert cannot
+    tell an insert from an update, so without it two writers could both
+    count the same new like. Rows are locked in id order to avoid deadlocks.
+    """
+    from django.contrib.auth import get_user_model
+
+    list(
+        get_user_model().objects.select_for_update()
+        .filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def _locked_states(keys):
+    from .models import PhotoInteraction
+
+    user_ids = {user_id for user_id, _ in keys}
+    photo_ids = {photo_id for _, photo_id in keys}
+    lock_users(user_ids)
+    rows = (
+        PhotoInteraction.objects
+        .select_for_update()
+        .filter(user_id__in=user_ids, photo_id__in=photo_ids)
+        .values_list('user_id', 'photo_id', 'interaction_type')
+    )
+    return {(user_id, photo_id): state for user_id, photo_id, state in rows if (user_id, photo_id) in keys}
+
+
+def _counter_expression(field, deltas):
+    whens = [When(pk=photo_id, then=Value(delta)) for photo_id, delta in deltas.items() if delta]
+    if not whens:
+        return F(field)
+    return F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def apply_states(states, current=None):
+    """
+    Write final interaction states.
+
+    Args:
+        states: Dict mapping ``(user_id, photo_id)`` to 'like', 'dislike'
+                or None (no interaction). Writing the same states twice is
+                a no-op.
+        current: The existing states of those keys, if the caller already
+                 read them with ``_locked_states()`` in this transaction
+
+    Returns:
+        The ids of the photos whose counters changed
+    """
+    from .models import Photo, PhotoInteraction
+
+    if not states:
+        return []
+    with transaction.atomic():
+        if current is None:
+            current = _locked_states(set(states))
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        upserts = []
+        deletes = []
+        for (user_id, photo_id), state in states.items():
+            old = current.get((user_id, photo_id))
+            if old == state:
+                continue
+            if old:
+                deltas[photo_id][old] -= 1
+            if state:
+                deltas[photo_id][state] += 1
+                upserts.append(PhotoInteraction(user_id=user_id, photo_id=photo_id, interaction_type=state))
+            else:
+                deletes.append((user_id, photo_id))
+
+        if upserts:
+            PhotoInteraction.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=['user', 'photo'],
+                update_fields=['interaction_type'],
+            )
+        if deletes:
+            by_user = defaultdict(list)
+            for user_id, photo_id in deletes:
+                by_user[user_id].append(photo_id)
+            for user_id, photo_ids in by_user.items():
+                PhotoInteraction.objects.filter(user_id=user_id, photo_id__in=photo_ids).delete()
+
+        changed = [photo_id for photo_id, delta in deltas.items() if any(delta.values())]
+        if changed:
+            Photo.objects.filter(pk__in=changed).update(
+                cache_version=fragments.bumped('cache_version'),
+                updated_at=timezone.now(),
+                **{
+                    field: _counter_expression(
+                        field, {photo_id: deltas[photo_id][interaction_type] for photo_id in changed}
+                    )
+                    for interaction_type, field in Photo.COUNTER_FIELDS.items()
+                }
+            )
+            scores.record({photo_id: deltas[photo_id] for photo_id in changed})
+    return changed
+
+
+def apply_operations(user, operations):
+    """
+    Apply a user's ``(photo_id, interaction_type)`` operations in order.
+
+    Returns:
+        Dict mapping each photo id to ``{'interaction', 'like_count',
+        'dislike_count'}`` after the batch
+
+    Raises:
+        InvalidOperation: If an interaction type or photo id is invalid or
+                          unknown; nothing is written in that case
+    """
+    from .models import Photo
+
+    ops_by_photo = defaultdict(list)
+    for value, interaction_type in operations:
+        if interaction_type not in INTERACTION_TYPES:
+            raise InvalidOperation(f'Unknown interaction type {interaction_type!r}.')
+        ops_by_photo[photo_id(value)].append(interaction_type)
+
+    with transaction.atomic():
+        existing = set(Photo.objects.filter(pk__in=ops_by_photo).values_list('pk', flat=True))
+        missing = sorted(set(ops_by_photo) - existing)
+        if missing:
+            raise InvalidOperation(f'Unknown photo ids: {missing}.')
+
+        keys = {(user.pk, photo_id) for photo_id in ops_by_photo}
+        current = _locked_states(keys)
+        states = {
+            (user.pk, photo_id): fold(current.get((user.pk, photo_id)), types)
+            for photo_id, types in ops_by_photo.items()
+        }
+        apply_states(states, current)
+        counts = Photo.objects.filter(pk__in=ops_by_photo).values_list('pk', 'like_count', 'dislike_count')
+
+        return {
+            pk: {
+                'interaction': states[(user.pk, pk)],
+                'like_count': like_count,
+                'dislike_count': dislike_count,
+            }
+            for pk, like_count, dislike_count in counts
+        }
@@ -0,0 +1,161 @@
+"""
+Database-backed background job queue.
+
+Jobs are rows in ``pic_me_job`` and work on SQLite and PostgreSQL without an
+external broker. A worker (``manage.py run_worker``) claims due jobs with a
+conditional UPDATE, which makes the claim atomic: only one worker can move a
+row from its observed state to ``running``. A claim is leased for
+``PICME_JOB_VISIBILITY_TIMEOUT`` seconds; if the worker dies, the job becomes
+claimable again once the lease expires. Failed jobs are retried with
+exponential backoff until ``max_attempts`` is reached.
+"""
+import importlib
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Modules that register job handlers; imported lazily by get_handler()
+HANDLER_MODULES = ['pic_me.tasks']
+
+_handlers = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job can never succeed."""
+
+
+def job_handler(kind):
+    """
+    Register the decorated function as the handler for jobs of ``kind``.
+    The handler is called with the job payload as keyword arguments.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def get_handler(kind):
+    if kind not in _handlers:
+        for module in HANDLER_MODULES:
+            importlib.import_module(module)
+    return _handlers[kind]
+
+
+def enqueue(kind, delay=0, max_attempts=None, **payload):
+    """
+    Add a job to the queue and return it.
+
+    The row is written in the caller's transaction, so a job enqueued while
+    saving a model only becomes visible to workers once that save commits.
+    """
+    from .models import Job
+
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.PICME_JOB_MAX_ATTEMPTS,
+    )
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before the next attempt: exponential backoff with jitter.
+    """
+    base = settings.PICME_JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    delay = min(base, settings.PICME_JOB_MAX_BACKOFF)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Lease up to ``limit`` due jobs for ``worker_id`` and return their IDs.
+
+    A job is due when it is queued and its ``run_after`` has passed, or when
+    it is running but its lease (visibility timeout) has expired.
+    """
+    from .models import Job
+
+    now = timezone.now()
+    candidates = (
+        Job.objects
+        .filter(
+            Q(status=Job.STATUS_QUEUED, run_after__lte=now) |
+            Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+        )
+        .order_by('run_after', 'id')
+        .values('id', 'status', 'locked_until')[:limit * 2]
+    )
+
+    claimed = []
+    lease = now + timedelta(seconds=settings.PICME_JOB_VISIBILITY_TIMEOUT)
+    for candidate in candidates:
+        updated = Job.objects.filter(
+            pk=candidate['id'],
+            status=candidate['status'],
+            locked_until=candidate['locked_until'],
+        ).update(
+            status=Job.STATUS_RUNNING,
+            locked_by=worker_id,
+            locked_until=lease,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if updated:
+            claimed.append(candidate['id'])
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def run_job(job_id, worker_id):
+    """
+    Execute a claimed job and record its outcome.
+
+    Outcomes are only written while the worker still holds the lease, so a
+    job that timed out and was re-claimed elsewhere is not overwritten.
+    """
+    from .models import Job
+
+    job = Job.objects.get(pk=job_id)
+    owned = Job.objects.filter(pk=job_id, status=Job.STATUS_RUNNING, locked_by=worker_id)
+
+    if job.attempts > job.max_attempts:
+        owned.update(status=Job.STATUS_FAILED, locked_until=None, finished_at=timezone.now(),
+                     last_error='Lease expired too many times.')
+        return Job.STATUS_FAILED
+
+    try:
+        handler = get_handler(job.kind)
+    except KeyError:
+        owned.update(status=Job.STATUS_FAILED, locked_until=None, finished_at=timezone.now(),
+                     last_error=f'No handler registered for {job.kind!r}.')
+        return Job.STATUS_FAILED
+
+    try:
+        handler(**job.payload)
+    except Exception as exc:
+        error = traceback.format_exc()
+        permanent = isinstance(exc, PermanentJobError) or job.attempts >= job.max_attempts
+        if permanent:
+            logger.error('Job %s (%s) failed permanently: %s', job_id, job.kind, exc)
+            owned.update(status=Job.STATUS_FAILED, locked_until=None, finished_at=timezone.now(),
+                         last_error=error)
+            return Job.STATUS_FAILED
+
+        delay = retry_delay(job.attempts)
+        logger.warning('Job %s (%s) failed, retrying in %.0fs: %s', job_id, job.kind, delay, exc)
+        owned.update(status=Job.STATUS_QUEUED, locked_until=None, last_error=error,
+                     run_after=timezone.now() + timedelta(seconds=delay))
+        return Job.STATUS_QUEUED
+
+    owned.update(status=Job.STATUS_DONE, locked_until=None, finished_at=timezone.now(), last_error='')
+    return Job.STATUS_DONE
@@ -0,0 +1,332 @@
+import http.cookiejar
+import json
+import math
+import platform
+import random
+import re
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import ExitStack
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from pic_me import interactions
+from pic_me.models import Photo, Tag
+
+SCENARIOS = ('home', 'home_tag', 'home_search', 'photo_detail', 'user_login', 'interact_photo')
+
+PASSWORD = 'benchmark-password'
+
+WORDS = (
+    'sunset', 'harbor', 'forest', 'city', 'portrait', 'mountain', 'river', 'street',
+    'winter', 'market', 'garden', 'bridge', 'desert', 'night', 'coast', 'festival',
+)
+
+# Written by QueryBudgetMiddleware, which also runs behind a real server
+SERVER_TIMING_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+class TestClientDriver:
+    """
+    Requests through Django's test client, in this process.
+    """
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None):
+        if method == 'POST':
+            response = self.client.post(path, data or {})
+        else:
+            response = self.client.get(path)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpDriver:
+    """
+    Requests over HTTP to a running server (e.g. gunicorn), with cookies
+    and the CSRF token handled like a browser.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect())
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return ''
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        body = None
+        headers = {}
+        if method == 'POST':
+            body = urllib.parse.urlencode(data or {}).encode()
+            headers = {
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'X-CSRFToken': self._csrf_token(),
+                'Referer': url,
+            }
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code, exc.headers.get('Server-Timing', '')
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, query_counts, db_times, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': count / elapsed if elapsed else None,
+        'mean_ms': sum(latencies) / count * 1000 if count else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if count else None,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if count else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if count else None,
+        'queries_mean': sum(query_counts) / len(query_counts) if query_counts else None,
+        'queries_max': max(query_counts) if query_counts else None,
+        'db_ms_mean': sum(db_times) / len(db_times) if db_times else None,
+    }
+
+
+def seed(options, rng):
+    """
+    Create the synthetic dataset in the current database.
+    """
+    UserModel = get_user_model()
+    # One hash for everyone: seeding should not spend minutes in scrypt,
+    # but logins still verify at the configured cost. Users and tags of an
+    # earlier run against the same database are reused.
+    password = make_password(PASSWORD)
+    UserModel.objects.bulk_create([
+        UserModel(email=f'bench{i}@example.com', username=f'bench{i}', password=password)
+        for i in range(options['users'])
+    ], ignore_conflicts=True)
+    users = list(UserModel.objects.filter(username__startswith='bench').order_by('pk'))
+
+    Tag.objects.bulk_create([
+        Tag(name=f'{WORDS[i % len(WORDS)].title()} {i}', slug=f'bench-{i}')
+        for i in range(options['tags'])
+    ], ignore_conflicts=True)
+    tags = list(Tag.objects.filter(slug__startswith='bench-'))
+
+    photos = []
+    for i in range(options['photos']):
+        words = rng.sample(WORDS, 3)
+        photos.append(Photo.create_with_placeholder(
+            title=' '.join(words[:2]).title(),
+            description=f'A {words[2]} photo.',
+            uploaded_by=rng.choice(users),
+            # Distinct colors, so content-addressed storage keeps one file each
+            color=(i % 256, (i // 256) % 256, 128),
+            tags=rng.sample(tags, min(len(tags), rng.randint(1, 3))),
+        ))
+
+    states = {}
+    pairs = len(users) * len(photos)
+    while len(states) < min(options['interactions'], pairs):
+        key = (rng.choice(users).pk, rng.choice(photos).pk)
+        states[key] = rng.choice(interactions.INTERACTION_TYPES)
+    items = list(states.items())
+    for start in range(0, len(items), 500):
+        interactions.apply_states(dict(items[start:start + 500]))
+
+    return {
+        'emails': [user.email for user in users],
+        'tags': [tag.slug for tag in tags],
+        'photos': [photo.pk for photo in photos],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic dataset and measure latency, throughput and query counts of the gallery, '
+        'photo detail, login and like paths. Writes JSON for comparing runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--photos', type=int, default=200)
+        parser.add_argument('--interactions', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per scenario (default: 100).')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario (default: 10).')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+                            help='Run only this scenario (repeatable; default: all).')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for reproducible datasets.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--base-url',
+                            help='Drive a running server (e.g. gunicorn) at this URL instead of the test client. '
+                                 'The dataset is then seeded into the configured database, which the server must use.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask before seeding the configured database (with --base-url).')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        scenarios = options['scenarios'] or list(SCENARIOS)
+
+        with ExitStack() as stack:
+            if options['base_url']:
+                if options['interactive']:
+                    answer = input(f"This adds benchmark data to the database {connection.settings_dict['NAME']}. "
+                                   "Type 'yes' to continue: ")
+                    if answer != 'yes':
+                        raise CommandError('Benchmark cancelled.')
+
+                def driver():
+                    return HttpDriver(options['base_url'])
+            else:
+                stack.enter_context(self.isolated_environment())
+                driver = TestClientDriver
+
+            self.stderr.write('Seeding dataset...')
+            started = time.perf_counter()
+            dataset = seed(options, rng)
+            seed_seconds = time.perf_counter() - started
+
+            results = {name: self.run_scenario(name, driver, dataset, rng, options) for name in scenarios}
+            vendor = connection.vendor
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'commit': self.git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': vendor,
+                'driver': options['base_url'] or 'test-client',
+                'password_hasher': settings.PICME_PASSWORD_HASHER,
+                'dataset': {key: options[key] for key in ('users', 'tags', 'photos', 'interactions', 'seed')},
+                'seed_seconds': seed_seconds,
+            },
+            'scenarios': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        for name, result in results.items():
+            self.stderr.write(
+                f"{name:<15} p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  "
+                f"p99 {result['p99_ms']:.1f} ms  {result['throughput_rps']:.1f} req/s  "
+                f"{result['queries_mean'] or 0:.1f} queries  {result['errors']} errors"
+            )
+        self.stderr.write(self.style.SUCCESS(f'Benchmarked {len(results)} scenarios.'))
+
+    def isolated_environment(self):
+        """
+        A throwaway test database, media directory and caches, so the test
+        client run never touches real data.
+        """
+        stack = ExitStack()
+        tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix='picme-benchmark-'))
+        caches = {
+            alias: {**config, 'KEY_PREFIX': f"benchmark:{config.get('KEY_PREFIX', '')}"}
+            for alias, config in settings.CACHES.items()
+        }
+        stack.enter_context(override_settings(
+            MEDIA_ROOT=tmp,
+            CACHES=caches,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            PICME_INTERACTION_JOURNAL_DIR=f'{tmp}/journal',
+            # Image processing is not what is measured; leave it to the queue
+            PICME_ASYNC_IMAGE_PROCESSING=True,
+        ))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        stack.callback(connection.creation.destroy_test_db, old_name, verbosity=0)
+        return stack
+
+    def run_scenario(self, name, driver, dataset, rng, options):
+        client = driver()
+        if name != 'user_login':
+            self.log_in(client, rng.choice(dataset['emails']))
+
+        def next_request():
+            if name == 'home':
+                return client, 'GET', '/', None
+            if name == 'home_tag':
+                return client, 'GET', f"/?tag={rng.choice(dataset['tags'])}", None
+            if name == 'home_search':
+                return client, 'GET', f'/?search={rng.choice(WORDS)}', None
+            if name == 'photo_detail':
+                return client, 'GET', f"/photo/{rng.choice(dataset['photos'])}/", None
+            if name == 'interact_photo':
+                data = {'interaction_type': rng.choice(interactions.INTERACTION_TYPES)}
+                return client, 'POST', f"/photo/{rng.choice(dataset['photos'])}/interact/", data
+            # A fresh anonymous client per login; fetching the form for the
+            # CSRF cookie is not measured
+            fresh = driver()
+            fresh.request('GET', '/login/')
+            data = {'email': rng.choice(dataset['emails']), 'password': PASSWORD}
+            return fresh, 'POST', '/login/', data
+
+        latencies, query_counts, db_times = [], [], []
+        errors = 0
+        elapsed = 0.0
+        for i in range(options['warmup'] + options['requests']):
+            request_client, method, path, data = next_request()
+            started = time.perf_counter()
+            status, server_timing = request_client.request(method, path, data)
+            duration = time.perf_counter() - started
+            if i < options['warmup']:
+                continue
+            elapsed += duration
+            latencies.append(duration)
+            if status >= 400:
+                errors += 1
+            timing = SERVER_TIMING_RE.search(server_timing)
+            if timing:
+                db_times.append(float(timing.group(1)))
+                query_counts.append(int(timing.group(2)))
+        return summarize(latencies, query_counts, db_times, errors, elapsed)
+
+    def log_in(self, client, email):
+        client.request('GET', '/login/')
+        status, _ = client.request('POST', '/login/', {'email': email, 'password': PASSWORD})
+        if status != 302:
+            raise CommandError(f'Could not log in as {email} (status {status}).')
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pic_me import sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions from the database in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PICME_SESSION_CLEANUP_BATCH,
+                            help='Sessions deleted per statement (default: PICME_SESSION_CLEANUP_BATCH).')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        deleted = sessions.delete_expired(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions.'))
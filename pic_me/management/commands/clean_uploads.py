@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pic_me import uploads
+from pic_me.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions (and their part files) that received no data for a while.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.PICME_UPLOAD_SESSION_TTL,
+                            help='Seconds since the last chunk (default: PICME_UPLOAD_SESSION_TTL).')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['max_age'])
+        deleted = 0
+        for session_id in UploadSession.objects.filter(updated_at__lt=cutoff).values_list('pk', flat=True):
+            uploads.discard(session_id)
+            UploadSession.objects.filter(pk=session_id).delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stale upload sessions.'))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from pic_me import storage
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media files that are no longer referenced by any photo or profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help='Only delete blobs unreferenced for at least this long (default: 60).')
+
+    def handle(self, *args, **options):
+        deleted = storage.collect(grace=timedelta(minutes=options['grace_minutes']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unused blobs.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pic_me import scores
+
+
+class Command(BaseCommand):
+    help = 'Move the trending score epoch to now and rescale every score to it (run daily).'
+
+    def handle(self, *args, **options):
+        rescaled = scores.compact()
+        self.stdout.write(self.style.SUCCESS(f'Rescaled {rescaled} trending scores.'))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pic_me import fragments, storage
+from pic_me.models import Photo, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Move existing photos and profile pictures to content-addressed names, storing duplicates once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true',
+                            help='Delete the old files once every row has been moved.')
+
+    def handle(self, *args, **options):
+        originals = set()
+        moved = 0
+        for model, field in ((Photo, 'image'), (UserProfile, 'profile_picture')):
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).order_by('pk')
+            for instance in rows.iterator():
+                field_file = getattr(instance, field)
+                old_name = field_file.name
+                if storage.CONTENT_NAME_RE.match(old_name.rsplit('/', 1)[-1]):
+                    continue
+                if not field_file.storage.exists(old_name):
+                    self.stderr.write(f'{model.__name__} {instance.pk}: {old_name} is missing, skipped')
+                    continue
+                with field_file.open('rb') as f:
+                    new_name = field_file.storage.save(old_name, f)
+
+                update = {field: new_name}
+                renditions = getattr(instance, 'renditions', None)
+                if renditions and renditions.get('source') == old_name:
+                    # Same content under a new name: the renditions still apply
+                    update['renditions'] = dict(renditions, source=new_name)
+                with transaction.atomic():
+                    model.objects.filter(pk=instance.pk).update(**update)
+                    storage.retain(new_name)
+                    if 'renditions' in update:
+                        storage.record_renditions(new_name, update['renditions'])
+                if model is Photo:
+                    fragments.bump_photos([instance.pk])
+
+                originals.add(old_name)
+                moved += 1
+                self.stdout.write(f'{model.__name__} {instance.pk}: {old_name} -> {new_name}')
+
+        if options['delete_originals']:
+            for name in sorted(originals):
+                storage.content_addressed_storage.delete(name)
+            self.stdout.write(f'Deleted {len(originals)} original files.')
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} files.'))
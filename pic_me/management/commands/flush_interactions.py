@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pic_me import writebehind
+
+
+class Command(BaseCommand):
+    help = 'Replay interaction journal segments left behind by crashed processes.'
+
+    def handle(self, *args, **options):
+        replayed = writebehind.replay_orphans()
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} buffered interactions.'))
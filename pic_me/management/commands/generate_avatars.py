@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from pic_me.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Generate the square avatar crops of profile pictures that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate even if the avatars are up to date.')
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True).order_by('pk')
+
+        generated = 0
+        for profile in profiles.iterator():
+            if not options['force'] and profile.avatars.get('source') == profile.profile_picture.name:
+                continue
+            profile.refresh_avatars()
+            generated += 1
+            self.stdout.write(f'Generated avatars for profile {profile.pk}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {generated} profiles.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from pic_me.models import Photo
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail/resized renditions for photos that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Only process these photo IDs.')
+        parser.add_argument('--force', action='store_true', help='Regenerate even if renditions are up to date.')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.all().order_by('pk')
+        if options['ids']:
+            photos = photos.filter(pk__in=options['ids'])
+
+        generated = 0
+        for photo in photos.iterator():
+            if not options['force'] and photo.renditions.get('source') == photo.image.name:
+                continue
+            photo.refresh_renditions()
+            generated += 1
+            self.stdout.write(f'Generated renditions for photo {photo.pk}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {generated} photos.'))
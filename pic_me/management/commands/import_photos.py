@@ -0,0 +1,255 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+def _init_process():
+    # Spawned pool processes need Django set up before touching models/storage
+    django.setup()
+
+
+def _prepare(item):
+    """
+    Validate, strip, hash and store one image and build its renditions.
+    Runs in a pool process; returns the item with ``image``, ``hash`` and
+    ``renditions`` set, or with ``error`` on failure.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    from pic_me import ingest, renditions, similarity, storage
+    from pic_me.models import Photo
+    from pic_me.tasks import strip_metadata
+
+    field = Photo._meta.get_field('image')
+    try:
+        with open(item['path'], 'rb') as f:
+            ingest.inspect(f)
+            Image.open(f).verify()
+            f.seek(0)
+            stripped = strip_metadata(f)
+            f.seek(0)
+            image_hash = similarity.hash_file(f)
+            f.seek(0)
+            content = ContentFile(stripped) if stripped is not None else File(f)
+            name = field.storage.save(field.generate_filename(None, os.path.basename(item['path'])), content)
+    except (OSError, SyntaxError, ValueError, UnidentifiedImageError, Image.DecompressionBombError) as exc:
+        return dict(item, error=str(exc))
+
+    known = storage.known_renditions(name)
+    if not known:
+        try:
+            known = renditions.generate_renditions(field.attr_class(None, field, name))
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            return dict(item, error=f'renditions failed: {exc}')
+    return dict(item, image=name, hash=image_hash, renditions=known)
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Import photos from a directory or a CSV/JSON-lines manifest. Images are validated, '
+        'stripped of EXIF and turned into renditions in a process pool; rows are written with bulk inserts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory to scan, or a .csv/.jsonl manifest with path, title, '
+                                           'description and tags columns (paths relative to the manifest).')
+        parser.add_argument('--user', required=True, help='Username or email of the uploader.')
+        parser.add_argument('--tag', action='append', default=[], help='Tag added to every photo (repeatable).')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Number of decoding processes (default: CPU count).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Photos written per transaction (default: 500).')
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help='Skip images whose content is already used by a photo.')
+
+    def handle(self, *args, **options):
+        from pic_me.models import Photo
+
+        User = get_user_model()
+        user = User.objects.filter(Q(username=options['user']) | Q(email=options['user'])).first()
+        if user is None:
+            raise CommandError(f"No user {options['user']!r}.")
+
+        items = list(self.read_items(options['source'], options['tag']))
+        if not items:
+            self.stdout.write('Nothing to import.')
+            return
+
+        processes = max(options['processes'], 1)
+        batch_size = max(options['batch_size'], 1)
+        self.tag_ids = {}
+        self.tags_created = False
+        imported = failed = skipped = 0
+        started = time.monotonic()
+
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_process,
+        )
+        try:
+            results = pool.map(_prepare, items, chunksize=max(1, min(32, batch_size // (processes * 4))))
+            for batch in _batches(results, batch_size):
+                for result in batch:
+                    if 'error' in result:
+                        failed += 1
+                        self.stderr.write(f"{result['path']}: {result['error']}")
+                batch = [result for result in batch if 'error' not in result]
+                if options['skip_duplicates'] and batch:
+                    used = set(Photo.objects.filter(image__in=[r['image'] for r in batch])
+                               .values_list('image', flat=True))
+                    skipped += sum(1 for r in batch if r['image'] in used)
+                    batch = [r for r in batch if r['image'] not in used]
+                imported += self.write_batch(batch, user)
+
+                done = imported + failed + skipped
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{done}/{len(items)} processed, {imported} imported '
+                                  f'({imported / elapsed:.0f} rows/s)')
+        finally:
+            pool.shutdown(wait=True)
+
+        if self.tags_created:
+            from pic_me import fragments
+            fragments.bump_version(fragments.TAGS_VERSION)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} photos in {elapsed:.1f}s ({imported / elapsed:.0f} rows/s); '
+            f'{failed} failed, {skipped} skipped.'
+        ))
+
+    def read_items(self, source, extra_tags):
+        """
+        Yield ``{'path', 'title', 'description', 'tags'}`` dicts for every
+        image in a directory or manifest.
+        """
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        stem = os.path.splitext(filename)[0]
+                        yield {
+                            'path': os.path.join(root, filename),
+                            'title': stem.replace('_', ' ').replace('-', ' ').strip().capitalize()[:200],
+                            'description': '',
+                            'tags': list(extra_tags),
+                        }
+            return
+
+        if not os.path.isfile(source):
+            raise CommandError(f'{source} is neither a directory nor a manifest file.')
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='', encoding='utf-8') as f:
+            if source.lower().endswith('.csv'):
+                rows = csv.DictReader(f)
+            elif source.lower().endswith(('.jsonl', '.ndjson')):
+                rows = (json.loads(line) for line in f if line.strip())
+            else:
+                raise CommandError('Manifests must be .csv or .jsonl files.')
+            for row in rows:
+                tags = row.get('tags') or []
+                if isinstance(tags, str):
+                    tags = tags.split(',')
+                path = os.path.join(base, row['path'])
+                yield {
+                    'path': path,
+                    'title': (row.get('title') or os.path.splitext(os.path.basename(path))[0])[:200],
+                    'description': row.get('description') or '',
+                    'tags': [tag.strip() for tag in tags if tag.strip()] + list(extra_tags),
+                }
+
+    def resolve_tags(self, names):
+        """
+        Map tag names to ids, creating missing tags with one bulk insert.
+        """
+        from pic_me.models import Tag
+
+        missing = {name for name in names if name not in self.tag_ids}
+        if missing:
+            self.tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+            missing -= self.tag_ids.keys()
+        if missing:
+            Tag.objects.bulk_create(
+                [Tag(name=name[:50], slug=slugify(name)[:50] or 'tag') for name in sorted(missing)],
+                ignore_conflicts=True,
+            )
+            self.tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+            for name in sorted(missing - self.tag_ids.keys()):
+                # Slug taken by a differently spelled tag
+                tag = Tag(name=name[:50], slug=f'{slugify(name)[:40] or "tag"}-{len(self.tag_ids)}')
+                tag.save()
+                self.tag_ids[name] = tag.pk
+            self.tags_created = True
+        return self.tag_ids
+
+    def write_batch(self, batch, user):
+        """
+        Insert one batch of prepared photos, their tags, tag counts, blob
+        references, search documents, score rows and perceptual hashes in a
+        single transaction.
+        ``bulk_create`` skips ``Photo.save()`` and signals, so their side
+        effects are applied here.
+        """
+        from pic_me import facets, scores, search, storage
+        from pic_me.models import Photo, PhotoHash
+
+        if not batch:
+            return 0
+        with transaction.atomic():
+            tag_ids = self.resolve_tags({name[:50] for item in batch for name in item['tags']})
+            photos = Photo.objects.bulk_create([
+                Photo(
+                    title=item['title'],
+                    description=item['description'],
+                    image=item['image'],
+                    renditions=item['renditions'],
+                    uploaded_by=user,
+                )
+                for item in batch
+            ])
+            photo_tags = {
+                photo.pk: {tag_ids[name[:50]] for name in item['tags']}
+                for photo, item in zip(photos, batch)
+            }
+            Through = Photo.tags.through
+            Through.objects.bulk_create(
+                [
+                    Through(photo_id=photo_id, tag_id=tag_id)
+                    for photo_id, photo_tag_ids in photo_tags.items()
+                    for tag_id in photo_tag_ids
+                ],
+                ignore_conflicts=True,
+            )
+            facets.record({}, photo_tags)
+            storage.retain_many(photo.image.name for photo in photos)
+            storage.record_processed_many({item['image']: item['renditions'] for item in batch})
+            search.index_photos([photo.pk for photo in photos])
+            scores.ensure([photo.pk for photo in photos])
+            PhotoHash.objects.bulk_create([
+                PhotoHash(photo_id=photo.pk, **PhotoHash.fields_for(item['hash'], item['image']))
+                for photo, item in zip(photos, batch)
+            ])
+        return len(photos)
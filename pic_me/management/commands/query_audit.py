@@ -0,0 +1,185 @@
+import re
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from pic_me import search
+from pic_me.models import CustomUser, Photo, Tag
+from pic_me.pagination import encode_cursor
+
+# A full pass over a table in EXPLAIN output: "Seq Scan on pic_me_photo" on
+# PostgreSQL; "SCAN pic_me_photo" on SQLite, which also reports walking a
+# whole index in order as "SCAN pic_me_photo USING INDEX ..." (virtual
+# tables such as the FTS index are not matched)
+SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?\s*$', re.MULTILINE),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)()'),
+}
+
+# Sorting the rows instead of reading them in index order
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'\bUSE TEMP B-TREE FOR (?:RIGHT PART OF |LAST TERM OF )?ORDER BY\b'),
+    'postgresql': re.compile(r'\bSort Key:'),
+}
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN',
+    'postgresql': 'EXPLAIN',
+}
+
+# The gallery page itself, as opposed to the tag, facet and card lookups
+# of the same request
+PAGE_QUERY = re.compile(r'\bFROM "pic_me_photo"(?!\w).*\bORDER BY\b.*\bLIMIT\b', re.DOTALL)
+
+
+def sequential_scans(sql, plan, tables):
+    """
+    Tables (of ``tables``, so not derived tables) the plan reads in full.
+    Walking an index in order is fine for a sliced query, since it stops
+    after the slice.
+    """
+    sliced = re.search(r'\bLIMIT\b', sql) is not None
+    pattern = SCAN_PATTERNS[connection.vendor]
+    return sorted({
+        table for table, index in pattern.findall(plan) if table in tables and not (index and sliced)
+    })
+
+
+def sorts_page(sql, plan):
+    """
+    Whether a gallery page query sorts its matches rather than walking the
+    ordering index, which costs as much as reading every match.
+    """
+    return PAGE_QUERY.search(sql) is not None and SORT_PATTERNS[connection.vendor].search(plan) is not None
+
+
+def audited_requests():
+    """
+    The requests replayed against the views, as ``(label, path, params,
+    login, gallery)``. ``gallery`` marks paged listings in date or score
+    order, whose page query must not sort. Ids, tags and search terms are
+    taken from the data, so the plans are those of a real request.
+    """
+    photo = Photo.objects.order_by('-pk').first()
+    photo_id = photo.pk if photo else 1
+    slugs = list(Tag.objects.order_by('-photo_count', 'name').values_list('slug', flat=True)[:2])
+    slugs = (slugs + ['sample', 'other'])[:2]
+    term = next(iter(search.terms(photo.title) if photo else []), 'sample')
+    new_cursor = encode_cursor([timezone.now().isoformat(), photo_id])
+    score_cursor = encode_cursor([0, photo_id])
+
+    home = reverse('home')
+    api_photos = reverse('api_photo_list')
+    return [
+        ('home: first gallery page', home, {}, False, True),
+        ('home: next gallery page', home, {'cursor': new_cursor}, False, True),
+        ('home: tag filter', home, {'tag': slugs[0]}, False, True),
+        ('home: two tags, all', home, {'tag': slugs}, False, True),
+        ('home: two tags, any', home, {'tag': slugs, 'match': 'any'}, False, True),
+        ('home: search', home, {'search': term}, False, True),
+        ('home: search by relevance', home, {'search': term, 'sort': 'relevance'}, False, False),
+        ('home: trending page', home, {'sort': 'trending'}, False, True),
+        ('home: next top page', home, {'sort': 'top', 'cursor': score_cursor}, False, True),
+        ('home: signed in', home, {}, True, True),
+        ('photo_detail', reverse('photo_detail', args=[photo_id]), {}, True, False),
+        ('profile', reverse('profile'), {}, True, False),
+        ('upload_session', reverse('upload_session', args=[uuid.uuid4()]), {}, True, False),
+        ('api: photos', api_photos, {}, False, True),
+        ('api: photos, next page', api_photos, {'cursor': new_cursor}, False, True),
+        ('api: photos, tag filter', api_photos, {'tag': slugs[0]}, False, True),
+        ('api: photos, search', api_photos, {'search': term}, False, True),
+        ('api: photos, top', api_photos, {'sort': 'top'}, False, True),
+        ('api: photo', reverse('api_photo_detail', args=[photo_id]), {}, False, False),
+        ('api: photo counts', reverse('api_photo_counts', args=[photo_id]), {}, False, False),
+        ('api: tags by count', reverse('api_tag_list'), {'order': 'count', 'limit': 50}, False, False),
+        ('api: tag facets', reverse('api_tag_facets'), {'tag': slugs[0]}, False, False),
+        ('api: tag facets, two tags', reverse('api_tag_facets'), {'tag': slugs}, False, False),
+    ]
+
+
+def captured_queries(client, path, params):
+    """
+    The distinct SELECT statements a request runs, as ``(sql, params)``.
+    """
+    queries = {}
+
+    def capture(execute, sql, sql_params, many, context):
+        if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            queries.setdefault(sql, sql_params)
+        return execute(sql, sql_params, many, context)
+
+    with connection.execute_wrapper(capture):
+        client.get(path, params)
+    return list(queries.items())
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'{EXPLAIN_PREFIXES[connection.vendor]} {sql}', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def table_rows(table):
+    """
+    Row count of a table, estimated from the statistics where available.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return row[0]
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = ('Replay requests against the views, EXPLAIN every query they run and fail if any '
+            'scans a large table sequentially or a gallery page is sorted instead of read in order.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=10000,
+                            help='Only report sequential scans of tables with at least this many rows (default: 10000).')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in SCAN_PATTERNS:
+            raise CommandError(f'Query audit does not support the {connection.vendor} backend.')
+
+        tables = set(connection.introspection.table_names())
+        rows = {}
+        failures = []
+        audited = 0
+        # Sign-ins, sessions and anything else the views write are rolled back
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            user = CustomUser.objects.filter(is_active=True).order_by('pk').first()
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            for label, path, params, login, gallery in audited_requests():
+                if login and user is None:
+                    self.stdout.write(f'{label}: skipped, no user to sign in as')
+                    continue
+                queries = captured_queries(client if login else Client(), path, params)
+                for sql, sql_params in queries:
+                    plan = explain(sql, sql_params)
+                    if options['verbosity'] >= 2:
+                        self.stdout.write(f'{label}:\n{sql}\n{plan}\n')
+                    if gallery and sorts_page(sql, plan):
+                        failures.append(f'{label}: the gallery page is sorted instead of read in index order')
+                    for table in sequential_scans(sql, plan, tables):
+                        if table not in rows:
+                            rows[table] = table_rows(table)
+                        if rows[table] >= options['min_rows']:
+                            failures.append(f'{label}: sequential scan of {table} ({rows[table]} rows)')
+                        else:
+                            self.stdout.write(f'{label}: sequential scan of {table} ({rows[table]} rows, below threshold)')
+                audited += len(queries)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'Audited {audited} queries, no large sequential scans or sorted galleries.'))
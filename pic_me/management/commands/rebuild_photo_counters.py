@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from pic_me import fragments, scores
+from pic_me.models import Photo, PhotoInteraction
+
+
+def counter_subquery(interaction_type):
+    """
+    Correlated subquery counting one interaction type for the outer photo.
+    """
+    counts = (
+        PhotoInteraction.objects
+        .filter(photo=OuterRef('pk'), interaction_type=interaction_type)
+        .order_by()
+        .values('photo')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized like/dislike counters on Photo from PhotoInteraction.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Photo.objects.update(
+                cache_version=fragments.bumped('cache_version'),
+                updated_at=timezone.now(),
+                **{
+                    field: counter_subquery(interaction_type)
+                    for interaction_type, field in Photo.COUNTER_FIELDS.items()
+                }
+            )
+            scores.rebuild_top()
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt counters for {updated} photos.'))
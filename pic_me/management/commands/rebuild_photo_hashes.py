@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from pic_me import similarity
+from pic_me.models import Photo, PhotoHash
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hashes used for near-duplicate detection for photos that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Only process these photo IDs.')
+        parser.add_argument('--force', action='store_true', help='Recompute even if the hash is up to date.')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.only('id', 'image').order_by('pk')
+        if options['ids']:
+            photos = photos.filter(pk__in=options['ids'])
+        if options['force']:
+            PhotoHash.objects.filter(photo__in=photos).delete()
+
+        hashed = failed = 0
+        for photo in photos.iterator():
+            if similarity.ensure_hash(photo) is None:
+                failed += 1
+            else:
+                hashed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} photos; {failed} could not be decoded.'))
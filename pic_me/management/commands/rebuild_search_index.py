@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pic_me import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of photo titles, descriptions and tags.'
+
+    def handle(self, *args, **options):
+        if not search.backend():
+            raise CommandError('No full-text search index is available on this database.')
+
+        with transaction.atomic():
+            indexed = search.rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} photos ({search.backend()}).'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pic_me import facets
+
+
+class Command(BaseCommand):
+    help = 'Recompute the photo count of every tag and the co-occurrence counts of tag pairs from the tag assignments.'
+
+    def handle(self, *args, **options):
+        tags, pairs = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Recounted {tags} tags and {pairs} tag pairs.'))
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pic_me import jobs
+
+
+def _init_process():
+    # Pool processes are spawned, not forked, so they never share the
+    # parent's database connections and need Django set up on their own.
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _execute(job_id, worker_id):
+    close_old_connections()
+    try:
+        return jobs.run_job(job_id, worker_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Process background jobs (image validation, EXIF stripping, renditions) with a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: CPU count).')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when the queue is empty.')
+        parser.add_argument('--max-tasks-per-child', type=int, default=200,
+                            help='Recycle a worker process after this many jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no due jobs are left instead of polling forever.')
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}',
+                            help='Identifier recorded on claimed jobs.')
+
+    def handle(self, *args, **options):
+        processes = max(options['processes'], 1)
+        worker_id = options['worker_id']
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f'Worker {worker_id} started with {processes} processes.')
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_process,
+            max_tasks_per_child=options['max_tasks_per_child'],
+        )
+        inflight = {}
+        completed = 0
+        try:
+            while True:
+                free = processes - len(inflight)
+                if free and not self.stopping:
+                    for job_id in jobs.claim_jobs(worker_id, free):
+                        inflight[pool.submit(_execute, job_id, worker_id)] = job_id
+
+                if not inflight:
+                    if self.stopping or options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(inflight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = inflight.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        # The lease expires and another claim retries the job
+                        self.stderr.write(f'Job {job_id} crashed its worker process: {exc}')
+                        continue
+                    completed += 1
+                    self.stdout.write(f'Job {job_id}: {status}')
+        finally:
+            pool.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} stopped after {completed} jobs.'))
+
+    def _stop(self, signum, frame):
+        self.stopping = True
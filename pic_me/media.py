@@ -0,0 +1,164 @@
+"""
+Helpers for streaming user-uploaded files from MEDIA_ROOT.
+
+Used by ``views.serve_media``. Files are read in fixed-size chunks, so a
+response never holds more than ``CHUNK_SIZE`` bytes of a file in memory.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404
+from django.utils._os import safe_join
+
+CHUNK_SIZE = 64 * 1024
+
+# File names that embed a content digest (renditions, content-addressed blobs)
+FINGERPRINT_RE = re.compile(r'(?:^|[_.-])(?P<digest>[0-9a-f]{12}|[0-9a-f]{64})\.[A-Za-z0-9]+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Content hashes of recently served files, keyed by (path, size, mtime)
+_ETAG_CACHE_SIZE = 4096
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file."""
+
+
+def resolve(path):
+    """
+    Return the absolute path of ``path`` under MEDIA_ROOT.
+
+    Raises:
+        Http404: If the path escapes MEDIA_ROOT
+    """
+    try:
+        return safe_join(settings.MEDIA_ROOT, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404('Invalid media path.')
+
+
+def fingerprint(path):
+    """Return the content digest embedded in a file name, if any."""
+    match = FINGERPRINT_RE.search(os.path.basename(path))
+    return match.group('digest') if match else None
+
+
+def cache_control(path):
+    """
+    Fingerprinted names never change content and may be cached forever.
+    """
+    if fingerprint(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return f'public, max-age={settings.PICME_MEDIA_MAX_AGE}'
+
+
+def content_type(path):
+    guessed, encoding = mimetypes.guess_type(path)
+    return guessed or 'application/octet-stream'
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def etag(path, stat):
+    """
+    Strong ETag derived from the file's content.
+
+    Fingerprinted names already carry a digest; other files are hashed once
+    per (size, mtime) and remembered in a bounded per-process cache.
+    """
+    digest = fingerprint(path)
+    if digest is None:
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with _etag_lock:
+            digest = _etag_cache.get(key)
+            if digest is not None:
+                _etag_cache.move_to_end(key)
+        if digest is None:
+            digest = _hash_file(path)
+            with _etag_lock:
+                _etag_cache[key] = digest
+                while len(_etag_cache) > _ETAG_CACHE_SIZE:
+                    _etag_cache.popitem(last=False)
+    return f'"{digest[:32]}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range`` header into an inclusive ``(start, end)`` pair.
+
+    Returns None when the header should be ignored (malformed, not bytes,
+    or several ranges, which are answered with the full file).
+
+    Raises:
+        RangeNotSatisfiable: If the range starts beyond the end of the file
+    """
+    units, _, ranges = header.partition('=')
+    if units.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def iter_file(path, start, length):
+    """Yield ``length`` bytes of ``path`` from ``start`` in chunks."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def aiter_file(path, start, length):
+    """
+    Async variant of ``iter_file``; reads run in a thread so the event loop
+    is never blocked on disk I/O.
+    """
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
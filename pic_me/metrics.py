@@ -0,0 +1,98 @@
+"""
+In-process counters for operational metrics.
+
+Values are per worker process and reset on restart; they are exposed as
+JSON to staff users by the ``metrics`` view. Durations are kept as
+fixed-bucket histograms, from which p50/p95/p99 are estimated.
+"""
+import bisect
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.175, 0.25, 0.35, 0.5, 0.75, 1.0, 2.5, 5.0)
+_histograms = {}
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def observe(name, seconds):
+    """
+    Record a duration in the histogram ``name``.
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {'counts': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0}
+        histogram['counts'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram['sum'] += seconds
+
+
+def quantile(counts, q):
+    """
+    Estimate a quantile from bucket counts: the upper bound of the bucket
+    holding it (None for the overflow bucket or an empty histogram).
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def _summarize(histogram):
+    counts = histogram['counts']
+    total = sum(counts)
+    return {
+        'count': total,
+        'mean': histogram['sum'] / total if total else None,
+        'buckets': {
+            **{str(bound): count for bound, count in zip(LATENCY_BUCKETS, counts)},
+            '+Inf': counts[-1],
+        },
+        'p50': quantile(counts, 0.5),
+        'p95': quantile(counts, 0.95),
+        'p99': quantile(counts, 0.99),
+    }
+
+
+def ratio(hits, misses):
+    """Return hits / (hits + misses), or None when nothing was recorded."""
+    total = hits + misses
+    return hits / total if total else None
+
+
+def snapshot():
+    """
+    Return a copy of all counters plus derived hit rates.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            name: {'counts': list(histogram['counts']), 'sum': histogram['sum']}
+            for name, histogram in _histograms.items()
+        }
+    return {
+        'counters': counters,
+        'histograms': {name: _summarize(histogram) for name, histogram in histograms.items()},
+        'rates': {
+            'fragment_cache_hit_rate': ratio(
+                counters.get('fragments.hits', 0), counters.get('fragments.misses', 0)
+            ),
+            'user_cache_hit_rate': ratio(
+                counters.get('users.hits', 0) + counters.get('users.shared_hits', 0),
+                counters.get('users.misses', 0),
+            ),
+        },
+    }
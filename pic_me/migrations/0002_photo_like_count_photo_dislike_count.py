@@ -0,0 +1,44 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:06
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Photo = apps.get_model('pic_me', 'Photo')
+    PhotoInteraction = apps.get_model('pic_me', 'PhotoInteraction')
+
+    def counter(interaction_type):
+        counts = (
+            PhotoInteraction.objects
+            .filter(photo=OuterRef('pk'), interaction_type=interaction_type)
+            .order_by()
+            .values('photo')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Photo.objects.update(like_count=counter('like'), dislike_count=counter('dislike'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0002_photo_like_count_photo_dislike_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['-created_at', '-id'], name='pic_me_photo_created_id_idx'),
+        ),
+    ]
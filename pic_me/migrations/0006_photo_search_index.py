@@ -0,0 +1,66 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:48
+
+from django.db import migrations
+
+
+SQLITE_DOCUMENTS_SQL = """
+    SELECT p.id, p.title, p.description,
+           COALESCE((SELECT group_concat(t.name, ' ')
+                     FROM pic_me_photo_tags pt JOIN pic_me_tag t ON t.id = pt.tag_id
+                     WHERE pt.photo_id = p.id), '')
+    FROM pic_me_photo p
+"""
+
+POSTGRES_DOCUMENTS_SQL = """
+    SELECT p.id,
+           setweight(to_tsvector('english', p.title), 'A') ||
+           setweight(to_tsvector('english', p.description), 'B') ||
+           setweight(to_tsvector('english', COALESCE((
+               SELECT string_agg(t.name, ' ')
+               FROM pic_me_photo_tags pt JOIN pic_me_tag t ON t.id = pt.tag_id
+               WHERE pt.photo_id = p.id), '')), 'C')
+    FROM pic_me_photo p
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE pic_me_photo_fts USING fts5("
+            "title, description, tags, tokenize = 'porter unicode61')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO pic_me_photo_fts (rowid, title, description, tags) {SQLITE_DOCUMENTS_SQL}'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE pic_me_photo_search ('
+            'photo_id bigint PRIMARY KEY REFERENCES pic_me_photo (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX pic_me_photo_search_document_idx ON pic_me_photo_search USING GIN (document)'
+        )
+        schema_editor.execute(
+            f'INSERT INTO pic_me_photo_search (photo_id, document) {POSTGRES_DOCUMENTS_SQL}'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS pic_me_photo_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS pic_me_photo_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0005_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
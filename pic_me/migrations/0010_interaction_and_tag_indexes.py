@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 23:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0009_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photointeraction',
+            index=models.Index(fields=['photo', 'interaction_type'], name='pic_me_inter_photo_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photointeraction',
+            index=models.Index(condition=models.Q(('interaction_type', 'like')), fields=['photo', 'user'], name='pic_me_inter_like_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photointeraction',
+            index=models.Index(condition=models.Q(('interaction_type', 'dislike')), fields=['photo', 'user'], name='pic_me_inter_dislike_idx'),
+        ),
+        # Tag-filtered galleries go from the tag to its photos; Django only
+        # creates single-column indexes on the auto-created m2m table
+        migrations.RunSQL(
+            'CREATE INDEX pic_me_photo_tags_tag_photo_idx ON pic_me_photo_tags (tag_id, photo_id)',
+            'DROP INDEX pic_me_photo_tags_tag_photo_idx',
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 6.0.1 on 2026-10-17 23:52
+
+from collections import defaultdict
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_scores(apps, schema_editor):
+    """
+    Score existing photos: ``top`` from the counters, ``trending`` from the
+    interactions weighted by when they were created.
+    """
+    Photo = apps.get_model('pic_me', 'Photo')
+    PhotoInteraction = apps.get_model('pic_me', 'PhotoInteraction')
+    PhotoScore = apps.get_model('pic_me', 'PhotoScore')
+    ScoreEpoch = apps.get_model('pic_me', 'ScoreEpoch')
+
+    now = timezone.now()
+    half_life = timedelta(hours=settings.PICME_TRENDING_HALF_LIFE)
+    ScoreEpoch.objects.create(pk=1, started_at=now)
+
+    trending = defaultdict(float)
+    rows = PhotoInteraction.objects.values_list('photo_id', 'interaction_type', 'created_at')
+    for photo_id, interaction_type, created_at in rows.iterator(chunk_size=2000):
+        sign = 1 if interaction_type == 'like' else -1
+        trending[photo_id] += sign * 2 ** ((created_at - now) / half_life)
+
+    scores = [
+        PhotoScore(photo_id=photo_id, top=likes - dislikes, trending=trending.get(photo_id, 0))
+        for photo_id, likes, dislikes in Photo.objects.values_list('pk', 'like_count', 'dislike_count').iterator()
+    ]
+    PhotoScore.objects.bulk_create(scores, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0010_interaction_and_tag_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreEpoch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhotoScore',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='pic_me.photo')),
+                ('top', models.IntegerField(default=0)),
+                ('trending', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Photo Score',
+                'verbose_name_plural': 'Photo Scores',
+                'indexes': [models.Index(fields=['-trending', '-photo'], name='pic_me_score_trending_idx'), models.Index(fields=['-top', '-photo'], name='pic_me_score_top_idx')],
+            },
+        ),
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:14
+
+from collections import Counter
+from itertools import permutations
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_tags(apps, schema_editor):
+    Photo = apps.get_model('pic_me', 'Photo')
+    Tag = apps.get_model('pic_me', 'Tag')
+    TagPair = apps.get_model('pic_me', 'TagPair')
+    Through = Photo.tags.through
+
+    tags_by_photo = {}
+    for photo_id, tag_id in Through.objects.order_by('photo_id').values_list('photo_id', 'tag_id').iterator():
+        tags_by_photo.setdefault(photo_id, []).append(tag_id)
+    counts = Counter()
+    pairs = Counter()
+    for tag_ids in tags_by_photo.values():
+        counts.update(tag_ids)
+        pairs.update(permutations(tag_ids, 2))
+    for tag_id, total in counts.items():
+        Tag.objects.filter(pk=tag_id).update(photo_count=total)
+    TagPair.objects.bulk_create(
+        [TagPair(tag_id=tag_id, other_id=other_id, count=total) for (tag_id, other_id), total in pairs.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0011_photo_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Tag Pair',
+                'verbose_name_plural': 'Tag Pairs',
+            },
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-photo_count', 'name'], name='pic_me_tag_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='tagpair',
+            name='other',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pic_me.tag'),
+        ),
+        migrations.AddField(
+            model_name='tagpair',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='pic_me.tag'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagpair',
+            constraint=models.UniqueConstraint(fields=('tag', 'other'), name='pic_me_tagpair_unique'),
+        ),
+        migrations.RunPython(count_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0012_tag_facet_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoHash',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='phash', serialize=False, to='pic_me.photo')),
+                ('hash', models.BigIntegerField()),
+                ('band0', models.IntegerField()),
+                ('band1', models.IntegerField()),
+                ('band2', models.IntegerField()),
+                ('band3', models.IntegerField()),
+                ('source', models.CharField(max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Photo Hash',
+                'verbose_name_plural': 'Photo Hashes',
+                'indexes': [models.Index(fields=['band0'], name='pic_me_phash_band0_idx'), models.Index(fields=['band1'], name='pic_me_phash_band1_idx'), models.Index(fields=['band2'], name='pic_me_phash_band2_idx'), models.Index(fields=['band3'], name='pic_me_phash_band3_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:27
+
+import django.core.validators
+import pic_me.ingest
+import pic_me.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0013_photo_hashes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(storage=pic_me.storage.image_storage, upload_to='photos/', validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif']), pic_me.ingest.validate_image_file]),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=pic_me.storage.image_storage, upload_to='profile_pics/', validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png']), pic_me.ingest.validate_image_file]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pic_me', '0014_image_decode_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatars',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,14 +1,34 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.core.validators import FileExtensionValidator
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.core.files.base import ContentFile
 from io import BytesIO
 from PIL import Image
+import logging
 import os
+import uuid
+
+from . import avatars
+from . import facets
+from . import fragments
+from . import ingest
+from . import interactions
+from . import renditions as photo_renditions
+from . import scores
+from . import search
+from . import similarity
+from . import storage as blob_storage
+from . import usercache
+from .jobs import enqueue
+from .storage import image_storage
+from .tasks import enqueue_image_pipeline
+
+logger = logging.getLogger(__name__)
 
 
 class CustomUserManager(BaseUserManager):
@@ -54,7 +74,57 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def get_short_name(self):
         return self.first_name or self.username
 
-class UserProfile(models.Model):
+class ImageChangeTrackingMixin:
+    """
+    Remembers the file names of image fields as loaded from the database,
+    so ``save()`` can tell whether a new file was assigned and background
+    processing needs to be queued.
+    """
+    tracked_image_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_images()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or set(fields) & set(self.tracked_image_fields):
+            self.remember_images()
+
+    def remember_images(self):
+        self._loaded_images = {
+            name: getattr(self, name).name
+            for name in self.tracked_image_fields
+            if name not in self.get_deferred_fields()
+        }
+
+    def image_changed(self, name):
+        loaded = getattr(self, '_loaded_images', {})
+        if name not in loaded:
+            return self._state.adding or name not in self.get_deferred_fields()
+        return getattr(self, name).name != loaded[name]
+
+    def loaded_image(self, name):
+        return getattr(self, '_loaded_images', {}).get(name)
+
+    def adopt_processed_image(self, name):
+        """
+        Store a newly assigned file and, if identical content already went
+        through the background pipeline, point the field at the processed
+        blob. Returns that Blob or None.
+        """
+        field_file = getattr(self, name)
+        if not field_file._committed:
+            field_file.save(field_file.name, field_file.file, save=False)
+        blob = blob_storage.processed_blob(field_file.name)
+        if blob is not None:
+            setattr(self, name, blob.name)
+        return blob
+
+
+class UserProfile(ImageChangeTrackingMixin, models.Model):
     """
     Extended user profile model containing additional user information.
     Linked to the CustomUser model via OneToOne relationship.
@@ -64,46 +134,91 @@ class UserProfile(models.Model):
     bio = models.TextField(max_length=500, blank=True, help_text="Tell us about yourself")
     profile_picture = models.ImageField(
         upload_to='profile_pics/', 
+        storage=image_storage,
         blank=True, 
         null=True,
-        validators=[FileExtensionValidator(['jpg', 'jpeg', 'png'])]
+        validators=[FileExtensionValidator(['jpg', 'jpeg', 'png']), ingest.validate_image_file]
     )
+    # Square crops of the picture, see pic_me.avatars
+    avatars = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_image_fields = ('profile_picture',)
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    def save(self, *args, **kwargs):
+        picture_changed = self.image_changed('profile_picture')
+        previous_picture = self.loaded_image('profile_picture')
+        processed = None
+        stale_avatars = []
+        if picture_changed and self.profile_picture:
+            processed = self.adopt_processed_image('profile_picture')
+        elif picture_changed and self.avatars:
+            stale_avatars = blob_storage.rendition_names(self.avatars)
+            self.avatars = {}
+        super().save(*args, **kwargs)
+        self.remember_images()
+        if picture_changed:
+            blob_storage.swap_reference(previous_picture, self.profile_picture.name)
+            for name in stale_avatars:
+                blob_storage.release(name)
+        if not picture_changed or not self.profile_picture:
+            return
+        if not settings.PICME_ASYNC_IMAGE_PROCESSING:
+            self.refresh_avatars()
+        elif processed is not None:
+            enqueue('profile.avatars', pk=self.pk)
+        else:
+            enqueue_image_pipeline(self, 'profile_picture')
+
+    def refresh_avatars(self, fail_silently=True):
+        """
+        Regenerate the avatar crops of the current picture; until they
+        exist, templates show the identicon.
+        """
+        try:
+            generated = avatars.generate_avatars(self.profile_picture)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            if not fail_silently:
+                raise
+            logger.exception('Could not generate avatars for profile %s', self.pk)
+            return
+        previous = set(blob_storage.rendition_names(self.avatars))
+        current = set(blob_storage.rendition_names(generated))
+        blob_storage.retain_many(current - previous)
+        for name in previous - current:
+            blob_storage.release(name)
+        self.avatars = generated
+        UserProfile.objects.filter(pk=self.pk).update(avatars=generated, updated_at=timezone.now())
+        usercache.invalidate(self.user_id)
+
+    def avatar_url(self, size=64):
+        """
+        URL of the square avatar covering ``size`` pixels, or of the user's
+        identicon if there is none.
+        """
+        size = avatars.nearest_size(size)
+        entry = self.avatars.get(f'avatar_{size}')
+        if entry and self.profile_picture and self.avatars.get('source') == self.profile_picture.name:
+            return self.profile_picture.storage.url(entry['jpeg'])
+        return avatars.identicon_url(self.user_id, size)
+
     class Meta:
         verbose_name = 'User Profile'
         verbose_name_plural = 'User Profiles'
 
 
-# Signal handlers for automatic profile creation and saving
-@receiver(post_save, sender=CustomUser)
-def create_user_profile(sender, instance, created, **kwargs):
-    """
-    Create a UserProfile when a new CustomUser is created.
-    """
-    if created:
-        UserProfile.objects.create(user=instance)
-
-
-@receiver(post_save, sender=CustomUser)
-def save_user_profile(sender, instance, **kwargs):
-    """
-    Save the UserProfile when the CustomUser is saved.
-    """
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
-
-
 class Tag(models.Model):
     """
     Tag model for categorizing photos.
     """
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=50, unique=True)
+    # Number of photos with this tag, maintained by pic_me.facets
+    photo_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -111,10 +226,34 @@ class Tag(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Backs the most-used-first tag cloud and facet list
+            models.Index(fields=['-photo_count', 'name'], name='pic_me_tag_count_idx'),
+        ]
         
 
 
-class Photo(models.Model):
+class TagPair(models.Model):
+    """
+    Number of photos carrying both ``tag`` and ``other``; every pair is
+    stored in both directions. Maintained by pic_me.facets.
+    """
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='pairs')
+    other = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Tag Pair'
+        verbose_name_plural = 'Tag Pairs'
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'other'], name='pic_me_tagpair_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag_id} & {self.other_id}: {self.count}"
+
+
+class Photo(ImageChangeTrackingMixin, models.Model):
     """
     Photo model representing individual photos in the gallery.
     Includes title, description, tags, and tracks user interactions.
@@ -123,23 +262,146 @@ class Photo(models.Model):
     description = models.TextField(blank=True)
     image = models.ImageField(
         upload_to='photos/',
-        validators=[FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif'])]
+        storage=image_storage,
+        validators=[FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif']), ingest.validate_image_file]
     )
     tags = models.ManyToManyField(Tag, related_name='photos', blank=True)
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='photos')
+    # Denormalized interaction counters, maintained by PhotoInteraction.toggle()
+    # and rebuilt from PhotoInteraction by `manage.py rebuild_photo_counters`.
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
+    # Precomputed thumbnails/resized copies, see pic_me.renditions
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Version of the cached gallery card, bumped by signals (see pic_me.fragments)
+    cache_version = models.BigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_image_fields = ('image',)
+
+    COUNTER_FIELDS = {
+        'like': 'like_count',
+        'dislike': 'dislike_count',
+    }
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        image_changed = self.image_changed('image')
+        previous_image = self.loaded_image('image')
+        processed = None
+        if image_changed and self.image:
+            # Identical content is stored once; reuse its processed file
+            # and renditions instead of running the pipeline again
+            processed = self.adopt_processed_image('image')
+            self.renditions = blob_storage.known_renditions(self.image.name)
+        super().save(*args, **kwargs)
+        self.remember_images()
+        if image_changed:
+            blob_storage.swap_reference(previous_image, self.image.name)
+        if not self.image or self.renditions.get('source') == self.image.name:
+            if image_changed:
+                # Reused, already processed content: hash it right away
+                similarity.ensure_hash(self)
+            return
+        if image_changed and settings.PICME_ASYNC_IMAGE_PROCESSING:
+            if processed is not None:
+                enqueue('photo.renditions', pk=self.pk)
+            else:
+                enqueue_image_pipeline(self, 'image')
+        elif not settings.PICME_ASYNC_IMAGE_PROCESSING:
+            self.refresh_renditions()
+
+    def refresh_renditions(self, fail_silently=True):
+        """
+        Regenerate the thumbnail/resized renditions of the current image.
+        Failures are logged and the templates fall back to the original.
+        """
+        try:
+            self.renditions = photo_renditions.generate_renditions(self.image)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            if not fail_silently:
+                raise
+            logger.exception('Could not generate renditions for photo %s', self.pk)
+            return
+        Photo.objects.filter(pk=self.pk).update(
+            renditions=self.renditions,
+            cache_version=fragments.bumped('cache_version'),
+            updated_at=timezone.now(),
+        )
+        blob_storage.record_renditions(self.image.name, self.renditions)
+        similarity.ensure_hash(self)
+
+    def rendition_url(self, name, format_key='jpeg'):
+        """
+        URL of a rendition, or an empty string if it has not been generated.
+        """
+        entry = self.renditions.get(name) if self.renditions.get('source') == self.image.name else None
+        if not entry:
+            return ''
+        return self.image.storage.url(entry[format_key])
+
+    def _srcset(self, format_key):
+        candidates = {}
+        for name in photo_renditions.SRCSET_RENDITIONS:
+            url = self.rendition_url(name, format_key)
+            # Small originals are never upscaled, so sizes may repeat
+            if url:
+                candidates.setdefault(self.renditions[name]['width'], url)
+        return ', '.join(f'{url} {width}w' for width, url in candidates.items())
+
+    @property
+    def thumbnail_url(self):
+        return self.rendition_url('thumbnail') or self.image.url
+
+    @property
+    def thumbnail_webp_url(self):
+        return self.rendition_url('thumbnail', 'webp')
+
+    @property
+    def medium_url(self):
+        return self.rendition_url('medium') or self.image.url
+
+    @property
+    def medium_webp_url(self):
+        return self.rendition_url('medium', 'webp')
+
+    @property
+    def srcset(self):
+        return self._srcset('jpeg')
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('webp')
+
     def total_likes(self):
-        """Calculate total number of likes for this photo."""
-        return self.interactions.filter(interaction_type='like').count()
+        """Return the total number of likes for this photo."""
+        return self.like_count
 
     def total_dislikes(self):
-        """Calculate total number of dislikes for this photo."""
-        return self.interactions.filter(interaction_type='dislike').count()
+        """Return the total number of dislikes for this photo."""
+        return self.dislike_count
+
+    @classmethod
+    def apply_counter_deltas(cls, photo_id, deltas):
+        """
+        Atomically adjust the like/dislike counters of a photo.
+
+        Args:
+            photo_id: Primary key of the photo to update
+            deltas: Dict mapping interaction type ('like'/'dislike') to the
+                    amount to add (may be negative)
+        """
+        updates = {
+            cls.COUNTER_FIELDS[interaction_type]: F(cls.COUNTER_FIELDS[interaction_type]) + delta
+            for interaction_type, delta in deltas.items()
+            if delta
+        }
+        if updates:
+            cls.objects.filter(pk=photo_id).update(**updates)
+            scores.record({photo_id: deltas})
 
     @staticmethod
     def create_placeholder_image(width=400, height=300, color=(100, 150, 200), text=""):
@@ -205,6 +467,10 @@ class Photo(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Photo'
         verbose_name_plural = 'Photos'
+        indexes = [
+            # Backs keyset pagination of the gallery on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='pic_me_photo_created_id_idx'),
+        ]
 
 class PhotoInteraction(models.Model):
     """
@@ -225,7 +491,421 @@ class PhotoInteraction(models.Model):
         unique_together = ('user', 'photo')
         verbose_name = 'Photo Interaction'
         verbose_name_plural = 'Photo Interactions'
+        indexes = [
+            # Backs per-photo counts by type (counter rebuilds) and the
+            # cascade when a photo is deleted; (user, photo) only helps
+            # lookups that start from the user
+            models.Index(fields=['photo', 'interaction_type'], name='pic_me_inter_photo_type_idx'),
+            # Partial indexes per type that also cover the user, for
+            # listing who liked or disliked a photo
+            models.Index(fields=['photo', 'user'], condition=Q(interaction_type='like'), name='pic_me_inter_like_idx'),
+            models.Index(
+                fields=['photo', 'user'], condition=Q(interaction_type='dislike'), name='pic_me_inter_dislike_idx',
+            ),
+        ]
 
     def __str__(self):
         verb = 'liked' if self.interaction_type == 'like' else 'disliked'
-        return f"{self.user.username} {verb} {self.photo.title}"
\ No newline at end of file
+        return f"{self.user.username} {verb} {self.photo.title}"
+
+    @classmethod
+    def toggle(cls, user, photo, interaction_type):
+        """
+        Record a like/dislike from a user on a photo.
+
+        Repeating the current interaction removes it and choosing the other
+        type flips it. The photo's counters are updated in the same
+        transaction, so they always agree with the interaction rows.
+
+        Returns:
+            'created', 'removed' or 'changed'
+        """
+        with transaction.atomic():
+            # Serializes with batched writes, see interactions.lock_users()
+            interactions.lock_users([user.pk])
+            interaction, created = cls.objects.select_for_update().get_or_create(
+                user=user,
+                photo=photo,
+                defaults={'interaction_type': interaction_type}
+            )
+
+            if created:
+                result = 'created'
+                deltas = {interaction_type: 1}
+            elif interaction.interaction_type == interaction_type:
+                interaction.delete()
+                result = 'removed'
+                deltas = {interaction_type: -1}
+            else:
+                deltas = {interaction.interaction_type: -1, interaction_type: 1}
+                interaction.interaction_type = interaction_type
+                interaction.save(update_fields=['interaction_type'])
+                result = 'changed'
+
+            Photo.apply_counter_deltas(photo.pk, deltas)
+
+        return result
+
+
+class Job(models.Model):
+    """
+    A unit of background work processed by `manage.py run_worker`.
+    See pic_me.jobs for the queue semantics.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            # Backs the claim query of pic_me.jobs.claim_jobs()
+            models.Index(fields=['status', 'run_after'], name='pic_me_job_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable chunked photo upload in progress. The received bytes live in
+    a part file, see pic_me.uploads.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveBigIntegerField()
+    # Optional SHA-256 announced by the client, checked on completion
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+
+    def __str__(self):
+        return f"{self.filename} ({self.size} bytes) by {self.user.username}"
+
+
+class PhotoScore(models.Model):
+    """
+    Popularity scores of a photo for the "top" and "trending" orderings,
+    maintained incrementally by pic_me.scores.
+    """
+    photo = models.OneToOneField(Photo, on_delete=models.CASCADE, primary_key=True, related_name='score')
+    # Likes minus dislikes
+    top = models.IntegerField(default=0)
+    # Recency-weighted likes minus dislikes, on the scale of the ScoreEpoch
+    trending = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Photo Score'
+        verbose_name_plural = 'Photo Scores'
+        indexes = [
+            # Back the top-K reads of the trending and top galleries
+            models.Index(fields=['-trending', '-photo'], name='pic_me_score_trending_idx'),
+            models.Index(fields=['-top', '-photo'], name='pic_me_score_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.photo_id}: top {self.top}, trending {self.trending:g}"
+
+
+class PhotoHash(models.Model):
+    """
+    Perceptual hash of a photo's image, split into separately indexed bands
+    for near-duplicate lookups (see pic_me.similarity).
+    """
+    photo = models.OneToOneField(Photo, on_delete=models.CASCADE, primary_key=True, related_name='phash')
+    # 64-bit dHash, stored signed
+    hash = models.BigIntegerField()
+    band0 = models.IntegerField()
+    band1 = models.IntegerField()
+    band2 = models.IntegerField()
+    band3 = models.IntegerField()
+    # Image the hash was computed from
+    source = models.CharField(max_length=255)
+
+    class Meta:
+        verbose_name = 'Photo Hash'
+        verbose_name_plural = 'Photo Hashes'
+        indexes = [
+            models.Index(fields=['band0'], name='pic_me_phash_band0_idx'),
+            models.Index(fields=['band1'], name='pic_me_phash_band1_idx'),
+            models.Index(fields=['band2'], name='pic_me_phash_band2_idx'),
+            models.Index(fields=['band3'], name='pic_me_phash_band3_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.photo_id}: {similarity.to_unsigned(self.hash):016x}"
+
+    @staticmethod
+    def fields_for(value, source):
+        """
+        Column values for an unsigned hash computed from ``source``.
+        """
+        band0, band1, band2, band3 = similarity.bands(value)
+        return {
+            'hash': similarity.to_signed(value),
+            'band0': band0, 'band1': band1, 'band2': band2, 'band3': band3,
+            'source': source,
+        }
+
+
+class ScoreEpoch(models.Model):
+    """
+    Single row holding the time trending weights are measured from; moved
+    forward by `manage.py compact_scores`.
+    """
+    SINGLETON_ID = 1
+
+    started_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Score epoch {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class Blob(models.Model):
+    """
+    A content-addressed file in media storage, shared by every image field
+    holding the same content. See pic_me.storage.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    # Number of image fields (and source blobs, for renditions) using the file
+    refcount = models.IntegerField(default=0)
+    # Set once the background pipeline validated the content; points at the
+    # EXIF-stripped copy when stripping produced a different file
+    processed = models.BooleanField(default=False)
+    replaced_by = models.CharField(max_length=255, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
+        indexes = [
+            # Backs the garbage collection query of pic_me.storage.collect()
+            models.Index(fields=['refcount', 'updated_at'], name='pic_me_blob_refcount_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class CacheVersion(models.Model):
+    """
+    Named version counter for cached fragments that do not belong to a
+    single row (e.g. the tag dropdown). See pic_me.fragments.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+# Signal handlers for automatic profile creation and saving
+@receiver(post_save, sender=CustomUser)
+def create_user_profile(sender, instance, created, **kwargs):
+    """
+    Create a UserProfile when a new CustomUser is created.
+    """
+    if created:
+        UserProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=CustomUser)
+def save_user_profile(sender, instance, **kwargs):
+    """
+    Save the UserProfile when the CustomUser is saved.
+    """
+    if hasattr(instance, 'profile'):
+        instance.profile.save()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drop the user's cached session snapshot (see pic_me.usercache).
+    """
+    usercache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_profile_user(sender, instance, **kwargs):
+    """
+    The cached snapshot includes the profile, so drop it as well.
+    """
+    usercache.invalidate(instance.user_id)
+
+
+# Signal handler keeping interaction counters right (pic_me.interactions)
+@receiver(pre_delete, sender=CustomUser)
+def withdraw_user_interactions(sender, instance, **kwargs):
+    """
+    Deleting a user cascades to their interactions, which would leave the
+    photos' counters and scores counting them. Remove them through
+    ``interactions.apply_states`` first, in the same transaction.
+    """
+    photo_ids = PhotoInteraction.objects.filter(user=instance).values_list('photo_id', flat=True)
+    interactions.apply_states({(instance.pk, photo_id): None for photo_id in photo_ids})
+
+
+# Signal handlers releasing blob references of deleted rows (pic_me.storage)
+@receiver(post_delete, sender=Photo)
+def release_photo_image(sender, instance, **kwargs):
+    blob_storage.release(instance.loaded_image('image') or instance.image.name)
+
+
+@receiver(post_delete, sender=UserProfile)
+def release_profile_picture(sender, instance, **kwargs):
+    blob_storage.release(instance.loaded_image('profile_picture') or instance.profile_picture.name)
+    for name in blob_storage.rendition_names(instance.avatars):
+        blob_storage.release(name)
+
+
+# Signal handler creating score rows (pic_me.scores)
+@receiver(post_save, sender=Photo)
+def create_photo_score(sender, instance, created, **kwargs):
+    """
+    Give new photos a score row, so the score orderings include them.
+    """
+    if created:
+        scores.ensure([instance.pk])
+
+
+# Signal handlers maintaining the tag facet counts (pic_me.facets)
+@receiver(pre_delete, sender=Photo)
+def remember_photo_tags(sender, instance, **kwargs):
+    instance._facet_tags = facets.snapshot([instance.pk])
+
+
+@receiver(post_delete, sender=Photo)
+def uncount_photo_tags(sender, instance, **kwargs):
+    """
+    Remove a deleted photo's tags from the counts (the join rows go
+    without m2m_changed).
+    """
+    before = getattr(instance, '_facet_tags', None)
+    if before:
+        facets.record(before, {})
+
+
+# Signal handlers keeping the full-text search index (pic_me.search) in sync
+@receiver(post_save, sender=Photo)
+def index_photo(sender, instance, **kwargs):
+    """
+    Reindex a photo whenever it is saved.
+    """
+    search.index_photos([instance.pk])
+
+
+@receiver(post_delete, sender=Photo)
+def unindex_photo(sender, instance, **kwargs):
+    """
+    Remove a deleted photo from the search index.
+    """
+    search.remove_photos([instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+def index_tag_photos(sender, instance, created, **kwargs):
+    """
+    Reindex the photos of a tag after it is renamed.
+    """
+    if not created:
+        search.index_photos(instance.photos.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_photos(sender, instance, **kwargs):
+    instance._search_photo_ids = list(instance.photos.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_deleted_tag_photos(sender, instance, **kwargs):
+    """
+    Reindex the photos that lost a deleted tag.
+    """
+    search.index_photos(getattr(instance, '_search_photo_ids', []))
+
+
+# Signal handlers invalidating cached gallery fragments (pic_me.fragments)
+@receiver(post_save, sender=Photo)
+def bump_photo_version(sender, instance, **kwargs):
+    """
+    Invalidate a photo's card after it is saved.
+    """
+    fragments.bump_photos([instance.pk])
+
+
+@receiver(post_save, sender=PhotoInteraction)
+@receiver(post_delete, sender=PhotoInteraction)
+def bump_interaction_photo_version(sender, instance, **kwargs):
+    """
+    Invalidate a photo's card when its like/dislike counts change.
+    """
+    fragments.bump_photos([instance.photo_id])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, instance, **kwargs):
+    """
+    Invalidate the tag dropdown and every card showing tag names.
+    """
+    fragments.bump_version(fragments.TAGS_VERSION)
+
+
+# Signal handler for tag changes from either side of Photo.tags
+@receiver(m2m_changed, sender=Photo.tags.through)
+def photo_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Snapshot the tag sets of the affected photos before a change. After it,
+    apply the difference to the tag facet counts (pic_me.facets), reindex
+    the photos and invalidate their cards.
+    """
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        if not reverse:
+            photo_ids = [instance.pk]
+        elif action == 'pre_clear':
+            photo_ids = list(instance.photos.values_list('pk', flat=True))
+        else:
+            photo_ids = list(pk_set or [])
+        instance._tags_before = facets.snapshot(photo_ids)
+    elif hasattr(instance, '_tags_before'):
+        before = instance.__dict__.pop('_tags_before')
+        facets.record(before, facets.snapshot(before))
+        if before:
+            search.index_photos(list(before))
+            fragments.bump_photos(before)
@@ -0,0 +1,213 @@
+"""
+Keyset (cursor) pagination for querysets.
+
+Instead of OFFSET, each page is fetched with a WHERE clause that continues
+after the last row of the previous page, so page N costs the same as page 1
+as long as an index backs the ordering. The ordering must be total (end with
+a unique field such as ``id``) for the cursor to be stable.
+"""
+import base64
+import binascii
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import F, Func, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.lookups import In
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded for the given ordering."""
+
+
+class KeysetPage:
+    """
+    A single page of results plus the token for the following page.
+    """
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _lookup_value(obj, field_name):
+    if isinstance(obj, dict):
+        return obj[field_name]
+    for part in field_name.split('__'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of a row into an opaque URL-safe token.
+    """
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _field_value(field, value, connection):
+    """
+    Convert a decoded cursor value for ``field`` and check that it can be
+    bound as a query parameter of that field.
+    """
+    # JSON null, booleans and containers are never valid ordering values
+    if value is None or isinstance(value, (bool, list, dict)):
+        raise InvalidCursor('Cursor contains an invalid value.')
+    if field is None:
+        return value
+    try:
+        value = field.to_python(value)
+    except (ValidationError, TypeError, ValueError, OverflowError) as exc:
+        raise InvalidCursor('Cursor contains an invalid value.') from exc
+    if value is None or (isinstance(value, float) and not math.isfinite(value)):
+        raise InvalidCursor('Cursor contains an invalid value.')
+    if isinstance(value, int):
+        try:
+            low, high = connection.ops.integer_field_range(field.get_internal_type())
+        except KeyError:
+            low, high = None, None
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise InvalidCursor('Cursor contains an out of range value.')
+    return value
+
+
+def _ordering_field(queryset, name):
+    """
+    The field named in an ordering: a model field, a field of a related
+    model (``score__top``) or the output field of an annotation; None if
+    none is known.
+    """
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    model = queryset.model
+    *relations, field_name = name.split(LOOKUP_SEP)
+    try:
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+            if model is None:
+                return None
+        return model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return None
+
+
+def decode_cursor(token, queryset, ordering):
+    """
+    Decode a cursor token back into Python values for ``ordering``.
+
+    Values are converted with the ``to_python`` of the model field (also
+    across relations, or of the annotation's output field) so datetimes
+    compare correctly, and checked against the field's type and range;
+    other names are returned as decoded from JSON. Raises ``InvalidCursor``
+    for anything that would not make a valid keyset filter.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor('Malformed cursor.') from exc
+
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Cursor does not match the ordering.')
+
+    connection = connections[queryset.db]
+    decoded = []
+    for field_name, value in zip(ordering, values):
+        field = _ordering_field(queryset, field_name.lstrip('-'))
+        decoded.append(_field_value(field, value, connection))
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the ``Q`` selecting rows strictly after ``values`` in ``ordering``.
+
+    For ``('-created_at', '-id')`` this is
+    ``created_at <= c AND (created_at < c OR (created_at = c AND id < i))``.
+    The redundant bound on the first field gives the database a range to
+    read from the ordering index, which it cannot derive from the ``OR``.
+    """
+    condition = Q()
+    for index, field_name in enumerate(ordering):
+        name = field_name.lstrip('-')
+        lookup = 'lt' if field_name.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[index]})
+        for previous_name, previous_value in zip(ordering[:index], values[:index]):
+            clause &= Q(**{previous_name.lstrip('-'): previous_value})
+        condition |= clause
+    if len(ordering) > 1:
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        condition = Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+    return condition
+
+
+class _Unindexed(Func):
+    # "+column" has the column's value but keeps SQLite from looking it up
+    # by index; on PostgreSQL it is a no-op unary plus, and the planner
+    # picks the plan from its statistics anyway
+    template = '+%(expressions)s'
+
+
+def filter_pk_in(queryset, subquery):
+    """
+    Restrict ``queryset`` to the primary keys returned by ``subquery``
+    without letting that filter choose the plan.
+
+    A plain ``pk__in`` makes the database fetch every match by primary key
+    and sort them all before returning the first page. Checked row by row
+    instead, the ordering index is walked and the scan stops after a page.
+    """
+    return queryset.filter(In(_Unindexed(F('pk')), subquery))
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=24):
+    """
+    Return a KeysetPage of ``queryset`` ordered by ``ordering``.
+
+    Args:
+        queryset: QuerySet to paginate (filters already applied)
+        ordering: Tuple of field names, e.g. ('-created_at', '-id')
+        cursor: Token returned as ``next_cursor`` by the previous page
+        page_size: Number of rows per page
+
+    Raises:
+        InvalidCursor: If the cursor cannot be decoded
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, queryset, ordering)))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [_lookup_value(last, field_name.lstrip('-')) for field_name in ordering]
+        )
+    return KeysetPage(rows, next_cursor)
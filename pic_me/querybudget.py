@@ -0,0 +1,195 @@
+"""
+Per-request SQL query accounting and budgets.
+
+``QueryBudgetMiddleware`` records every statement a request runs: how
+many, their total database time, and how often each statement shape
+(``fingerprint()``) repeats. It reports them in a ``Server-Timing`` header
+and one log line per request on the ``pic_me.queries`` logger.
+
+Views can declare a budget with ``@query_budget(queries=..., duplicates=...)``.
+Without one, ``PICME_QUERY_DUPLICATE_LIMIT`` still applies to repeated
+statements, the usual sign of an N+1. An overrun is logged as a warning, or
+raised as ``QueryBudgetExceeded`` when ``PICME_QUERY_BUDGET_RAISE`` is set
+(as it should be in tests). ``assert_query_budget()`` checks a block of
+test code the same way.
+
+Statements are recorded by an execute wrapper installed on every
+connection (see ``PicMeConfig.ready()``) into a context variable, so
+queries of sync code run from async views are counted too.
+"""
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('pic_me.queries')
+
+_recorder = contextvars.ContextVar('picme_query_recorder', default=None)
+
+# Collapses literals and IN lists so statements differing only in values
+# share a fingerprint
+_PLACEHOLDER_LISTS_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_NUMBERS_RE = re.compile(r'\b\d+\b')
+_STRINGS_RE = re.compile(r"'(?:[^']|'')*'")
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view or block ran more (or more repeated) queries than allowed."""
+
+
+def fingerprint(sql):
+    """
+    Normalize a statement to its shape: literals and IN lists removed.
+    """
+    sql = _STRINGS_RE.sub('?', sql)
+    sql = _NUMBERS_RE.sub('?', sql)
+    sql = _PLACEHOLDER_LISTS_RE.sub('(...)', sql)
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Statements run while the recorder is active.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """The most repeated statement shape and its count, or (None, 0)."""
+        if not self.fingerprints:
+            return None, 0
+        return self.fingerprints.most_common(1)[0]
+
+    def violations(self, queries=None, duplicates=None):
+        """Describe how the recording breaks a budget; empty if it does not."""
+        problems = []
+        if queries is not None and self.count > queries:
+            problems.append(f'{self.count} queries (budget {queries})')
+        if duplicates is not None:
+            for sql, count in self.fingerprints.most_common():
+                if count <= duplicates:
+                    break
+                problems.append(f'{count}x (limit {duplicates}): {sql}')
+        return problems
+
+
+def _record(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(sql, time.perf_counter() - start)
+
+
+def install(connection, **kwargs):
+    """
+    Add the recording wrapper to a connection (idempotent); connected to
+    ``connection_created``.
+    """
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+@contextmanager
+def record_queries():
+    """
+    Record the statements run inside the block on any connection.
+    """
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    recorder = QueryRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def assert_query_budget(queries=None, duplicates=None):
+    """
+    Test helper: raise ``QueryBudgetExceeded`` if the block runs more than
+    ``queries`` statements or any statement shape more than ``duplicates``
+    times.
+    """
+    with record_queries() as recorder:
+        yield recorder
+    problems = recorder.violations(queries, duplicates)
+    if problems:
+        raise QueryBudgetExceeded('Query budget exceeded: ' + '; '.join(problems))
+
+
+def query_budget(queries=None, duplicates=None):
+    """
+    Declare the query budget of a view, enforced by the middleware.
+    """
+    def decorator(view_func):
+        view_func.query_budget = {'queries': queries, 'duplicates': duplicates}
+        return view_func
+    return decorator
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        match = request.resolver_match
+        view = match.view_name if match else request.path
+        budget = {'queries': None, 'duplicates': settings.PICME_QUERY_DUPLICATE_LIMIT}
+        if match:
+            declared = getattr(match.func, 'query_budget', {})
+            budget.update({key: value for key, value in declared.items() if value is not None})
+
+        _, top_count = recorder.duplicates()
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f'dup;desc="max repeat {top_count}"'
+        )
+        logger.info(
+            'view=%s status=%s queries=%d db_ms=%.1f max_repeat=%d',
+            view, response.status_code, recorder.count, recorder.duration * 1000, top_count,
+        )
+
+        problems = recorder.violations(**budget)
+        if problems:
+            message = f'Query budget exceeded by {view}: ' + '; '.join(problems)
+            if settings.PICME_QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,110 @@
+"""
+Precomputed image renditions (thumbnails and resized copies) for photos.
+
+Every rendition is written in JPEG and WebP next to the original under
+``<upload dir>/renditions/``. The storage names files by the SHA-256 of
+their content (see pic_me.storage), so a URL never changes meaning and can
+be cached forever, and identical renditions are stored once.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from . import ingest
+from .storage import upload_directory
+
+logger = logging.getLogger(__name__)
+
+# name -> (max width, max height, crop to exactly that size)
+RENDITION_SPECS = {
+    'thumbnail': (480, 300, True),
+    'small': (640, 640, False),
+    'medium': (1024, 1024, False),
+    'large': (1600, 1600, False),
+}
+
+# Renditions offered to the browser in ``srcset`` on the detail page
+SRCSET_RENDITIONS = ('small', 'medium', 'large')
+
+# format key -> (Pillow format, file extension, save options)
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+
+def _largest_box(specs=RENDITION_SPECS):
+    return (
+        max(width for width, _, _ in specs.values()),
+        max(height for _, height, _ in specs.values()),
+    )
+
+
+def load_source(fileobj, box=None):
+    """
+    Decode an uploaded image into an RGB/RGBA Pillow image ready for resizing.
+
+    The file is checked against the decoding limits first (see
+    ``pic_me.ingest``). JPEGs are decoded at a reduced scale when the
+    original is much larger than the biggest rendition (or ``box``), and
+    EXIF orientation is applied.
+    """
+    image = ingest.open_image(fileobj, draft=('RGB', box or _largest_box()))
+    image.seek(0)
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def _resize(image, width, height, crop):
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail((width, height), Image.Resampling.LANCZOS)
+    return resized
+
+
+def _encode(image, format_key):
+    pil_format, _, options = RENDITION_FORMATS[format_key]
+    if pil_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_renditions(field_file, specs=RENDITION_SPECS):
+    """
+    Create every rendition of an image field file and store it.
+
+    Args:
+        field_file: The FieldFile of the original (e.g. ``photo.image``)
+        specs: Renditions to create, in the form of ``RENDITION_SPECS``
+
+    Returns:
+        Dict describing the renditions, suitable for ``Photo.renditions``:
+        ``{'source': name, '<rendition>': {'width', 'height', 'jpeg', 'webp'}}``
+    """
+    storage = field_file.storage
+    with field_file.open('rb') as original:
+        source = load_source(original, _largest_box(specs))
+
+    # The content-addressed storage names each file by the digest of its
+    # data and skips the write when that file already exists
+    directory = posixpath.join(upload_directory(field_file.name), 'renditions')
+    renditions = {'source': field_file.name}
+    for rendition, (width, height, crop) in specs.items():
+        resized = _resize(source, width, height, crop)
+        entry = {'width': resized.width, 'height': resized.height}
+        for format_key, (_, extension, _) in RENDITION_FORMATS.items():
+            name = posixpath.join(directory, f'{rendition}.{extension}')
+            entry[format_key] = storage.save(name, ContentFile(_encode(resized, format_key)))
+        renditions[rendition] = entry
+    return renditions
@@ -0,0 +1,176 @@
+"""
+Popularity scores for the "top" and "trending" gallery orderings.
+
+Every photo has a ``PhotoScore`` row holding:
+- ``top``: net votes, likes minus dislikes
+- ``trending``: net votes, each weighted by how recent it is, with a
+  half-life of ``PICME_TRENDING_HALF_LIFE`` hours
+
+Both are updated incrementally from the counter deltas of each write
+(``record()``), so ordering by them costs an index walk just like ordering
+by date, however many interactions exist.
+
+Decaying every score continuously would rewrite the whole table all the
+time. Instead, a vote cast at time ``t`` adds ``2 ** ((t - epoch) /
+half_life)``, measured from the ``ScoreEpoch``. Newer votes weigh more, and
+since all scores share one scale their order is the decayed order. The
+weights grow over time, so ``manage.py compact_scores`` periodically moves
+the epoch to now and rescales every score. Run it daily; should it not run,
+the first vote after the weights reach ``2 ** COMPACT_EXPONENT`` compacts
+instead, long before they could overflow a float (``2 ** 1024``). Removing
+a vote counts as a recent negative vote: trending measures the recent flow
+of votes.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+# Trending scores closer to zero than this are snapped to zero on compaction
+NEGLIGIBLE = 1e-9
+
+# Half-lives after the epoch at which a vote compacts the scores first
+COMPACT_EXPONENT = 64
+
+
+def _half_life():
+    return timedelta(hours=settings.PICME_TRENDING_HALF_LIFE)
+
+
+def exponent(moment, epoch):
+    """
+    Half-lives from ``epoch`` to ``moment``.
+    """
+    return (moment - epoch) / _half_life()
+
+
+def weight(moment, epoch):
+    """
+    Trending weight of a vote cast at ``moment``.
+    """
+    return 2 ** exponent(moment, epoch)
+
+
+def current_epoch(lock=False, shared=False):
+    """
+    Start of the current score scale; with ``lock``, the row is locked until
+    the end of the transaction. ``shared`` takes the lock in share mode
+    where the database has one (PostgreSQL), so writers holding it only wait
+    for a compaction, not for each other.
+    """
+    from .models import ScoreEpoch
+
+    if lock and shared and connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(ScoreEpoch._meta.db_table)
+        rows = ScoreEpoch.objects.raw(
+            f'SELECT id, started_at FROM {table} WHERE id = %s FOR SHARE', [ScoreEpoch.SINGLETON_ID],
+        )
+        epoch = next((row.started_at for row in rows), None)
+    else:
+        queryset = ScoreEpoch.objects.select_for_update() if lock else ScoreEpoch.objects
+        epoch = queryset.filter(pk=ScoreEpoch.SINGLETON_ID).values_list('started_at', flat=True).first()
+    if epoch is None:
+        epoch, _ = ScoreEpoch.objects.get_or_create(pk=ScoreEpoch.SINGLETON_ID, defaults={'started_at': timezone.now()})
+        epoch = epoch.started_at
+    return epoch
+
+
+def decayed(trending, epoch, now=None):
+    """
+    Convert a stored trending score to vote units as of ``now``.
+    """
+    # The inverse weight, which underflows to zero instead of overflowing
+    return trending * weight(epoch, now or timezone.now())
+
+
+def ensure(photo_ids):
+    """
+    Create missing score rows (``bulk_create`` of photos skips the signal).
+    """
+    from .models import PhotoScore
+
+    PhotoScore.objects.bulk_create([PhotoScore(photo_id=photo_id) for photo_id in photo_ids], ignore_conflicts=True)
+
+
+def _case(field, deltas, output_field):
+    whens = [When(photo_id=photo_id, then=Value(delta)) for photo_id, delta in deltas.items() if delta]
+    if not whens:
+        return F(field)
+    return F(field) + Case(*whens, default=Value(0), output_field=output_field)
+
+
+def record(counter_deltas):
+    """
+    Apply interaction counter changes to the scores.
+
+    Args:
+        counter_deltas: Dict mapping photo ids to ``{interaction_type: delta}``
+                        as applied to the like/dislike counters
+    """
+    from .models import PhotoScore
+
+    net = {
+        photo_id: deltas.get('like', 0) - deltas.get('dislike', 0)
+        for photo_id, deltas in counter_deltas.items()
+    }
+    net = {photo_id: delta for photo_id, delta in net.items() if delta}
+    if not net:
+        return
+    if exponent(timezone.now(), current_epoch()) > COMPACT_EXPONENT:
+        # Before taking the epoch lock in share mode, which compact() would
+        # have to upgrade
+        compact(min_exponent=COMPACT_EXPONENT)
+    with transaction.atomic():
+        # The epoch stays locked until the scores are written, see compact()
+        vote_weight = weight(timezone.now(), current_epoch(lock=True, shared=True))
+        ensure(net)
+        PhotoScore.objects.filter(photo_id__in=net).update(
+            top=_case('top', net, IntegerField()),
+            trending=_case('trending', {photo_id: delta * vote_weight for photo_id, delta in net.items()}, FloatField()),
+            updated_at=timezone.now(),
+        )
+
+
+def compact(min_exponent=None):
+    """
+    Move the epoch to now and rescale every trending score to it. Returns
+    the number of rescaled rows.
+
+    With ``min_exponent``, only compacts if the epoch is still more than
+    that many half-lives old once locked (another process may have
+    compacted meanwhile), else returns 0.
+    """
+    from .models import Photo, PhotoScore, ScoreEpoch
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Writers hold a shared lock on the epoch until they commit; taking
+        # it exclusively waits for them and keeps new ones from adding
+        # weights of the old scale to rescaled rows
+        epoch = current_epoch(lock=True)
+        if min_exponent is not None and exponent(now, epoch) <= min_exponent:
+            return 0
+        ensure(Photo.objects.filter(score__isnull=True).values_list('pk', flat=True))
+        factor = weight(epoch, now)
+        rescaled = PhotoScore.objects.exclude(trending=0).update(trending=F('trending') * factor)
+        PhotoScore.objects.filter(Q(trending__gt=-NEGLIGIBLE) & Q(trending__lt=NEGLIGIBLE)).exclude(
+            trending=0,
+        ).update(trending=0)
+        ScoreEpoch.objects.filter(pk=ScoreEpoch.SINGLETON_ID).update(started_at=now)
+    return rescaled
+
+
+def rebuild_top():
+    """
+    Recompute ``top`` from the photo counters (see
+    ``manage.py rebuild_photo_counters``).
+    """
+    from .models import Photo, PhotoScore
+
+    ensure(Photo.objects.filter(score__isnull=True).values_list('pk', flat=True))
+    net = Photo.objects.filter(pk=OuterRef('photo_id')).values(
+        net=F('like_count') - F('dislike_count'),
+    )
+    PhotoScore.objects.update(top=Subquery(net, output_field=IntegerField()))
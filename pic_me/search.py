@@ -0,0 +1,215 @@
+"""
+Full-text search over photo titles, descriptions and tag names.
+
+SQLite uses an FTS5 virtual table (``pic_me_photo_fts``) keyed by photo id;
+PostgreSQL uses a side table of weighted ``tsvector`` documents
+(``pic_me_photo_search``) with a GIN index. Both are created by migration
+0006 and kept in sync by the signal handlers in ``models.py``. On any other
+database, or if the index table is missing, search falls back to
+``icontains`` filters.
+
+Weights: title > description > tags.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
+
+from .pagination import filter_pk_in
+
+FTS_TABLE = 'pic_me_photo_fts'
+TSVECTOR_TABLE = 'pic_me_photo_search'
+
+# Annotation added by rank_photos(), higher is more relevant
+RANK = 'search_rank'
+
+# Maximum number of query terms passed to the index
+MAX_TERMS = 8
+
+# Column weights for bm25() on SQLite: title, description, tags
+SQLITE_WEIGHTS = (10.0, 4.0, 2.0)
+
+SQLITE_DOCUMENTS_SQL = """
+    SELECT p.id, p.title, p.description,
+           COALESCE((SELECT group_concat(t.name, ' ')
+                     FROM pic_me_photo_tags pt JOIN pic_me_tag t ON t.id = pt.tag_id
+                     WHERE pt.photo_id = p.id), '')
+    FROM pic_me_photo p
+"""
+
+POSTGRES_DOCUMENTS_SQL = """
+    SELECT p.id,
+           setweight(to_tsvector('english', p.title), 'A') ||
+           setweight(to_tsvector('english', p.description), 'B') ||
+           setweight(to_tsvector('english', COALESCE((
+               SELECT string_agg(t.name, ' ')
+               FROM pic_me_photo_tags pt JOIN pic_me_tag t ON t.id = pt.tag_id
+               WHERE pt.photo_id = p.id), '')), 'C')
+    FROM pic_me_photo p
+"""
+
+_available = {}
+
+
+def backend():
+    """
+    Return 'sqlite', 'postgresql' or None if no full-text index is available.
+    """
+    vendor = connection.vendor
+    if vendor not in _available:
+        tables = connection.introspection.table_names()
+        if vendor == 'sqlite':
+            _available[vendor] = FTS_TABLE in tables
+        elif vendor == 'postgresql':
+            _available[vendor] = TSVECTOR_TABLE in tables
+        else:
+            _available[vendor] = False
+    return vendor if _available[vendor] else None
+
+
+def terms(query):
+    """
+    Split a user query into lowercase word terms safe to embed in an
+    FTS5 or tsquery expression.
+    """
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _match_expression(query):
+    words = terms(query)
+    if not words:
+        return None
+    if backend() == 'sqlite':
+        # Every term must match, each as a prefix
+        return ' '.join(f'"{word}"*' for word in words)
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def _in_clause(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def index_photos(photo_ids):
+    """
+    (Re)build the search documents of the given photos.
+    """
+    photo_ids = [int(pk) for pk in photo_ids]
+    if not photo_ids or not backend():
+        return
+    placeholders = _in_clause(photo_ids)
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', photo_ids)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, tags) '
+                f'{SQLITE_DOCUMENTS_SQL} WHERE p.id IN ({placeholders})',
+                photo_ids,
+            )
+        else:
+            cursor.execute(f'DELETE FROM {TSVECTOR_TABLE} WHERE photo_id IN ({placeholders})', photo_ids)
+            cursor.execute(
+                f'INSERT INTO {TSVECTOR_TABLE} (photo_id, document) '
+                f'{POSTGRES_DOCUMENTS_SQL} WHERE p.id IN ({placeholders})',
+                photo_ids,
+            )
+
+
+def remove_photos(photo_ids):
+    """
+    Drop the search documents of deleted photos.
+    """
+    photo_ids = [int(pk) for pk in photo_ids]
+    if not photo_ids or not backend():
+        return
+    table, column = (FTS_TABLE, 'rowid') if backend() == 'sqlite' else (TSVECTOR_TABLE, 'photo_id')
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({_in_clause(photo_ids)})', photo_ids)
+
+
+def rebuild_index():
+    """
+    Recreate every search document from the photo and tag tables.
+    Returns the number of indexed photos.
+    """
+    if not backend():
+        return 0
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, title, description, tags) {SQLITE_DOCUMENTS_SQL}')
+        else:
+            cursor.execute(f'DELETE FROM {TSVECTOR_TABLE}')
+            cursor.execute(f'INSERT INTO {TSVECTOR_TABLE} (photo_id, document) {POSTGRES_DOCUMENTS_SQL}')
+        return cursor.rowcount
+
+
+def _matching_ids(match):
+    if backend() == 'sqlite':
+        return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+    return RawSQL(
+        f"SELECT photo_id FROM {TSVECTOR_TABLE} WHERE document @@ to_tsquery('english', %s)",
+        (match,),
+    )
+
+
+def search_photos(queryset, query):
+    """
+    Restrict a Photo queryset to photos matching ``query``.
+
+    The queryset keeps its own ordering, so it can still be paginated by
+    date; the filter leaves the plan to that ordering, see
+    ``pagination.filter_pk_in()``. Use ``rank_photos()`` for relevance order.
+    """
+    match = _match_expression(query)
+    if match is None:
+        return queryset
+    if not backend():
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(tags__name__icontains=query)
+        ).distinct()
+    return filter_pk_in(queryset, _matching_ids(match))
+
+
+def ranks(query):
+    """
+    Whether ``rank_photos()`` ranks the matches of ``query``, which needs
+    query terms and a full-text index.
+    """
+    return _match_expression(query) is not None and backend() is not None
+
+
+def rank_photos(queryset, query):
+    """
+    Annotate a Photo queryset with ``search_rank``, the relevance of each
+    photo to ``query`` (higher is better), for ordering and keyset cursors.
+
+    The queryset is also restricted to the matching photos, looked up by
+    id: ordered by relevance, every match has to be ranked anyway, so it
+    needs no ``search_photos()`` filter. Without query terms or a full-text
+    index it is returned unchanged.
+    """
+    if not ranks(query):
+        return queryset
+    match = _match_expression(query)
+    if backend() == 'sqlite':
+        # bm25() is lower for better matches
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = pic_me_photo.id',
+            (match,),
+            output_field=FloatField(),
+        )
+    else:
+        rank = RawSQL(
+            f"SELECT ts_rank(document, to_tsquery('english', %s)) FROM {TSVECTOR_TABLE} "
+            f"WHERE photo_id = pic_me_photo.id",
+            (match,),
+            output_field=FloatField(),
+        )
+    queryset = queryset.filter(pk__in=_matching_ids(match))
+    return queryset.annotate(**{RANK: Coalesce(rank, Value(0.0))})
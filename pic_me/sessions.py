@@ -0,0 +1,110 @@
+"""
+Session engine: cached sessions written through to the database.
+
+``SessionMiddleware`` saves a session whenever request code marks it
+modified, and Django's ``cached_db`` engine then writes both the cache and
+the ``django_session`` row, even when the values set are the ones already
+stored (``login()`` of the same user, views re-setting a flag). This store
+remembers the serialized data it loaded and skips the save when it is
+unchanged, so most requests only read the session, and only from the cache
+(``SESSION_CACHE_ALIAS``). The database row keeps sessions alive across
+cache restarts and evictions.
+
+A new session key (first save, ``cycle_key()`` on login) is always written,
+as is every session while ``SESSION_SAVE_EVERY_REQUEST`` is enabled.
+
+Expired rows are deleted in batches by ``clear_expired()`` (used by
+Django's ``clearsessions``) and ``manage.py clean_sessions``, instead of one
+``DELETE`` locking the whole expired range.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.utils import timezone
+
+from . import metrics
+
+KEY_PREFIX = 'picme.sessions'
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # Serialized data as loaded, None until loaded or after a new key
+        self._stored_state = None
+
+    def _state(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        data = super().load()
+        self._stored_state = self._state(data) if self.session_key else None
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._stored_state = self._state(data) if self.session_key else None
+        return data
+
+    def _unchanged(self, must_create):
+        return (
+            not must_create
+            and not settings.SESSION_SAVE_EVERY_REQUEST
+            and self.session_key is not None
+            and self._stored_state is not None
+            and self._state(self._session) == self._stored_state
+        )
+
+    def save(self, must_create=False):
+        if self._unchanged(must_create):
+            metrics.increment('sessions.skipped_writes')
+            return
+        super().save(must_create)
+        self._stored_state = self._state(self._session)
+        metrics.increment('sessions.writes')
+
+    async def asave(self, must_create=False):
+        if self._unchanged(must_create):
+            metrics.increment('sessions.skipped_writes')
+            return
+        await super().asave(must_create)
+        self._stored_state = self._state(self._session)
+        metrics.increment('sessions.writes')
+
+    @classmethod
+    def clear_expired(cls):
+        delete_expired()
+
+
+def delete_expired(batch_size=None, pause=0.0):
+    """
+    Delete expired session rows, at most ``batch_size`` per statement.
+
+    Args:
+        batch_size: Rows per ``DELETE`` (default ``PICME_SESSION_CLEANUP_BATCH``)
+        pause: Seconds to sleep between batches, leaving room for other writers
+
+    Returns:
+        The number of sessions deleted.
+    """
+    model = SessionStore.get_model_class()
+    batch_size = batch_size or settings.PICME_SESSION_CLEANUP_BATCH
+    cutoff = timezone.now()
+    deleted = 0
+    while True:
+        # Walks the expire_date index; the cutoff is fixed so the loop ends
+        keys = list(
+            model.objects.filter(expire_date__lt=cutoff)
+            .order_by('expire_date')
+            .values_list('session_key', flat=True)[:batch_size]
+        )
+        if not keys:
+            return deleted
+        deleted += model.objects.filter(session_key__in=keys).delete()[0]
+        if len(keys) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
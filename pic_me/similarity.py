@@ -0,0 +1,191 @@
+"""
+Near-duplicate detection with perceptual hashes.
+
+Every photo gets a 64-bit difference hash (dHash, ``dhash()``): the image
+is shrunk to 9x8 grey pixels and each bit records whether a pixel is
+brighter than its right neighbour. Re-encoding, resizing or mild colour
+changes flip only a few bits, so near-duplicates are hashes within a small
+Hamming distance of each other.
+
+Hashes are stored in ``PhotoHash`` together with their four 16-bit bands,
+each indexed (multi-index hashing). Two hashes at most ``d`` bits apart
+differ by at most ``d // 4`` bits in at least one band, so all matches are
+among the rows sharing one band value within that radius of the query's.
+``similar()`` looks those up through the band indexes and ranks the few
+candidates by their exact distance, instead of comparing against every
+photo.
+"""
+import logging
+from itertools import combinations
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import ingest
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Upper bound on the rows read per lookup, for degenerate hashes (e.g.
+# flat images, which all hash to zero) shared by very many photos
+MAX_CANDIDATES = 1000
+
+DECODE_ERRORS = (OSError, SyntaxError, ValueError, UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def dhash(image):
+    """
+    64-bit difference hash of a Pillow image, as an unsigned int.
+    """
+    grey = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hash_file(fileobj):
+    """
+    dHash of an image file; JPEGs are decoded at reduced scale.
+    """
+    image = ingest.open_image(fileobj, draft=('L', (64, 64)))
+    image.seek(0)
+    return dhash(image)
+
+
+def bands(value):
+    """
+    The 16-bit bands of a hash, most significant first.
+    """
+    return [(value >> (BAND_BITS * (BANDS - 1 - i))) & BAND_MASK for i in range(BANDS)]
+
+
+def to_signed(value):
+    """
+    Store an unsigned 64-bit hash in a signed BIGINT column.
+    """
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def distance(a, b):
+    """
+    Hamming distance between two hashes.
+    """
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def _neighbours(band, radius):
+    """
+    Every band value at most ``radius`` bits away from ``band``.
+    """
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), flips):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def store(photo, value):
+    """
+    Record the hash of a photo's current image.
+    """
+    from .models import PhotoHash
+
+    PhotoHash.objects.update_or_create(photo_id=photo.pk, defaults=PhotoHash.fields_for(value, photo.image.name))
+    return value
+
+
+def ensure_hash(photo, fileobj=None):
+    """
+    Hash of a photo's current image, computed (from ``fileobj`` if given,
+    else the stored image) and recorded unless already known. Returns None
+    if the image cannot be decoded.
+    """
+    from .models import PhotoHash
+
+    if not photo.image:
+        PhotoHash.objects.filter(photo_id=photo.pk).delete()
+        return None
+    known = PhotoHash.objects.filter(photo_id=photo.pk, source=photo.image.name).values_list('hash', flat=True).first()
+    if known is not None:
+        return to_unsigned(known)
+    try:
+        if fileobj is not None:
+            value = hash_file(fileobj)
+        else:
+            with photo.image.open('rb') as f:
+                value = hash_file(f)
+    except DECODE_ERRORS:
+        logger.exception('Could not hash the image of photo %s', photo.pk)
+        return None
+    return store(photo, value)
+
+
+def candidates(value, max_distance):
+    """
+    ``PhotoHash`` rows sharing a band value within the band radius with
+    ``value``: a superset of the hashes within ``max_distance`` bits.
+    """
+    from .models import PhotoHash
+
+    radius = max_distance // BANDS
+    match = Q()
+    for i, band in enumerate(bands(value)):
+        match |= Q(**{f'band{i}__in': _neighbours(band, radius)})
+    return PhotoHash.objects.filter(match)
+
+
+def similar(value, max_distance=None, exclude=None, limit=None):
+    """
+    Photos whose hash is within ``max_distance`` bits of ``value``.
+
+    Returns ``[(photo_id, distance)]``, closest first (newest first among
+    equals), at most ``limit`` long.
+    """
+    if max_distance is None:
+        max_distance = settings.PICME_SIMILAR_MAX_DISTANCE
+    rows = candidates(value, max_distance)
+    if exclude is not None:
+        rows = rows.exclude(photo_id=exclude)
+    found = []
+    for photo_id, other in rows.values_list('photo_id', 'hash')[:MAX_CANDIDATES]:
+        bits = distance(value, other)
+        if bits <= max_distance:
+            found.append((photo_id, bits))
+    found.sort(key=lambda item: (item[1], -item[0]))
+    return found[:limit]
+
+
+def similar_photos(photo, limit=None):
+    """
+    Near-duplicates of a saved photo, closest first, with ``distance`` set.
+    """
+    from .models import Photo, PhotoHash
+
+    value = PhotoHash.objects.filter(photo_id=photo.pk).values_list('hash', flat=True).first()
+    if value is None:
+        return []
+    matches = similar(to_unsigned(value), exclude=photo.pk, limit=limit)
+    photos = Photo.objects.only('id', 'title', 'image', 'renditions').in_bulk([photo_id for photo_id, _ in matches])
+    found = []
+    for photo_id, bits in matches:
+        if photo_id in photos:
+            photos[photo_id].distance = bits
+            found.append(photos[photo_id])
+    return found
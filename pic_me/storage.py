@@ -0,0 +1,311 @@
+"""
+Content-addressed storage for uploaded images.
+
+Files are named by the SHA-256 of their content
+(``photos/ab/ab12...ef.jpg``), so identical uploads are stored once. Every
+stored file has a ``Blob`` row that counts the model fields referencing it
+and remembers the work already done for that content (validation, EXIF
+stripping, renditions). Releasing the last reference only marks a blob as
+unused; ``manage.py collect_blobs`` deletes unused blobs after a grace
+period, which keeps a concurrent identical upload from losing its file.
+
+``StaticStorage`` is the static files storage: WhiteNoise's hashed and
+compressed copies, falling back to plain names before collectstatic ran.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+CONTENT_NAME_RE = re.compile(r'^(?P<digest>[0-9a-f]{64})(?:\.[A-Za-z0-9]+)?$')
+
+
+def upload_directory(name):
+    """
+    Return the directory a file was uploaded to, without the shard
+    directory of content-addressed names (``photos/ab/ab12...ef.jpg`` ->
+    ``photos``).
+    """
+    directory, filename = posixpath.split(name.replace('\\', '/'))
+    match = CONTENT_NAME_RE.match(filename)
+    if match and posixpath.basename(directory) == match.group('digest')[:2]:
+        directory = posixpath.dirname(directory)
+    return directory
+
+
+def hash_content(content):
+    """Return the SHA-256 hex digest of a File, reading it in chunks."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files by content hash and never writes
+    the same content twice.
+
+    Uploads that already know their digest (e.g. chunked uploads, which
+    hash while receiving) can set a ``sha256`` attribute on the content to
+    skip rehashing.
+    """
+
+    def content_name(self, name, digest):
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(upload_directory(name), digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = getattr(content, 'sha256', None) or hash_content(content)
+        name = self.content_name(name, digest)
+        validate_file_name(name, allow_relative_path=True)
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+
+        # Write to a temporary file and hard-link it into place, so readers
+        # never see a partial file and a concurrent identical upload is a no-op
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            try:
+                os.link(temp_path, full_path)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(temp_path)
+        return name
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def image_storage():
+    """Storage callable for image fields (keeps migrations stable)."""
+    return content_addressed_storage
+
+
+def retain(name):
+    """
+    Add a reference to the blob stored under ``name``.
+    """
+    from .models import Blob
+
+    if not name:
+        return
+    if Blob.objects.filter(name=name).update(refcount=F('refcount') + 1, updated_at=timezone.now()):
+        return
+    size = content_addressed_storage.size(name) if content_addressed_storage.exists(name) else 0
+    blob, created = Blob.objects.get_or_create(name=name, defaults={'refcount': 1, 'size': size})
+    if not created:
+        Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1, updated_at=timezone.now())
+
+
+def release(name):
+    """
+    Drop a reference to the blob stored under ``name``. The file is kept
+    until ``collect_blobs`` finds it unused for longer than the grace period.
+    """
+    from .models import Blob
+
+    if name:
+        Blob.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, updated_at=timezone.now()
+        )
+
+
+def retain_many(names):
+    """
+    Bulk variant of ``retain()``: add one reference per occurrence of each
+    name, with a constant number of queries per distinct count.
+    """
+    from .models import Blob
+
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    existing = set(Blob.objects.filter(name__in=counts).values_list('name', flat=True))
+    Blob.objects.bulk_create(
+        [
+            Blob(name=name, size=content_addressed_storage.size(name) if content_addressed_storage.exists(name) else 0)
+            for name in counts if name not in existing
+        ],
+        ignore_conflicts=True,
+    )
+    by_count = defaultdict(list)
+    for name, count in counts.items():
+        by_count[count].append(name)
+    now = timezone.now()
+    for count, group in by_count.items():
+        Blob.objects.filter(name__in=group).update(refcount=F('refcount') + count, updated_at=now)
+
+
+def swap_reference(old_name, new_name):
+    """Move one reference from ``old_name`` to ``new_name``."""
+    if old_name != new_name:
+        retain(new_name)
+        release(old_name)
+
+
+def mark_processed(name, replaced_by=''):
+    """
+    Record that the background pipeline finished for the content stored
+    under ``name``, optionally pointing at the EXIF-stripped replacement.
+    """
+    from .models import Blob
+
+    Blob.objects.filter(name=name).update(processed=True, replaced_by=replaced_by)
+    if replaced_by:
+        Blob.objects.filter(name=replaced_by).update(processed=True)
+
+
+def record_renditions(name, renditions):
+    """
+    Remember the renditions generated for a blob so identical uploads can
+    reuse them, and hold a reference on each rendition file.
+    """
+    from .models import Blob
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        previous = set(rendition_names(blob.renditions))
+        current = set(rendition_names(renditions))
+        for rendition in current - previous:
+            retain(rendition)
+        for rendition in previous - current:
+            release(rendition)
+        Blob.objects.filter(pk=blob.pk).update(renditions=renditions)
+
+
+def record_processed_many(renditions_by_name):
+    """
+    Mark blobs processed and remember their renditions in bulk, for
+    content that went through the whole pipeline outside the job queue
+    (e.g. ``manage.py import_photos``).
+    """
+    from .models import Blob
+
+    if not renditions_by_name:
+        return
+    with transaction.atomic():
+        blobs = list(Blob.objects.select_for_update().filter(name__in=renditions_by_name))
+        retained = []
+        changed = []
+        for blob in blobs:
+            renditions = renditions_by_name[blob.name]
+            if renditions and blob.renditions.get('source') != blob.name:
+                retained.extend(rendition_names(renditions))
+                blob.renditions = renditions
+            blob.processed = True
+            changed.append(blob)
+        Blob.objects.bulk_update(changed, ['processed', 'renditions'], batch_size=500)
+        retain_many(retained)
+
+
+def rendition_names(renditions):
+    return [
+        entry[format_key]
+        for key, entry in renditions.items()
+        if isinstance(entry, dict)
+        for format_key in ('jpeg', 'webp')
+        if format_key in entry
+    ]
+
+
+def processed_blob(name):
+    """
+    Return the Blob holding the fully processed version of the content
+    stored under ``name`` (following an EXIF-stripping replacement), or
+    None if the content still has to go through the pipeline.
+    """
+    from .models import Blob
+
+    blob = Blob.objects.filter(name=name).first()
+    if blob is not None and blob.replaced_by:
+        blob = Blob.objects.filter(name=blob.replaced_by).first()
+    if blob is None or not blob.processed or not content_addressed_storage.exists(blob.name):
+        return None
+    return blob
+
+
+def collect(grace=timedelta(hours=1)):
+    """
+    Delete blobs that have been unreferenced for longer than ``grace``,
+    together with their files. Returns the number of deleted blobs.
+
+    Renditions of a deleted source blob are only released here, so they
+    are collected by a later run once their own grace period has passed.
+    """
+    from .models import Blob
+
+    cutoff = timezone.now() - grace
+    deleted = 0
+    for blob in Blob.objects.filter(refcount__lte=0, updated_at__lt=cutoff).iterator():
+        with transaction.atomic():
+            # Re-check under the delete: a new reference may have arrived
+            if not Blob.objects.filter(pk=blob.pk, refcount__lte=0).delete()[0]:
+                continue
+            for rendition in rendition_names(blob.renditions):
+                release(rendition)
+        content_addressed_storage.delete(blob.name)
+        deleted += 1
+    return deleted
+
+
+def known_renditions(name):
+    """
+    Return the renditions already generated for the content stored under
+    ``name``, or an empty dict.
+    """
+    from .models import Blob
+
+    blob = Blob.objects.filter(name=name).only('renditions').first()
+    if blob is None or blob.renditions.get('source') != name:
+        return {}
+    return blob.renditions
+
+
+class StaticStorage(CompressedManifestStaticFilesStorage):
+    """
+    Content-hashed static files from the ``staticfiles.json`` manifest.
+    Files missing from it, such as all of them on a fresh checkout or in
+    tests, are linked by their plain name instead of failing the page;
+    run collectstatic to get the hashed, immutable URLs.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
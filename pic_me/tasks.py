@@ -0,0 +1,132 @@
+"""
+Background job handlers for image processing.
+
+Uploads are processed as a chain of jobs: ``image.validate`` checks that the
+file really is an image, ``image.strip_exif`` removes EXIF metadata (applying
+the orientation first), then ``photo.renditions`` builds the thumbnails of
+photos and ``profile.avatars`` the avatar crops of profile pictures. Each
+step enqueues the next one on success.
+
+Outcomes are recorded on the content-addressed ``Blob`` of the file (see
+``pic_me.storage``), so later uploads of identical content skip the chain.
+"""
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import fragments, ingest
+from . import storage as blob_storage
+from .jobs import PermanentJobError, enqueue, job_handler
+
+EXIF_ORIENTATION = 0x0112
+
+
+def enqueue_image_pipeline(instance, field_name):
+    """
+    Queue background processing for a freshly saved image field.
+    """
+    enqueue('image.validate', model=instance._meta.label, pk=instance.pk, field=field_name)
+
+
+def _field_file(model, pk, field):
+    Model = apps.get_model(model)
+    instance = Model.objects.filter(pk=pk).first()
+    if instance is None:
+        raise PermanentJobError(f'{model} {pk} no longer exists.')
+    field_file = getattr(instance, field)
+    if not field_file:
+        raise PermanentJobError(f'{model} {pk} has no file in {field}.')
+    return instance, field_file
+
+
+def _next_step(instance, field):
+    if instance._meta.label == 'pic_me.Photo':
+        enqueue('photo.renditions', pk=instance.pk)
+    elif instance._meta.label == 'pic_me.UserProfile':
+        enqueue('profile.avatars', pk=instance.pk)
+
+
+@job_handler('image.validate')
+def validate_image(model, pk, field):
+    instance, field_file = _field_file(model, pk, field)
+    try:
+        with field_file.open('rb') as f:
+            ingest.inspect(f)
+            Image.open(f).verify()
+    except (ingest.ImageRejected, UnidentifiedImageError, SyntaxError, Image.DecompressionBombError) as exc:
+        raise PermanentJobError(f'{field_file.name} is not a valid image: {exc}') from exc
+    enqueue('image.strip_exif', model=model, pk=pk, field=field)
+
+
+def strip_metadata(fileobj):
+    """
+    Return the image in ``fileobj`` re-encoded without EXIF metadata (with
+    the orientation applied), or None if there is nothing to strip.
+    """
+    image = ingest.open_image(fileobj)
+    image_format = image.format
+    if not image.getexif() and 'exif' not in image.info:
+        return None
+    if image_format == 'GIF':
+        # Re-encoding would flatten animations; GIFs carry no EXIF anyway
+        return None
+    image.load()
+
+    # Saving without the exif argument drops the metadata; re-encode losslessly
+    # where possible and only pay a generation loss when rotating
+    options = {}
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+        if image_format == 'JPEG':
+            options['quality'] = 90
+    elif image_format == 'JPEG':
+        options['quality'] = 'keep'
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+@job_handler('image.strip_exif')
+def strip_exif(model, pk, field):
+    instance, field_file = _field_file(model, pk, field)
+    with field_file.open('rb') as f:
+        stripped = strip_metadata(f)
+    if stripped is None:
+        blob_storage.mark_processed(field_file.name)
+        _next_step(instance, field)
+        return
+
+    old_name = field_file.name
+    new_name = field_file.storage.save(old_name, ContentFile(stripped))
+    type(instance).objects.filter(pk=pk).update(**{field: new_name})
+    # Other rows may still share the original; collect_blobs removes it
+    # once it is unreferenced
+    blob_storage.swap_reference(old_name, new_name)
+    blob_storage.mark_processed(old_name, replaced_by=new_name if new_name != old_name else '')
+    if instance._meta.label == 'pic_me.Photo':
+        fragments.bump_photos([pk])
+    _next_step(instance, field)
+
+
+@job_handler('photo.renditions')
+def photo_renditions(pk):
+    Photo = apps.get_model('pic_me.Photo')
+    photo = Photo.objects.filter(pk=pk).first()
+    if photo is None:
+        raise PermanentJobError(f'Photo {pk} no longer exists.')
+    if photo.renditions.get('source') != photo.image.name:
+        photo.refresh_renditions(fail_silently=False)
+
+
+@job_handler('profile.avatars')
+def profile_avatars(pk):
+    UserProfile = apps.get_model('pic_me.UserProfile')
+    profile = UserProfile.objects.filter(pk=pk).first()
+    if profile is None:
+        raise PermanentJobError(f'Profile {pk} no longer exists.')
+    if profile.profile_picture and profile.avatars.get('source') != profile.profile_picture.name:
+        profile.refresh_avatars(fail_silently=False)
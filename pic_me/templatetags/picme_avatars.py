@@ -0,0 +1,41 @@
+from django import template
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.html import format_html, format_html_join
+
+from pic_me import avatars
+
+register = template.Library()
+
+
+def _avatar_url(user, profile, size):
+    if profile is None:
+        return avatars.identicon_url(user.pk, size)
+    return profile.avatar_url(size)
+
+
+@register.simple_tag
+def avatar(user, size=64, **attrs):
+    """
+    Square avatar ``<img>`` of ``user`` at ``size`` pixels, with a 2x
+    source where a larger crop exists. Extra keyword arguments become
+    attributes.
+
+    Usage::
+
+        {% avatar photo.uploaded_by 32 style="margin-right: 0.5rem;" %}
+
+    Load the user's profile with the user (``select_related``) where many
+    avatars are shown.
+    """
+    try:
+        profile = user.profile
+    except ObjectDoesNotExist:
+        profile = None
+    src = _avatar_url(user, profile, size)
+    retina = _avatar_url(user, profile, size * 2) if size * 2 <= avatars.AVATAR_SIZES[-1] else src
+    style = f"width: {size}px; height: {size}px; border-radius: 50%; object-fit: cover; {attrs.pop('style', '')}"
+    return format_html(
+        '<img src="{}" srcset="{} 2x" width="{}" height="{}" alt="{}" style="{}"{}>',
+        src, retina, size, size, user.username, style.strip(),
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
@@ -0,0 +1,45 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from pic_me import fragments
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, key):
+        self.nodelist = nodelist
+        self.key = key
+
+    def render(self, context):
+        key = self.key.resolve(context)
+        prefetched = context.get('prefetched_fragments')
+        if prefetched is not None:
+            html = prefetched.get(key)
+        else:
+            html = fragments.get(key)
+        if html is None:
+            html = self.nodelist.render(context)
+            fragments.store(key, html)
+        return mark_safe(html)
+
+
+@register.tag('fragment')
+def do_fragment(parser, token):
+    """
+    Cache the enclosed template output in the fragment cache under ``key``.
+
+    Usage::
+
+        {% fragment photo.card_cache_key %} ... {% endfragment %}
+
+    If the view put a ``prefetched_fragments`` dict in the context (see
+    ``fragments.get_many``), lookups are served from it instead of one cache
+    round-trip per fragment.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires exactly one argument (the cache key).")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]))
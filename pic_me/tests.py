@@ -1,3 +1,1531 @@
-from django.test import TestCase
+import base64
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import avatars, fragments, hashers, ingest, interactions, jobs, media, pagination, querybudget, renditions, scores, search, sessions, similarity, storage, uploads, usercache, views, writebehind
+from .models import Blob, CustomUser, Job, Photo, PhotoInteraction, PhotoScore, ScoreEpoch, Tag, UploadSession, UserProfile
+from .templatetags import picme_avatars
+
+
+class PicMeTestCase(TestCase):
+    """
+    Stores uploads in a temporary MEDIA_ROOT, removed after the class.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp(prefix='picme-test-media-')
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+    @staticmethod
+    def create_user(name):
+        return CustomUser.objects.create_user(email=f'{name}@example.com', username=name, password='secret-pw-1')
+
+    @staticmethod
+    def create_photo(owner, title='Photo', **kwargs):
+        return Photo.create_with_placeholder(title, '', owner, **kwargs)
+
+    @staticmethod
+    def image_bytes(width=32, height=32, color='red', format='PNG'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), color).save(buffer, format)
+        return buffer.getvalue()
+
+    @staticmethod
+    def counts(photo):
+        photo.refresh_from_db(fields=['like_count', 'dislike_count'])
+        return photo.like_count, photo.dislike_count
+
+
+class PhotoCounterTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.photo = self.create_photo(self.owner)
+
+    def test_toggle_creates_removes_and_flips(self):
+        self.assertEqual(PhotoInteraction.toggle(self.alice, self.photo, 'like'), 'created')
+        self.assertEqual(PhotoInteraction.toggle(self.bob, self.photo, 'dislike'), 'created')
+        self.assertEqual(self.counts(self.photo), (1, 1))
+
+        self.assertEqual(PhotoInteraction.toggle(self.bob, self.photo, 'like'), 'changed')
+        self.assertEqual(self.counts(self.photo), (2, 0))
+
+        self.assertEqual(PhotoInteraction.toggle(self.alice, self.photo, 'like'), 'removed')
+        self.assertEqual(self.counts(self.photo), (1, 0))
+        self.assertEqual(PhotoInteraction.objects.filter(photo=self.photo).count(), 1)
+
+    def test_deleting_a_user_withdraws_their_interactions(self):
+        PhotoInteraction.toggle(self.alice, self.photo, 'like')
+        PhotoInteraction.toggle(self.bob, self.photo, 'dislike')
+
+        self.alice.delete()
+
+        self.assertEqual(self.counts(self.photo), (0, 1))
+        self.assertEqual(PhotoInteraction.objects.filter(photo=self.photo).count(), 1)
+        self.assertEqual(PhotoScore.objects.get(pk=self.photo.pk).top, -1)
+
+    def test_rebuild_photo_counters_repairs_drift(self):
+        PhotoInteraction.toggle(self.alice, self.photo, 'like')
+        PhotoInteraction.toggle(self.bob, self.photo, 'like')
+        other = self.create_photo(self.owner, title='Other')
+        Photo.objects.filter(pk=self.photo.pk).update(like_count=7, dislike_count=3)
+        Photo.objects.filter(pk=other.pk).update(like_count=5)
+
+        call_command('rebuild_photo_counters', stdout=StringIO())
+
+        self.assertEqual(self.counts(self.photo), (2, 0))
+        self.assertEqual(self.counts(other), (0, 0))
+
+
+class TrendingScoreTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+        self.photo = self.create_photo(self.owner)
+
+    def age_epoch(self, half_lives):
+        started_at = scores.current_epoch() - half_lives * timedelta(hours=settings.PICME_TRENDING_HALF_LIFE)
+        ScoreEpoch.objects.filter(pk=ScoreEpoch.SINGLETON_ID).update(started_at=started_at)
+
+    def trending(self, photo):
+        return PhotoScore.objects.get(pk=photo.pk).trending
+
+    def test_votes_after_many_half_lives_compact_first(self):
+        older = self.create_photo(self.owner, title='Older')
+        PhotoInteraction.toggle(self.owner, older, 'like')
+        # Far past the point where 2 ** exponent overflows a float
+        self.age_epoch(2000)
+        self.assertEqual(scores.decayed(1.0, scores.current_epoch()), 0.0)
+
+        PhotoInteraction.toggle(self.owner, self.photo, 'like')
+
+        self.assertLess(abs(scores.exponent(timezone.now(), scores.current_epoch())), 0.01)
+        self.assertAlmostEqual(self.trending(self.photo), 1.0, places=2)
+        self.assertEqual(self.trending(older), 0)
+        self.assertEqual(PhotoScore.objects.get(pk=older.pk).top, 1)
+
+    def test_recent_epochs_are_not_compacted(self):
+        self.age_epoch(scores.COMPACT_EXPONENT - 1)
+        epoch = scores.current_epoch()
+        PhotoInteraction.toggle(self.owner, self.photo, 'like')
+        self.assertEqual(scores.current_epoch(), epoch)
+        self.assertEqual(scores.compact(min_exponent=scores.COMPACT_EXPONENT), 0)
+
+        self.assertEqual(scores.compact(), 1)
+        self.assertAlmostEqual(self.trending(self.photo), 1.0, places=2)
+
+
+def raw_cursor(values):
+    """A cursor token for arbitrary JSON, as a client could forge it."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+class KeysetPaginationTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+        self.nature = Tag.objects.create(name='Nature', slug='nature')
+        self.photos = [
+            self.create_photo(self.owner, title=f'Photo {index}', tags=[self.nature] if index % 2 else None)
+            for index in range(7)
+        ]
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('api_photo_list'), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        cursor = parse_qs(urlsplit(data['next']).query)['cursor'][0] if data['next'] else None
+        return [photo['id'] for photo in data['results']], cursor
+
+    def fetch_all(self, **params):
+        ids, cursor = self.fetch(**params)
+        while cursor:
+            more, cursor = self.fetch(cursor=cursor, **params)
+            ids += more
+        return ids
+
+    def test_pages_cover_every_photo_once_in_order(self):
+        newest_first = [photo.pk for photo in reversed(self.photos)]
+        self.assertEqual(self.fetch_all(page_size=3), newest_first)
+
+    def test_cursor_is_stable_when_photos_are_added(self):
+        first_page, cursor = self.fetch(page_size=3)
+        self.create_photo(self.owner, title='Newer')
+        self.create_photo(self.owner, title='Newest')
+
+        rest = []
+        while cursor:
+            more, cursor = self.fetch(page_size=3, cursor=cursor)
+            rest += more
+
+        self.assertEqual(first_page + rest, [photo.pk for photo in reversed(self.photos)])
+
+    def test_pages_keep_the_tag_filter(self):
+        tagged = [photo.pk for photo in reversed(self.photos) if photo.tags.exists()]
+        self.assertEqual(self.fetch_all(page_size=2, tag='nature'), tagged)
+
+    def test_pages_keep_tag_and_search_filters(self):
+        other = Tag.objects.create(name='Other', slug='other')
+        for photo in self.photos[:4]:
+            photo.tags.add(other)
+        both = [photo.pk for photo in reversed(self.photos[:4]) if self.nature in photo.tags.all()]
+        self.assertEqual(self.fetch_all(page_size=1, tag=['nature', 'other']), both)
+        self.assertEqual(
+            self.fetch_all(page_size=2, tag=['nature', 'other'], match='any'),
+            [photo.pk for photo in reversed(self.photos) if photo.tags.exists()],
+        )
+        if search.backend():
+            self.assertEqual(self.fetch_all(page_size=2, search='photo 3'), [self.photos[3].pk])
+
+    def test_tampered_cursors_are_rejected(self):
+        created_at = self.photos[0].created_at.isoformat()
+        for cursor in (
+            'not base64!', raw_cursor({'a': 1}), raw_cursor([1]), raw_cursor([1, 2]),
+            raw_cursor([{'a': 1}, 1]), raw_cursor([None, None]), raw_cursor([created_at, 'x']),
+            raw_cursor([created_at, 10 ** 23]), raw_cursor([created_at, True]),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('api_photo_list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                # The gallery falls back to the first page
+                self.assertEqual(self.client.get(reverse('home'), {'cursor': cursor}).status_code, 200)
+
+    def test_tampered_score_cursors_are_rejected(self):
+        photo_id = self.photos[0].pk
+        for sort in ('top', 'trending'):
+            for cursor in (
+                raw_cursor(['x', 'y']), raw_cursor(['x', photo_id]), raw_cursor([None, None]),
+                raw_cursor([[1], photo_id]), raw_cursor(['1e400', photo_id]),
+            ):
+                with self.subTest(sort=sort, cursor=cursor):
+                    response = self.client.get(reverse('api_photo_list'), {'sort': sort, 'cursor': cursor})
+                    self.assertEqual(response.status_code, 400)
+                    response = self.client.get(reverse('home'), {'sort': sort, 'cursor': cursor})
+                    self.assertEqual(response.status_code, 200)
+
+    def test_decode_cursor_round_trip(self):
+        photo = self.photos[3]
+        queryset = Photo.objects.all()
+        token = pagination.encode_cursor([photo.created_at, photo.pk])
+        self.assertEqual(
+            pagination.decode_cursor(token, queryset, ('-created_at', '-id')), [photo.created_at, photo.pk],
+        )
+
+
+class SearchRelevanceTests(PicMeTestCase):
+    def setUp(self):
+        owner = self.create_user('owner')
+        self.in_description = Photo.objects.create(
+            title='Harbour', description='An old lighthouse at dusk', uploaded_by=owner,
+            image=Photo.create_solid_image(),
+        )
+        self.in_title = Photo.objects.create(
+            title='Lighthouse', description='Seen from the pier', uploaded_by=owner,
+            image=Photo.create_solid_image(color=(1, 2, 3)),
+        )
+        self.unrelated = self.create_photo(owner, title='Forest')
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('api_photo_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_relevance_puts_title_matches_first(self):
+        data = self.fetch(search='lighthouse', sort='relevance')
+        self.assertEqual([photo['id'] for photo in data['results']], [self.in_title.pk, self.in_description.pk])
+
+    def test_relevance_pages_with_a_cursor(self):
+        data = self.fetch(search='lighthouse', sort='relevance', page_size=1)
+        self.assertEqual([photo['id'] for photo in data['results']], [self.in_title.pk])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([photo['id'] for photo in data['results']], [self.in_description.pk])
+        self.assertIsNone(data['next'])
+
+    def test_relevance_looks_up_the_matches_once(self):
+        for url in (reverse('api_photo_list'), reverse('home')):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.client.get(url, {'search': 'lighthouse', 'sort': 'relevance'})
+            (page,) = [query['sql'] for query in queries.captured_queries if search.RANK in query['sql']]
+            # Once to restrict the page to the matches, once to rank each one
+            self.assertEqual(page.count(' MATCH '), 2)
+
+    def test_relevance_without_a_query_sorts_by_date(self):
+        data = self.fetch(sort='relevance')
+        self.assertEqual(data['results'][0]['id'], self.unrelated.pk)
+
+    def test_home_sorts_by_relevance(self):
+        response = self.client.get(reverse('home'), {'search': 'lighthouse', 'sort': 'relevance'})
+        self.assertEqual([photo.pk for photo in response.context['photos']], [self.in_title.pk, self.in_description.pk])
+
+    def test_rank_requires_a_search_index(self):
+        self.assertIsNotNone(search.backend())
+        ranked = search.rank_photos(Photo.objects.all(), 'lighthouse')
+        self.assertIn(search.RANK, ranked.query.annotations)
+
+
+@override_settings(PICME_USER_CACHE_TTL=300)
+class UserCacheTests(PicMeTestCase):
+    """
+    A change made by another process is simulated by saving the user and
+    then restoring this process's (now stale) local snapshot.
+    """
+
+    def setUp(self):
+        usercache.clear()
+        caches[settings.PICME_USER_CACHE_ALIAS].clear()
+        self.user = self.create_user('alice')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def change_elsewhere(self, **fields):
+        stale = dict(usercache._entries)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        for name, value in fields.items():
+            setattr(user, name, value)
+        user.save()
+        usercache._entries.update(stale)
+
+    def test_cached_user_is_served_without_queries(self):
+        with self.assertNumQueries(0):
+            user = usercache.get_user(self.user.pk)
+        self.assertEqual(user.profile.user_id, self.user.pk)
+
+    def test_shared_snapshot_is_served_without_queries(self):
+        usercache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(usercache.get_user(self.user.pk).pk, self.user.pk)
+
+    def test_password_change_elsewhere_ends_the_session(self):
+        self.change_elsewhere(password=make_password('changed-pw-2'))
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 302)
+
+    def test_deactivation_elsewhere_ends_the_session(self):
+        self.change_elsewhere(is_active=False)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 302)
+
+
+@override_settings(PICME_SCRYPT_WORK_FACTOR=2**10)
+class PasswordRehashTests(PicMeTestCase):
+    def setUp(self):
+        self.alice = self.create_user('alice')
+
+    def login(self, password='secret-pw-1'):
+        return self.client.post(reverse('login'), {'email': 'alice@example.com', 'password': password})
+
+    def stored(self):
+        self.alice.refresh_from_db(fields=['password'])
+        return self.alice.password
+
+    def test_new_passwords_use_the_tuned_scrypt_cost(self):
+        self.assertTrue(self.stored().startswith('scrypt$1024$'))
+
+    def test_login_upgrades_pbkdf2_hashes_to_scrypt(self):
+        CustomUser.objects.filter(pk=self.alice.pk).update(
+            password=make_password('secret-pw-1', hasher='pbkdf2_sha256'),
+        )
+        self.assertRedirects(self.login(), reverse('home'), fetch_redirect_response=False)
+        self.assertTrue(self.stored().startswith('scrypt$1024$'))
+
+    def test_login_upgrades_the_cost(self):
+        with override_settings(PICME_SCRYPT_WORK_FACTOR=2**11):
+            self.assertEqual(self.login().status_code, 302)
+        self.assertTrue(self.stored().startswith('scrypt$2048$'))
+
+    def test_failed_logins_keep_the_hash(self):
+        old = make_password('secret-pw-1', hasher='pbkdf2_sha256')
+        CustomUser.objects.filter(pk=self.alice.pk).update(password=old)
+        self.assertEqual(self.login('wrong-password').status_code, 200)
+        self.assertEqual(self.stored(), old)
+
+    async def test_async_check_rehashes_in_the_pool(self):
+        user = await CustomUser.objects.aget(pk=self.alice.pk)
+        with override_settings(PICME_SCRYPT_WORK_FACTOR=2**11):
+            self.assertEqual(await hashers.acheck_password(user, 'secret-pw-1'), (True, True))
+            self.assertEqual(await hashers.acheck_password(user, 'secret-pw-1'), (True, False))
+            self.assertEqual(await hashers.acheck_password(user, 'wrong-password'), (False, False))
+        user = await CustomUser.objects.aget(pk=self.alice.pk)
+        self.assertTrue(user.password.startswith('scrypt$2048$'))
+
+
+class InteractionBatchTests(PicMeTestCase):
+    def setUp(self):
+        self.user = self.create_user('alice')
+        self.photos = [self.create_photo(self.user, title=f'Photo {index}') for index in range(3)]
+        self.client.force_login(self.user)
+
+    def post(self, body):
+        return self.client.post(
+            reverse('interact_batch'), body if isinstance(body, str) else json.dumps(body),
+            content_type='application/json',
+        )
+
+    def test_fold_applies_toggle_semantics(self):
+        self.assertEqual(interactions.fold(None, ['like']), 'like')
+        self.assertEqual(interactions.fold('like', ['like']), None)
+        self.assertEqual(interactions.fold('like', ['dislike']), 'dislike')
+        self.assertEqual(interactions.fold(None, ['like', 'dislike', 'dislike']), None)
+        self.assertEqual(interactions.fold(None, ['like', 'like', 'like']), 'like')
+
+    def test_batch_writes_final_states_with_one_upsert(self):
+        first, second, third = self.photos
+        PhotoInteraction.toggle(self.user, third, 'like')
+        operations = [
+            {'photo_id': first.pk, 'interaction_type': 'like'},
+            {'photo_id': second.pk, 'interaction_type': 'like'},
+            {'photo_id': second.pk, 'interaction_type': 'dislike'},
+            {'photo_id': third.pk, 'interaction_type': 'like'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({'operations': operations})
+        self.assertEqual(response.status_code, 200)
+
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "pic_me_photointeraction"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(response.json()['photos'], {
+            str(first.pk): {'interaction': 'like', 'like_count': 1, 'dislike_count': 0},
+            str(second.pk): {'interaction': 'dislike', 'like_count': 0, 'dislike_count': 1},
+            str(third.pk): {'interaction': None, 'like_count': 0, 'dislike_count': 0},
+        })
+        self.assertEqual(
+            dict(PhotoInteraction.objects.filter(user=self.user).values_list('photo_id', 'interaction_type')),
+            {first.pk: 'like', second.pk: 'dislike'},
+        )
+
+    def test_invalid_operations_are_rejected_without_writes(self):
+        photo = self.photos[0]
+        for body in (
+            '{"operations": [{"photo_id": 1e400, "interaction_type": "like"}]}',
+            {'operations': [{'photo_id': 10 ** 23, 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': True, 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': 1.5, 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': 'abc', 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': -1, 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': photo.pk + 1000, 'interaction_type': 'like'}]},
+            {'operations': [{'photo_id': photo.pk, 'interaction_type': 'love'}]},
+            {'operations': [{'photo_id': photo.pk}]},
+            {'operations': ['like']},
+            'not json',
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        self.assertFalse(PhotoInteraction.objects.exists())
+
+    def test_writes_lock_the_user_before_reading_states(self):
+        # Two writers racing on a new (user, photo) row both count it
+        # unless they serialize on the user row
+        photo = self.photos[0]
+        for write in (
+            lambda: interactions.apply_states({(self.user.pk, photo.pk): 'like'}),
+            lambda: PhotoInteraction.toggle(self.user, photo, 'dislike'),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                write()
+            selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+            self.assertIn('FROM "pic_me_customuser"', selects[0])
+        self.assertEqual(self.counts(photo), (0, 1))
+
+    def test_string_photo_ids_are_accepted(self):
+        photo = self.photos[0]
+        response = self.post({'operations': [{'photo_id': str(photo.pk), 'interaction_type': 'like'}]})
+        self.assertEqual(response.json()['photos'][str(photo.pk)]['like_count'], 1)
+
+
+class WriteBehindTests(PicMeTestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp(prefix='picme-test-journal-')
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        settings_override = override_settings(
+            PICME_INTERACTION_WRITE_BEHIND=True, PICME_INTERACTION_JOURNAL_DIR=self.journal_dir,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Flush explicitly instead of from the background thread
+        flusher = mock.patch.object(writebehind, '_flusher', object())
+        flusher.start()
+        self.addCleanup(flusher.stop)
+        self.addCleanup(self.crash)
+        caches[settings.PICME_INTERACTION_CACHE_ALIAS].clear()
+
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.first = self.create_photo(self.alice, title='First')
+        self.second = self.create_photo(self.alice, title='Second')
+
+    def crash(self):
+        """
+        Drop the buffer and release the journal like a dead process; the
+        shared cache keeps its entries.
+        """
+        with writebehind._lock:
+            segments = [*writebehind._sealed, *filter(None, [writebehind._segment])]
+            writebehind._segment = None
+            writebehind._sealed.clear()
+            writebehind._pending.clear()
+        for segment in segments:
+            segment.close()
+
+    def states(self):
+        return set(PhotoInteraction.objects.values_list('user_id', 'photo_id', 'interaction_type'))
+
+    def test_toggles_coalesce_into_one_write(self):
+        for interaction_type in ('like', 'dislike', 'like'):
+            writebehind.toggle(self.bob.pk, self.first.pk, interaction_type)
+        self.assertEqual(writebehind.pending(self.bob.pk, self.first.pk), (True, 'like'))
+        self.assertFalse(PhotoInteraction.objects.exists())
+
+        self.assertEqual(writebehind.flush(), 1)
+        self.assertEqual(self.states(), {(self.bob.pk, self.first.pk, 'like')})
+        self.assertEqual(self.counts(self.first), (1, 0))
+        self.assertEqual(glob.glob(os.path.join(self.journal_dir, '*.jsonl')), [])
+
+    def test_journal_of_a_crashed_process_is_replayed(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        writebehind.toggle(self.bob.pk, self.first.pk, 'dislike')
+        writebehind.toggle(self.alice.pk, self.first.pk, 'like')
+        writebehind.toggle(self.bob.pk, self.second.pk, 'like')
+        writebehind.toggle(self.bob.pk, self.second.pk, 'like')
+        (segment,) = glob.glob(os.path.join(self.journal_dir, '*.jsonl'))
+        self.crash()
+        # The journal alone is enough
+        caches[settings.PICME_INTERACTION_CACHE_ALIAS].clear()
+        with open(segment, 'a', encoding='utf-8') as journal:
+            journal.write('{"u": 1, "p')  # torn write
+        self.assertFalse(PhotoInteraction.objects.exists())
+
+        self.assertEqual(writebehind.replay_orphans(), 3)
+
+        self.assertEqual(self.states(), {
+            (self.bob.pk, self.first.pk, 'dislike'),
+            (self.alice.pk, self.first.pk, 'like'),
+        })
+        self.assertEqual(self.counts(self.first), (1, 1))
+        self.assertEqual(self.counts(self.second), (0, 0))
+        self.assertFalse(os.path.exists(segment))
+
+    def test_replay_prefers_the_shared_state(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        self.crash()
+        # Changed by another process that has not flushed yet
+        writebehind.toggle(self.bob.pk, self.first.pk, 'dislike')
+        with mock.patch.object(writebehind, '_segment', None):
+            self.assertEqual(writebehind.replay_orphans(), 1)
+        self.assertEqual(self.states(), {(self.bob.pk, self.first.pk, 'dislike')})
+
+    def test_other_processes_see_pending_clicks(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        with mock.patch.object(writebehind, '_pending', {}):
+            self.assertEqual(writebehind.pending(self.bob.pk, self.first.pk), (True, 'like'))
+            # A second click folds against the first, not the database
+            self.assertEqual(writebehind.toggle(self.bob.pk, self.first.pk, 'like'), 'removed')
+        self.assertEqual(writebehind.pending(self.bob.pk, self.first.pk), (True, None))
+        self.assertEqual(writebehind.flush(), 1)
+        self.assertFalse(PhotoInteraction.objects.exists())
+
+        # Written entries still read as the database state
+        writebehind.toggle(self.bob.pk, self.first.pk, 'dislike')
+        writebehind.flush()
+        self.assertEqual(writebehind.pending(self.bob.pk, self.first.pk), (True, 'dislike'))
+
+    def test_a_late_flush_does_not_overwrite_a_newer_click(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        stale = dict(writebehind._pending)
+        # Another process records and writes a newer click first
+        with mock.patch.object(writebehind, '_pending', {}):
+            writebehind.toggle(self.bob.pk, self.first.pk, 'dislike')
+            self.assertEqual(writebehind.flush(), 1)
+        self.assertEqual(writebehind._pending, stale)
+
+        self.assertEqual(writebehind.flush(), 1)
+        self.assertEqual(self.states(), {(self.bob.pk, self.first.pk, 'dislike')})
+        self.assertEqual(self.counts(self.first), (0, 1))
+
+    def test_live_segments_are_not_replayed(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        # Another process sees a segment it cannot lock
+        with mock.patch.object(writebehind, '_segment', None):
+            self.assertEqual(writebehind.replay_orphans(), 0)
+        self.assertFalse(PhotoInteraction.objects.exists())
+        self.assertEqual(writebehind.flush(), 1)
+
+    def test_replay_skips_deleted_photos(self):
+        writebehind.toggle(self.bob.pk, self.first.pk, 'like')
+        writebehind.toggle(self.bob.pk, self.second.pk, 'like')
+        self.crash()
+        self.second.delete()
+
+        self.assertEqual(writebehind.replay_orphans(), 2)
+        self.assertEqual(self.states(), {(self.bob.pk, self.first.pk, 'like')})
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(media.parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(media.parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(media.parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(media.parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(media.parse_range('bytes=-200', 100), (0, 99))
+
+    def test_ignored_ranges(self):
+        for header in ('bytes=0-9,20-29', 'items=0-9', 'bytes=9-0', 'bytes=a-b', 'bytes=10'):
+            with self.subTest(header=header):
+                self.assertIsNone(media.parse_range(header, 100))
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=100-', 'bytes=-0'):
+            with self.subTest(header=header), self.assertRaises(media.RangeNotSatisfiable):
+                media.parse_range(header, 100)
+
+
+class ServeMediaTests(PicMeTestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 4
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'docs'), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, 'docs', 'file.bin'), 'wb') as f:
+            f.write(self.data)
+        self.url = f'{settings.MEDIA_URL}docs/file.bin'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+
+    def test_single_range(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+
+    def test_suffix_range(self):
+        response, body = self.get(Range='bytes=-16')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[-16:])
+
+    def test_range_beyond_the_end(self):
+        response, _ = self.get(Range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_if_range_mismatch_sends_the_full_file(self):
+        response, body = self.get(Range='bytes=10-19', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+        etag = response['ETag']
+        response, body = self.get(Range='bytes=10-19', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:20])
+
+    def test_if_none_match(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(self.get(**{'If-None-Match': '"other"'})[0].status_code, 200)
+
+    def test_paths_outside_media_root(self):
+        self.assertEqual(self.client.get(f'{settings.MEDIA_URL}../settings.py').status_code, 404)
+        self.assertEqual(self.client.get(f'{settings.MEDIA_URL}docs/').status_code, 404)
+
+
+class BlobStorageTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.create_photo(self.owner, title='First')
+        second = self.create_photo(self.owner, title='Second')
+        other = self.create_photo(self.owner, title='Other', color=(1, 2, 3))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(Blob.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(Blob.objects.get(name=other.image.name).refcount, 1)
+        directory = os.path.dirname(storage.content_addressed_storage.path(first.image.name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first.image.name)])
+
+    def test_retain_and_release_count_references(self):
+        name = self.create_photo(self.owner).image.name
+        storage.retain(name)
+        self.assertEqual(Blob.objects.get(name=name).refcount, 2)
+        for _ in range(3):
+            storage.release(name)
+        self.assertEqual(Blob.objects.get(name=name).refcount, 0)
+
+    def test_unused_blobs_are_collected_after_the_grace_period(self):
+        kept = self.create_photo(self.owner, title='Kept', color=(1, 2, 3)).image.name
+        photo = self.create_photo(self.owner)
+        name = photo.image.name
+        photo.delete()
+        self.assertEqual(Blob.objects.get(name=name).refcount, 0)
+
+        self.assertEqual(storage.collect(), 0)
+        self.assertTrue(storage.content_addressed_storage.exists(name))
+
+        Blob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(storage.collect(), 1)
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(storage.content_addressed_storage.exists(name))
+        self.assertTrue(storage.content_addressed_storage.exists(kept))
+
+
+@override_settings(PICME_IMAGE_MAX_BYTES=100_000, PICME_IMAGE_MAX_PIXELS=10_000, PICME_IMAGE_MAX_FRAMES=3)
+class ImageLimitTests(SimpleTestCase):
+    @staticmethod
+    def gif_bytes(frames, width=10, height=10):
+        images = [Image.new('RGB', (width, height), (index * 40, 0, 0)) for index in range(frames)]
+        buffer = BytesIO()
+        images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:])
+        return buffer.getvalue()
+
+    def test_images_within_the_limits_are_accepted(self):
+        info = ingest.inspect(BytesIO(PicMeTestCase.image_bytes(100, 100)))
+        self.assertEqual((info.format, info.width, info.height, info.frames), ('PNG', 100, 100, 1))
+        self.assertEqual(ingest.inspect(BytesIO(self.gif_bytes(3))).frames, 3)
+
+    def test_images_over_a_limit_are_rejected(self):
+        files = {
+            'pixels': PicMeTestCase.image_bytes(101, 100),
+            'frames': self.gif_bytes(4),
+            'frame size': self.gif_bytes(1, 101, 100),
+            'bytes': PicMeTestCase.image_bytes(10, 10) + b'\0' * 100_000,
+            'format': b'BM' + b'\0' * 100,
+        }
+        for limit, data in files.items():
+            with self.subTest(limit=limit), self.assertRaises(ingest.ImageRejected):
+                ingest.inspect(BytesIO(data))
+
+    def test_validator_rejects_new_uploads_over_a_limit(self):
+        image = Photo(image=SimpleUploadedFile('large.png', PicMeTestCase.image_bytes(200, 200))).image
+        with self.assertRaises(ValidationError):
+            ingest.validate_image_file(image)
+        self.assertEqual(image.file.tell(), 0)
+        ingest.validate_image_file(Photo(image=SimpleUploadedFile('small.png', PicMeTestCase.image_bytes())).image)
+
+
+@override_settings(PICME_ASYNC_IMAGE_PROCESSING=False)
+class RenditionTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+
+    def upload(self, width, height, title='Photo'):
+        image = SimpleUploadedFile('photo.png', self.image_bytes(width, height))
+        return Photo.objects.create(title=title, uploaded_by=self.owner, image=image)
+
+    def test_renditions_are_generated_in_both_formats(self):
+        photo = self.upload(2000, 1000)
+        self.assertEqual(photo.renditions['source'], photo.image.name)
+        sizes = {
+            name: (photo.renditions[name]['width'], photo.renditions[name]['height'])
+            for name in renditions.RENDITION_SPECS
+        }
+        self.assertEqual(sizes, {
+            'thumbnail': (480, 300), 'small': (640, 320), 'medium': (1024, 512), 'large': (1600, 800),
+        })
+        for name in renditions.RENDITION_SPECS:
+            for format_key, (pil_format, _, _) in renditions.RENDITION_FORMATS.items():
+                with photo.image.storage.open(photo.renditions[name][format_key]) as f, Image.open(f) as image:
+                    self.assertEqual(image.format, pil_format)
+                    self.assertEqual(image.size, sizes[name])
+
+    def test_urls_point_at_fingerprinted_renditions(self):
+        photo = Photo.objects.get(pk=self.upload(2000, 1000).pk)
+        self.assertRegex(photo.thumbnail_url, r'^/media/photos/renditions/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertTrue(photo.medium_webp_url.endswith('.webp'))
+        self.assertEqual(
+            [candidate.split()[1] for candidate in photo.srcset.split(', ')], ['640w', '1024w', '1600w'],
+        )
+        self.assertEqual(media.cache_control(photo.thumbnail_url), media.IMMUTABLE_CACHE_CONTROL)
+
+    def test_small_originals_are_not_upscaled(self):
+        photo = self.upload(300, 200)
+        self.assertEqual((photo.renditions['large']['width'], photo.renditions['large']['height']), (300, 200))
+        self.assertEqual(photo.srcset, f'{photo.rendition_url("small")} 300w')
+
+    def test_identical_uploads_reuse_the_renditions(self):
+        first = self.upload(800, 600)
+        with mock.patch.object(renditions, 'generate_renditions') as generate:
+            second = self.upload(800, 600, title='Again')
+        generate.assert_not_called()
+        self.assertEqual(second.renditions, first.renditions)
+
+    def test_missing_renditions_fall_back_to_the_original(self):
+        photo = self.upload(800, 600)
+        photo.renditions = {}
+        self.assertEqual(photo.thumbnail_url, photo.image.url)
+        self.assertEqual(photo.thumbnail_webp_url, '')
+        self.assertEqual(photo.srcset, '')
+
+
+@override_settings(PICME_JOB_RETRY_BACKOFF=10, PICME_JOB_MAX_BACKOFF=60, PICME_JOB_VISIBILITY_TIMEOUT=300)
+class JobQueueTests(PicMeTestCase):
+    def setUp(self):
+        handlers = mock.patch.dict(jobs._handlers)
+        handlers.start()
+        self.addCleanup(handlers.stop)
+        self.calls = []
+        jobs.job_handler('test.record')(lambda **payload: self.calls.append(payload))
+
+        def fail(permanent=False):
+            raise (jobs.PermanentJobError if permanent else RuntimeError)('Failed.')
+
+        jobs.job_handler('test.fail')(fail)
+
+    def test_due_jobs_are_claimed_once(self):
+        first = jobs.enqueue('test.record', value=1)
+        second = jobs.enqueue('test.record', value=2)
+        jobs.enqueue('test.record', delay=60, value=3)
+
+        self.assertEqual(jobs.claim_jobs('worker-a', 10), [first.pk, second.pk])
+        self.assertEqual(jobs.claim_jobs('worker-b', 10), [])
+        self.assertEqual(jobs.run_job(first.pk, 'worker-a'), Job.STATUS_DONE)
+        self.assertEqual(self.calls, [{'value': 1}])
+
+    def test_expired_leases_are_claimed_again(self):
+        job = jobs.enqueue('test.record')
+        jobs.claim_jobs('worker-a', 1)
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(jobs.claim_jobs('worker-b', 1), [job.pk])
+        # The first worker lost its lease and cannot record an outcome
+        jobs.run_job(job.pk, 'worker-a')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.STATUS_RUNNING, 'worker-b', 2))
+        self.assertEqual(jobs.run_job(job.pk, 'worker-b'), Job.STATUS_DONE)
+
+    def test_failures_are_retried_with_backoff(self):
+        job = jobs.enqueue('test.fail', max_attempts=5)
+        delays = []
+        with mock.patch.object(jobs.random, 'uniform', return_value=1), self.assertLogs(jobs.logger, 'WARNING'):
+            for _ in range(4):
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                self.assertEqual(jobs.claim_jobs('worker', 1), [job.pk])
+                before = timezone.now()
+                self.assertEqual(jobs.run_job(job.pk, 'worker'), Job.STATUS_QUEUED)
+                job.refresh_from_db()
+                delays.append(round((job.run_after - before).total_seconds()))
+        self.assertEqual(delays, [10, 20, 40, 60])
+        self.assertIn('RuntimeError: Failed.', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.claim_jobs('worker', 1)
+        with self.assertLogs(jobs.logger, 'ERROR'):
+            self.assertEqual(jobs.run_job(job.pk, 'worker'), Job.STATUS_FAILED)
+
+    def test_permanent_errors_are_not_retried(self):
+        job = jobs.enqueue('test.fail', permanent=True)
+        jobs.claim_jobs('worker', 1)
+        with self.assertLogs(jobs.logger, 'ERROR'):
+            self.assertEqual(jobs.run_job(job.pk, 'worker'), Job.STATUS_FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 1))
+        self.assertIsNotNone(job.finished_at)
+
+
+class FragmentCacheTests(PicMeTestCase):
+    def setUp(self):
+        caches[settings.PICME_FRAGMENT_CACHE_ALIAS].clear()
+        self.owner = self.create_user('owner')
+        self.photo = self.create_photo(self.owner, title='Sunset')
+        self.nature = Tag.objects.create(name='Nature', slug='nature')
+
+    def version(self, photo=None):
+        return Photo.objects.values_list('cache_version', flat=True).get(pk=(photo or self.photo).pk)
+
+    def assertBumps(self, change, photo=None):
+        before = self.version(photo)
+        change()
+        self.assertGreater(self.version(photo), before)
+
+    def test_photo_writes_invalidate_its_card(self):
+        self.photo.title = 'Sunrise'
+        self.assertBumps(self.photo.save)
+        self.assertBumps(lambda: PhotoInteraction.toggle(self.owner, self.photo, 'like'))
+        self.assertBumps(lambda: interactions.apply_states({(self.owner.pk, self.photo.pk): 'dislike'}))
+
+    def test_tag_changes_invalidate_the_cards_from_either_side(self):
+        other = self.create_photo(self.owner, title='Other')
+        self.assertBumps(lambda: self.photo.tags.add(self.nature))
+        self.assertBumps(lambda: self.nature.photos.add(other), other)
+        self.assertBumps(lambda: self.nature.photos.clear(), other)
+        self.assertBumps(lambda: self.photo.tags.set([self.nature]))
+        self.assertBumps(lambda: self.photo.tags.remove(self.nature))
+
+    def test_tag_changes_look_up_the_affected_photos_once(self):
+        other = self.create_photo(self.owner, title='Other')
+        self.nature.photos.add(self.photo, other)
+        with CaptureQueriesContext(connection) as queries:
+            self.nature.photos.clear()
+        lookups = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "pic_me_photo"."id"')
+        ]
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(Tag.objects.get(pk=self.nature.pk).photo_count, 0)
+
+    def test_tag_writes_invalidate_the_tag_list(self):
+        before = fragments.get_version(fragments.TAGS_VERSION)
+        self.nature.name = 'Outdoors'
+        self.nature.save()
+        renamed = fragments.get_version(fragments.TAGS_VERSION)
+        self.assertGreater(renamed, before)
+        self.nature.delete()
+        self.assertGreater(fragments.get_version(fragments.TAGS_VERSION), renamed)
+
+    def test_gallery_shows_changes_to_cached_cards(self):
+        self.photo.tags.add(self.nature)
+        self.assertContains(self.client.get(reverse('home')), 'Sunset')
+        self.assertTrue(caches[settings.PICME_FRAGMENT_CACHE_ALIAS].get(
+            fragments.photo_card_key(Photo.objects.get(pk=self.photo.pk), fragments.get_version(fragments.TAGS_VERSION))
+        ))
+
+        self.photo.title = 'Sunrise'
+        self.photo.save()
+        self.nature.name = 'Outdoors'
+        self.nature.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Sunrise')
+        self.assertNotContains(response, 'Sunset')
+        self.assertContains(response, 'Outdoors')
+        self.assertNotContains(response, 'Nature')
+
+
+class InlineExecutor:
+    """Runs ``import_photos``' pool work in the test process, on the test database and MEDIA_ROOT."""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def map(self, fn, iterable, chunksize=1):
+        return map(fn, iterable)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ImportPhotosTests(PicMeTestCase):
+    def setUp(self):
+        from .management.commands import import_photos
+
+        executor = mock.patch.object(import_photos, 'ProcessPoolExecutor', InlineExecutor)
+        executor.start()
+        self.addCleanup(executor.stop)
+        self.source = tempfile.mkdtemp(prefix='picme-test-import-')
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+        self.owner = self.create_user('owner')
+
+    def write(self, name, data):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def run_import(self, source, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_photos', source, '--user', 'owner', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_directory_import(self):
+        self.write('sunset_beach.png', self.image_bytes(color='orange'))
+        self.write('trips/old-town.jpg', self.image_bytes(color='blue', format='JPEG'))
+        self.write('broken.png', b'not an image')
+        self.write('notes.txt', b'not listed')
+
+        out, err = self.run_import(self.source, '--tag', 'Holiday')
+
+        self.assertIn('Imported 2 photos', out)
+        self.assertIn('1 failed', out)
+        self.assertIn('broken.png', err)
+        photos = Photo.objects.order_by('title')
+        self.assertEqual([photo.title for photo in photos], ['Old town', 'Sunset beach'])
+        holiday = Tag.objects.get(name='Holiday')
+        self.assertEqual(holiday.photo_count, 2)
+        for photo in photos:
+            self.assertEqual(photo.renditions['source'], photo.image.name)
+            self.assertEqual([tag.name for tag in photo.tags.all()], ['Holiday'])
+            self.assertEqual(Blob.objects.get(name=photo.image.name).refcount, 1)
+            self.assertTrue(PhotoScore.objects.filter(pk=photo.pk).exists())
+        self.assertEqual(
+            list(search.search_photos(Photo.objects.all(), 'sunset').values_list('title', flat=True)),
+            ['Sunset beach'],
+        )
+
+    def test_manifest_import_skips_duplicates(self):
+        existing = self.create_photo(self.owner, title='Existing')
+        with existing.image.open('rb') as f:
+            self.write('images/existing.png', f.read())
+        self.write('images/red.png', self.image_bytes())
+        self.write('images/green.png', self.image_bytes(color='green'))
+        manifest = os.path.join(self.source, 'manifest.csv')
+        with open(manifest, 'w', newline='', encoding='utf-8') as f:
+            f.write('path,title,description,tags\n'
+                    'images/existing.png,Copy,,"Nature"\n'
+                    'images/red.png,Red,Bright,"Nature, Color"\n'
+                    'images/green.png,,,Nature\n')
+
+        out, _ = self.run_import(manifest, '--skip-duplicates')
+
+        self.assertIn('Imported 2 photos', out)
+        self.assertIn('1 skipped', out)
+        red = Photo.objects.get(title='Red')
+        self.assertEqual(red.description, 'Bright')
+        self.assertEqual(sorted(tag.name for tag in red.tags.all()), ['Color', 'Nature'])
+        self.assertTrue(Photo.objects.filter(title='green').exists())
+        self.assertFalse(Photo.objects.filter(title='Copy').exists())
+        self.assertEqual(dict(Tag.objects.values_list('name', 'photo_count')), {'Nature': 2, 'Color': 1})
+
+    def test_json_lines_manifest(self):
+        self.write('a.png', self.image_bytes())
+        manifest = self.write('manifest.jsonl', json.dumps({'path': 'a.png', 'tags': ['Nature']}).encode() + b'\n')
+
+        self.run_import(manifest)
+
+        photo = Photo.objects.get()
+        self.assertEqual(photo.title, 'a')
+        self.assertEqual(Tag.objects.get(name='Nature').photo_count, 1)
+
+    def test_unknown_users_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, "No user 'nobody'"):
+            call_command('import_photos', self.source, '--user', 'nobody', stdout=StringIO())
+
+
+class AvatarTests(PicMeTestCase):
+    def setUp(self):
+        self.alice = self.create_user('alice')
+        self.client.force_login(self.alice)
+
+    def upload_picture(self):
+        picture = SimpleUploadedFile('me.png', self.image_bytes(300, 200, color='green'))
+        response = self.client.post(reverse('profile'), {
+            'username': 'alice', 'email': 'alice@example.com', 'bio': '', 'profile_picture': picture,
+        })
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        return UserProfile.objects.get(user=self.alice)
+
+    def run_jobs(self):
+        while claimed := jobs.claim_jobs('test', 10):
+            for job_id in claimed:
+                self.assertEqual(jobs.run_job(job_id, 'test'), Job.STATUS_DONE)
+
+    def test_users_without_a_picture_get_an_identicon(self):
+        url = self.alice.profile.avatar_url(48)
+        self.assertEqual(url, avatars.identicon_url(self.alice.pk, 64))
+        self.assertNotEqual(url, avatars.identicon_url(self.create_user('bob').pk, 64))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Cache-Control'], media.IMMUTABLE_CACHE_CONTROL)
+        with Image.open(BytesIO(response.content)) as image:
+            self.assertEqual(image.size, (64, 64))
+        seed = avatars.identicon_seed(self.alice.pk)
+        self.assertEqual(self.client.get(reverse('identicon', args=[seed, 48])).status_code, 404)
+
+    @override_settings(PICME_ASYNC_IMAGE_PROCESSING=False)
+    def test_uploaded_pictures_are_cropped_to_avatars(self):
+        profile = self.upload_picture()
+        for size in avatars.AVATAR_SIZES:
+            entry = profile.avatars[f'avatar_{size}']
+            with storage.content_addressed_storage.open(entry['jpeg']) as f, Image.open(f) as image:
+                self.assertEqual(image.size, (size, size))
+
+        url = profile.avatar_url(48)
+        self.assertEqual(url, storage.content_addressed_storage.url(profile.avatars['avatar_64']['jpeg']))
+        self.assertEqual(media.cache_control(url), media.IMMUTABLE_CACHE_CONTROL)
+        html = picme_avatars.avatar(CustomUser.objects.select_related('profile').get(pk=self.alice.pk), 32)
+        self.assertIn(f'src="{profile.avatar_url(32)}"', html)
+        self.assertIn(f'srcset="{url} 2x"', html)
+
+    def test_identicon_until_the_avatar_job_ran(self):
+        profile = self.upload_picture()
+        self.assertEqual(profile.avatar_url(64), avatars.identicon_url(self.alice.pk, 64))
+
+        self.run_jobs()
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatars['source'], profile.profile_picture.name)
+        self.assertNotEqual(profile.avatar_url(64), avatars.identicon_url(self.alice.pk, 64))
+
+    @override_settings(PICME_ASYNC_IMAGE_PROCESSING=False)
+    def test_removing_the_picture_restores_the_identicon(self):
+        profile = self.upload_picture()
+        crops = storage.rendition_names(profile.avatars)
+        profile.profile_picture = None
+        profile.save()
+
+        self.assertEqual(profile.avatars, {})
+        self.assertEqual(profile.avatar_url(64), avatars.identicon_url(self.alice.pk, 64))
+        self.assertEqual(set(Blob.objects.filter(name__in=crops).values_list('refcount', flat=True)), {0})
+
+
+class ResumableUploadTests(PicMeTestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp(prefix='picme-test-uploads-')
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        settings_override = override_settings(PICME_UPLOAD_TEMP_DIR=temp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.alice = self.create_user('alice')
+        self.client.force_login(self.alice)
+        self.data = self.image_bytes()
+
+    def open_session(self, **fields):
+        response = self.client.post(reverse('upload_create'), {
+            'filename': 'photo.png', 'size': len(self.data), **fields,
+        })
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def send(self, url, offset, data):
+        return self.client.patch(
+            url, data, content_type='application/offset+octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_interrupted_upload_resumes_and_completes(self):
+        url = self.open_session(sha256=hashlib.sha256(self.data).hexdigest())
+        half = len(self.data) // 2
+        self.assertEqual(self.send(url, 0, self.data[:half]).status_code, 204)
+
+        # After a dropped connection the client asks where to continue
+        self.assertEqual(self.client.get(url)['Upload-Offset'], str(half))
+        response = self.send(url, half, self.data[half:])
+        self.assertEqual(response['Upload-Offset'], str(len(self.data)))
+
+        response = self.client.post(f'{url}complete/', {'title': 'Resumed'})
+        self.assertEqual(response.status_code, 201)
+        photo = Photo.objects.get(pk=response.json()['id'])
+        self.assertEqual(photo.title, 'Resumed')
+        with photo.image.open('rb') as image:
+            self.assertEqual(image.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(settings.PICME_UPLOAD_TEMP_DIR), [])
+
+    def test_chunks_at_a_stale_offset_are_rejected(self):
+        url = self.open_session()
+        self.send(url, 0, self.data[:10])
+
+        response = self.send(url, 0, self.data[:10])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 10)
+        response = self.client.post(f'{url}complete/', {'title': 'Early'})
+        self.assertEqual(response.status_code, 409)
+
+    def test_concurrent_chunks_do_not_both_pass_the_offset_check(self):
+        url = self.open_session()
+        session = UploadSession.objects.get()
+        self.send(url, 0, b'')
+        errors = []
+
+        def append():
+            try:
+                uploads.append_chunk(session, 0, BytesIO(self.data[:10]))
+            except uploads.OffsetMismatch as exc:
+                errors.append(exc.offset)
+
+        # Another request holds the part file while it writes the same chunk
+        with open(uploads.part_path(session.pk), 'ab') as part:
+            fcntl.flock(part, fcntl.LOCK_EX)
+            thread = threading.Thread(target=append)
+            thread.start()
+            time.sleep(0.2)
+            self.assertTrue(thread.is_alive())
+            part.write(self.data[:10])
+        thread.join()
+
+        self.assertEqual(errors, [10])
+        self.assertEqual(uploads.received(session.pk), 10)
+
+    def test_checksum_mismatch_discards_the_upload(self):
+        url = self.open_session(sha256='0' * 64)
+        self.send(url, 0, self.data)
+
+        response = self.client.post(f'{url}complete/', {'title': 'Corrupt'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Photo.objects.exists())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(settings.PICME_UPLOAD_TEMP_DIR), [])
+
+
+class QueryAuditTests(PicMeTestCase):
+    def test_views_pass_the_audit_and_writes_are_rolled_back(self):
+        owner = self.create_user('owner')
+        nature = Tag.objects.create(name='Nature', slug='nature')
+        for index in range(3):
+            self.create_photo(owner, title=f'Photo {index}', tags=[nature])
+        sessions = Session.objects.count()
+
+        out = StringIO()
+        call_command('query_audit', stdout=out)
+        self.assertIn('no large sequential scans or sorted galleries', out.getvalue())
+        self.assertEqual(Session.objects.count(), sessions)
+
+    def test_sorted_gallery_pages_are_reported(self):
+        from .management.commands import query_audit
+
+        page = 'SELECT "pic_me_photo"."id" FROM "pic_me_photo" ORDER BY "pic_me_photo"."created_at" DESC LIMIT 25'
+        plans = {
+            'sqlite': ('3 0 0 SEARCH pic_me_photo USING INTEGER PRIMARY KEY (rowid=?)\n'
+                       '9 0 0 USE TEMP B-TREE FOR ORDER BY'),
+            'postgresql': 'Limit\n  ->  Sort\n        Sort Key: pic_me_photo.created_at DESC',
+        }
+        if connection.vendor not in plans:
+            self.skipTest('No query audit for this backend')
+        self.assertTrue(query_audit.sorts_page(page, plans[connection.vendor]))
+        self.assertFalse(query_audit.sorts_page('SELECT "pic_me_tag"."id" FROM "pic_me_tag" ORDER BY "name" LIMIT 5',
+                                                plans[connection.vendor]))
+
+
+@override_settings(PICME_QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(PicMeTestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        owners = [self.create_user(f'owner{index}') for index in range(3)]
+        self.tags = [Tag.objects.create(name=f'Tag {index}', slug=f'tag-{index}') for index in range(4)]
+        self.photos = [
+            self.create_photo(owners[index % 3], title=f'Photo {index}', tags=self.tags[index % 2:index % 2 + 3])
+            for index in range(30)
+        ]
+        self.viewer = self.create_user('viewer')
+        for photo in self.photos[:12]:
+            PhotoInteraction.toggle(self.viewer, photo, 'like')
+
+    def test_home_stays_within_its_budget(self):
+        # Every card has tags and an owner to load
+        self.client.force_login(self.viewer)
+        for params in (
+            {}, {'tag': 'tag-1'}, {'tag': ['tag-1', 'tag-2']}, {'tag': ['tag-0', 'tag-3'], 'match': 'any'},
+            {'search': 'photo'}, {'search': 'photo', 'sort': 'relevance'}, {'sort': 'top'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('home'), params).status_code, 200)
+
+    def test_photo_detail_stays_within_its_budget(self):
+        for photo in self.photos[:3]:
+            self.client.logout()
+            self.assertEqual(self.client.get(reverse('photo_detail', args=[photo.pk])).status_code, 200)
+            self.client.force_login(self.viewer)
+            self.assertEqual(self.client.get(reverse('photo_detail', args=[photo.pk])).status_code, 200)
+
+    def test_overruns_are_raised(self):
+        with mock.patch.dict(views.home.query_budget, {'queries': 1}):
+            with self.assertRaises(querybudget.QueryBudgetExceeded):
+                self.client.get(reverse('home'))
+
+        with self.assertRaises(querybudget.QueryBudgetExceeded):
+            with querybudget.assert_query_budget(duplicates=2):
+                [photo.uploaded_by.username for photo in Photo.objects.all()]
+
+
+class TagFacetTests(PicMeTestCase):
+    def setUp(self):
+        owner = self.create_user('owner')
+        self.tags = [Tag.objects.create(name=f'Tag {index}', slug=f'tag-{index}') for index in range(5)]
+        # Photo n carries the tags of the set bits of n
+        self.photos = [
+            self.create_photo(owner, title=f'Photo {index}', tags=[tag for bit, tag in enumerate(self.tags) if index >> bit & 1])
+            for index in range(20)
+        ]
+
+    def expected(self, slugs, match):
+        tag_sets = [{tag.slug for tag in photo.tags.all()} for photo in self.photos]
+        def matches(tags, wanted):
+            return wanted <= tags if match == 'all' else bool(wanted & tags)
+
+        total = sum(matches(tags, set(slugs)) for tags in tag_sets)
+        counts = {}
+        for tag in self.tags:
+            if tag.slug not in slugs:
+                count = sum(matches(tags, {*slugs, tag.slug}) for tags in tag_sets)
+                if count:
+                    counts[tag.slug] = count
+        return total, counts
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('api_tag_facets'), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data['total'], {tag['slug']: tag['count'] for tag in data['results']}
+
+    def test_counts_match_the_photos(self):
+        for slugs in (['tag-0'], ['tag-0', 'tag-1'], ['tag-2', 'tag-4']):
+            for match in ('all', 'any'):
+                with self.subTest(slugs=slugs, match=match):
+                    self.assertEqual(self.fetch(tag=slugs, match=match), self.expected(slugs, match))
+
+    def test_selections_are_capped(self):
+        with override_settings(PICME_TAG_FACET_MAX_SELECTED=2):
+            self.assertEqual(self.fetch(tag=['tag-0', 'tag-1']), (self.expected(['tag-0', 'tag-1'], 'all')[0], {}))
+            too_many = {'tag': ['tag-0', 'tag-1', 'tag-2']}
+            self.assertEqual(self.client.get(reverse('api_tag_facets'), too_many).status_code, 400)
+            self.assertEqual(self.client.get(reverse('api_photo_list'), too_many).status_code, 400)
+
+            response = self.client.get(reverse('home'), too_many)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([tag.slug for tag in response.context['selected_tags']], ['tag-0', 'tag-1'])
+            self.assertEqual(response.context['facet_tags'], [])
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+class SimilarityTests(PicMeTestCase):
+    # Top bit set, so it is stored as a negative BIGINT
+    BASE = 0xF123456789ABCDEF
+
+    def setUp(self):
+        self.owner = self.create_user('owner')
+
+    def hashed(self, value, title='Photo'):
+        photo = self.create_photo(self.owner, title=title)
+        similarity.store(photo, value)
+        return photo
+
+    def test_hashes_round_trip_through_signed_bands(self):
+        self.assertLess(similarity.to_signed(self.BASE), 0)
+        self.assertEqual(similarity.to_unsigned(similarity.to_signed(self.BASE)), self.BASE)
+        self.assertEqual(similarity.bands(self.BASE), [0xF123, 0x4567, 0x89AB, 0xCDEF])
+        self.assertEqual(similarity.distance(self.BASE, similarity.to_signed(flip(self.BASE, 0, 63))), 2)
+
+    def test_lookup_finds_hashes_within_the_distance(self):
+        # Bits 0-15 are band 3, 16-31 band 2, 32-47 band 1, 48-63 band 0
+        same = self.hashed(self.BASE)
+        near = self.hashed(flip(self.BASE, 0, 20, 40))
+        at_cutoff = self.hashed(flip(self.BASE, 0, 1, 16, 17, 32, 33, 48, 49))
+        # A band within the radius, but 9 bits away in total
+        past_cutoff = self.hashed(flip(self.BASE, 0, 1, 2, 16, 17, 32, 33, 48, 49))
+        # No band within the radius of the query's
+        far = self.hashed(flip(self.BASE, 0, 1, 2, 16, 17, 18, 32, 33, 34, 48, 49, 50))
+
+        candidates = set(similarity.candidates(self.BASE, 8).values_list('photo_id', flat=True))
+        self.assertEqual(candidates, {same.pk, near.pk, at_cutoff.pk, past_cutoff.pk})
+        self.assertNotIn(far.pk, candidates)
+        self.assertEqual(
+            similarity.similar(self.BASE, max_distance=8, exclude=same.pk),
+            [(near.pk, 3), (at_cutoff.pk, 8)],
+        )
+        self.assertEqual(similarity.similar(self.BASE, max_distance=8, limit=1), [(same.pk, 0)])
+
+    def test_similar_photos_of_a_photo(self):
+        photo = self.hashed(self.BASE, title='Original')
+        copy = self.hashed(flip(self.BASE, 5), title='Copy')
+        self.hashed(~self.BASE & ((1 << 64) - 1), title='Other')
+
+        found = similarity.similar_photos(photo)
+        self.assertEqual([(match.pk, match.distance) for match in found], [(copy.pk, 1)])
+        self.assertEqual(similarity.similar_photos(self.create_photo(self.owner, title='Unhashed')), [])
+
+    def test_resized_copies_hash_alike(self):
+        image = Image.radial_gradient('L').convert('RGB')
+        buffer = BytesIO()
+        image.resize((97, 97)).save(buffer, 'JPEG', quality=60)
+        value = similarity.dhash(image)
+
+        self.assertLessEqual(similarity.distance(value, similarity.hash_file(buffer)), 2)
+        self.assertGreater(similarity.distance(value, similarity.dhash(Image.linear_gradient('L'))), 16)
+
+
+class SessionStoreTests(PicMeTestCase):
+    def saved_session(self, **data):
+        store = sessions.SessionStore()
+        store.update(data)
+        store.save()
+        return store.session_key
+
+    def test_unchanged_sessions_are_not_written(self):
+        key = self.saved_session(theme='dark')
+        store = sessions.SessionStore(key)
+        store['theme'] = 'dark'
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(cached_db.SessionStore, 'save') as save:
+            store.save()
+        save.assert_not_called()
+        self.assertEqual(len(queries), 0)
+
+    def test_changed_sessions_are_written(self):
+        key = self.saved_session(theme='dark')
+        store = sessions.SessionStore(key)
+        store['theme'] = 'light'
+        store.save()
+        self.assertEqual(Session.objects.get(pk=key).get_decoded(), {'theme': 'light'})
+
+        # Saved once, the new state is the one to compare against
+        store['theme'] = 'light'
+        with mock.patch.object(cached_db.SessionStore, 'save') as save:
+            store.save()
+        save.assert_not_called()
+
+    def test_new_keys_are_always_written(self):
+        key = self.saved_session(theme='dark')
+        store = sessions.SessionStore(key)
+        store.load()
+        store.cycle_key()
+        self.assertNotEqual(store.session_key, key)
+        self.assertTrue(Session.objects.filter(pk=store.session_key).exists())
+
+    @override_settings(SESSION_SAVE_EVERY_REQUEST=True)
+    def test_every_save_is_written_when_configured(self):
+        key = self.saved_session(theme='dark')
+        store = sessions.SessionStore(key)
+        store.load()
+        with mock.patch.object(cached_db.SessionStore, 'save') as save:
+            store.save()
+        save.assert_called_once()
+
+    async def test_async_saves_skip_unchanged_sessions(self):
+        store = sessions.SessionStore()
+        await store.aset('theme', 'dark')
+        await store.asave()
+        store = sessions.SessionStore(store.session_key)
+        await store.aset('theme', 'dark')
+        with mock.patch.object(cached_db.SessionStore, 'asave') as asave:
+            await store.asave()
+        asave.assert_not_called()
+
+    def test_login_with_an_unchanged_session_keeps_the_row(self):
+        user = self.create_user('alice')
+        self.client.force_login(user)
+        key = self.client.session.session_key
+        expiry = Session.objects.get(pk=key).expire_date
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertEqual(Session.objects.get(pk=key).expire_date, expiry)
+
+    def test_expired_sessions_are_deleted_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{index}', session_data='', expire_date=now - timedelta(days=1, minutes=index))
+            for index in range(5)
+        ] + [Session(session_key='current', session_data='', expire_date=now + timedelta(days=1))])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sessions.delete_expired(batch_size=2), 5)
+        self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries.captured_queries), 3)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+
+        out = StringIO()
+        call_command('clean_sessions', stdout=out)
+        self.assertIn('Deleted 0 expired sessions', out.getvalue())
+
+
+class ApiConditionalTests(PicMeTestCase):
+    def setUp(self):
+        self.owner = self.create_user('owner')
+        self.nature = Tag.objects.create(name='Nature', slug='nature')
+        self.photo = self.create_photo(self.owner, title='Sunset', tags=[self.nature])
+
+    def assertRevalidates(self, url, change, params=None):
+        """
+        The endpoint answers 304 to its own ETag until ``change()`` runs,
+        and a fresh 200 with another ETag after.
+        """
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(url, params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        change()
+        response = self.client.get(url, params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def like(self):
+        PhotoInteraction.toggle(self.owner, self.photo, 'like')
+
+    def test_photo_list(self):
+        response = self.assertRevalidates(reverse('api_photo_list'), self.like)
+        self.assertEqual(response.json()['results'][0]['like_count'], 1)
+        self.assertRevalidates(reverse('api_photo_list'), lambda: self.create_photo(self.owner, title='New'))
+
+    def test_photo_detail(self):
+        def rename_tag():
+            self.nature.name = 'Outdoors'
+            self.nature.save()
+
+        url = reverse('api_photo_detail', args=[self.photo.pk])
+        self.assertRevalidates(url, self.like)
+        response = self.assertRevalidates(url, rename_tag)
+        self.assertEqual(response.json()['tags'], [{'name': 'Outdoors', 'slug': 'nature'}])
+
+    def test_photo_counts(self):
+        response = self.assertRevalidates(reverse('api_photo_counts', args=[self.photo.pk]), self.like)
+        self.assertEqual((response.json()['like_count'], response.json()['dislike_count']), (1, 0))
+
+    def test_tag_list(self):
+        self.assertRevalidates(reverse('api_tag_list'), lambda: Tag.objects.create(name='City', slug='city'))
+
+    def test_tag_facets(self):
+        city = Tag.objects.create(name='City', slug='city')
+        response = self.assertRevalidates(
+            reverse('api_tag_facets'), lambda: self.photo.tags.add(city), {'tag': 'nature'},
+        )
+        self.assertEqual(response.json()['results'], [{'id': city.pk, 'name': 'City', 'slug': 'city', 'count': 1}])
+
+    def test_photos_answer_if_modified_since(self):
+        for url in (reverse('api_photo_list'), reverse('api_photo_detail', args=[self.photo.pk]),
+                    reverse('api_photo_counts', args=[self.photo.pk])):
+            with self.subTest(url=url):
+                last_modified = self.client.get(url)['Last-Modified']
+                response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_photo_lists_skip_the_tags(self):
+        etag = self.client.get(reverse('api_photo_list'))['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_photo_list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('"pic_me_tag"' in query['sql'] for query in queries.captured_queries))
+
+
+class StaticStorageTests(SimpleTestCase):
+    def test_uncollected_files_keep_their_name(self):
+        static_storage = storage.StaticStorage(location=tempfile.mkdtemp(prefix='picme-test-static-'))
+        self.addCleanup(shutil.rmtree, static_storage.location, ignore_errors=True)
+        self.assertEqual(static_storage.url('assets/css/style.css'), '/static/assets/css/style.css')
@@ -0,0 +1,170 @@
+"""
+Resumable chunked uploads.
+
+A client opens an ``UploadSession`` and sends the file as raw request bodies
+(``PATCH /uploads/<id>/`` with an ``Upload-Offset`` header). Each body is read
+from the request stream in ``CHUNK_SIZE`` pieces and appended to a part file
+under ``PICME_UPLOAD_TEMP_DIR``, so memory use does not depend on the file
+size. The size of the part file is the authoritative offset: after a dropped
+connection the client asks for it and continues from there.
+
+Each PATCH holds an exclusive ``flock`` on the part file from reading its
+size to the last write, so of two concurrent requests for the same offset
+the second sees the data of the first and gets ``OffsetMismatch``.
+
+The SHA-256 of the upload is hashed while receiving. The running hash lives
+in a bounded per-process cache; if a chunk lands on another process, the
+received prefix is rehashed from disk once.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+
+# session id -> (offset, sha256 object) of recently active uploads
+_HASH_CACHE_SIZE = 256
+_hashes = OrderedDict()
+_hashes_lock = threading.Lock()
+
+
+class OffsetMismatch(Exception):
+    """The chunk does not start where the received data ends."""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}.')
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    """The chunk would grow the upload beyond its declared size."""
+
+
+class SessionUploadedFile(UploadedFile):
+    """
+    A completed upload backed by its part file. Exposes
+    ``temporary_file_path()`` so form validation opens the file from disk
+    instead of reading it into memory, and carries the digest computed while
+    receiving for ``ContentAddressedStorage``.
+    """
+
+    def __init__(self, path, name, size, content_type, sha256):
+        super().__init__(open(path, 'rb'), name, content_type, size)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def part_path(session_id):
+    return os.path.join(settings.PICME_UPLOAD_TEMP_DIR, f'{session_id}.part')
+
+
+def received(session_id):
+    """Number of bytes received so far."""
+    try:
+        return os.path.getsize(part_path(session_id))
+    except FileNotFoundError:
+        return 0
+
+
+def _hash_prefix(path, length):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            digest.update(chunk)
+    return digest
+
+
+def _running_hash(session_id, offset):
+    with _hashes_lock:
+        cached = _hashes.pop(session_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    return _hash_prefix(part_path(session_id), offset)
+
+
+def _remember_hash(session_id, offset, digest):
+    with _hashes_lock:
+        _hashes[session_id] = (offset, digest)
+        while len(_hashes) > _HASH_CACHE_SIZE:
+            _hashes.popitem(last=False)
+
+
+def append_chunk(session, offset, stream):
+    """
+    Append the bytes of ``stream`` to the upload at ``offset`` and return the
+    new offset.
+
+    Raises:
+        OffsetMismatch: If ``offset`` is not the number of bytes received
+        UploadTooLarge: If the data exceeds the session's declared size
+    """
+    session_id = str(session.pk)
+    os.makedirs(settings.PICME_UPLOAD_TEMP_DIR, exist_ok=True)
+    with open(part_path(session_id), 'ab') as f:
+        if fcntl is not None:
+            # Released when the file is closed
+            fcntl.flock(f, fcntl.LOCK_EX)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise OffsetMismatch(current)
+        digest = _running_hash(session_id, current)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if current + len(chunk) > session.size:
+                    raise UploadTooLarge(f'Upload exceeds its declared size of {session.size} bytes.')
+                f.write(chunk)
+                digest.update(chunk)
+                current += len(chunk)
+        except UploadTooLarge:
+            # Keep what was valid so the client can resume from there
+            f.truncate(current)
+            raise
+        finally:
+            f.flush()
+            _remember_hash(session_id, current, digest)
+    return current
+
+
+def completed_file(session):
+    """
+    Return a ``SessionUploadedFile`` for a fully received upload.
+    """
+    session_id = str(session.pk)
+    path = part_path(session_id)
+    with _hashes_lock:
+        cached = _hashes.pop(session_id, None)
+    if cached is not None and cached[0] == session.size:
+        sha256 = cached[1].hexdigest()
+    else:
+        sha256 = _hash_prefix(path, session.size).hexdigest()
+    return SessionUploadedFile(path, session.filename, session.size, session.content_type, sha256)
+
+
+def discard(session_id):
+    session_id = str(session_id)
+    with _hashes_lock:
+        _hashes.pop(session_id, None)
+    try:
+        os.remove(part_path(session_id))
+    except FileNotFoundError:
+        pass
@@ -1,5 +1,5 @@
-from django.urls import path
-from . import views
+from django.urls import path, re_path
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -9,6 +9,17 @@ urlpatterns = [
     path('logout/', views.user_logout, name='logout'),
     path('profile/', views.profile, name='profile'),
     path('photo/<int:id>/interact/', views.interact_photo, name='interact_photo'),
+    path('interactions/', views.interact_batch, name='interact_batch'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:session_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<uuid:session_id>/complete/', views.upload_complete, name='upload_complete'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    re_path(r'^avatars/identicon/(?P<seed>[0-9a-f]{12})-(?P<size>[0-9]+)\.png$', views.identicon, name='identicon'),
+    path('api/v1/photos/', api.photo_list, name='api_photo_list'),
+    path('api/v1/photos/<int:id>/', api.photo_detail, name='api_photo_detail'),
+    path('api/v1/photos/<int:id>/counts/', api.photo_counts, name='api_photo_counts'),
+    path('api/v1/tags/', api.tag_list, name='api_tag_list'),
+    path('api/v1/tags/facets/', api.tag_facets, name='api_tag_facets'),
     path('password-reset/', views.CustomPasswordResetView.as_view(), name='password_reset'),
     path('password-reset-done/', views.CustomPasswordResetDoneView.as_view(), name='password_reset_done'),
     path('password-reset-confirm/<uidb64>/<token>/', views.CustomPasswordResetConfirmView.as_view(), name='password_reset_confirm'),
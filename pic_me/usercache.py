@@ -0,0 +1,147 @@
+"""
+Cache of authenticated users for ``CustomAuthBackend.get_user()``.
+
+``AuthenticationMiddleware`` resolves the session's user on every request,
+and most templates touch ``user.profile`` as well. Both rows are loaded with
+one query and kept as a pickled snapshot in a small per-process LRU for
+``PICME_USER_CACHE_TTL`` seconds. Every hit unpickles a fresh instance, so
+request code can never mutate a cached object.
+
+Snapshots are also kept in the shared ``PICME_USER_CACHE_ALIAS`` cache
+(the session cache by default), next to a credentials version per user.
+Each snapshot records the version it was loaded under, and every hit
+compares it with the current one, a cache read rather than a query. The
+``post_save``/``post_delete`` handlers in ``models.py`` replace the version
+(via ``invalidate()``), so a password change, a deactivation or a profile
+edit reaches every process on its next request. Writes that skip the
+signals, such as ``QuerySet.update()``, show once the shared snapshot
+expires after ``PICME_USER_CACHE_SHARED_TTL`` seconds.
+"""
+import itertools
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+# Set by invalidate(), so a lookup racing an update does not store the old
+# row. Users whose generation was trimmed report the highest trimmed value.
+_counter = itertools.count(1)
+_generations = OrderedDict()
+_generation_floor = 0
+
+
+def _shared_cache():
+    return caches[settings.PICME_USER_CACHE_ALIAS]
+
+
+def _shared_key(user_id):
+    return f'picme:user:{user_id}'
+
+
+def _version_key(user_id):
+    return f'picme:user-credentials:{user_id}'
+
+
+def _load(user_id):
+    UserModel = get_user_model()
+    try:
+        return UserModel.objects.select_related('profile').get(pk=user_id)
+    except UserModel.DoesNotExist:
+        return None
+
+
+def get_user(user_id):
+    """
+    Return the user with ``user_id`` (with its profile preloaded) or None.
+    """
+    if settings.PICME_USER_CACHE_TTL <= 0:
+        return _load(user_id)
+
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            _entries.move_to_end(user_id)
+        else:
+            entry = None
+        generation = _generations.get(user_id, _generation_floor)
+
+    shared = _shared_cache()
+    if entry is not None:
+        version = shared.get(_version_key(user_id))
+        if version is not None and version == entry[1]:
+            metrics.increment('users.hits')
+            return pickle.loads(entry[2])
+        metrics.increment('users.stale_credentials')
+    else:
+        cached = shared.get_many([_shared_key(user_id), _version_key(user_id)])
+        version = cached.get(_version_key(user_id))
+        shared_entry = cached.get(_shared_key(user_id))
+        if version is not None and shared_entry is not None and shared_entry[0] == version:
+            metrics.increment('users.shared_hits')
+            _remember(user_id, version, shared_entry[1], generation)
+            return pickle.loads(shared_entry[1])
+
+    metrics.increment('users.misses')
+    if version is None:
+        # Read back, in case another process created the version first
+        shared.add(_version_key(user_id), uuid.uuid4().hex, None)
+        version = shared.get(_version_key(user_id))
+    # The version is read before the row, so a change committed in between
+    # replaces it and the snapshot stored here is never used
+    user = _load(user_id)
+    if user is not None:
+        snapshot = pickle.dumps(user, pickle.HIGHEST_PROTOCOL)
+        if _remember(user_id, version, snapshot, generation):
+            shared.set(_shared_key(user_id), (version, snapshot), settings.PICME_USER_CACHE_SHARED_TTL)
+    return user
+
+
+def _remember(user_id, version, snapshot, generation):
+    with _lock:
+        if _generations.get(user_id, _generation_floor) != generation:
+            return False
+        _entries[user_id] = (time.monotonic() + settings.PICME_USER_CACHE_TTL, version, snapshot)
+        _entries.move_to_end(user_id)
+        while len(_entries) > settings.PICME_USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+    return True
+
+
+def _forget(user_id):
+    global _generation_floor
+    with _lock:
+        _entries.pop(user_id, None)
+        _generations[user_id] = next(_counter)
+        _generations.move_to_end(user_id)
+        while len(_generations) > settings.PICME_USER_CACHE_SIZE:
+            _, trimmed = _generations.popitem(last=False)
+            _generation_floor = max(_generation_floor, trimmed)
+    shared = _shared_cache()
+    shared.set(_version_key(user_id), uuid.uuid4().hex, None)
+    shared.delete(_shared_key(user_id))
+
+
+def invalidate(user_id):
+    """
+    Drop the cached snapshots of a user in every process, now and again
+    once the current transaction commits (a lookup in between could cache
+    the old row).
+    """
+    _forget(user_id)
+    transaction.on_commit(lambda: _forget(user_id))
+
+
+def clear():
+    with _lock:
+        _entries.clear()
@@ -3,62 +3,217 @@ from django.shortcuts import render
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse, StreamingHttpResponse,
+)
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 from django.contrib import messages
-from django.db.models import Q, Count
+from django.db.models import Q, Count, prefetch_related_objects
 from django.contrib.auth.views import PasswordResetView, PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView
 from django.contrib.auth.forms import PasswordResetForm
-from django.urls import reverse_lazy
-from .models import Photo, Tag, PhotoInteraction, UserProfile
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.conf import settings
+from .models import Photo, Tag, PhotoInteraction, UserProfile, UploadSession
 from .forms import UserRegistrationForm, UserProfileForm, UserUpdateForm, PhotoUploadForm
+from .pagination import InvalidCursor, paginate_keyset
+from . import avatars, facets, fragments, interactions, media, metrics, search, similarity, uploads, writebehind
+from .querybudget import query_budget
+import asyncio
+import json
+import os
+import stat
+
+
+GALLERY_ORDERING = ('-created_at', '-id')
+
+# Orderings selectable with the gallery's ``sort`` parameter. The score
+# orderings walk the indexes on PhotoScore (see pic_me.scores); their tie
+# breaker is the score's own photo_id so no sort step is needed.
+GALLERY_SORTS = {
+    'new': GALLERY_ORDERING,
+    'trending': ('-score__trending', '-score__photo_id'),
+    'top': ('-score__top', '-score__photo_id'),
+    # Only with a search query; see sort_gallery()
+    'relevance': (f'-{search.RANK}', '-id'),
+}
+
+# Maximum number of operations accepted by interact_batch
+INTERACTION_BATCH_LIMIT = 500
 
 
 # Create your views here.
 
+def filter_gallery(photos, tag_filter=None, search_query=None, match=facets.MATCH_ALL, sort=None):
+    """
+    Apply the gallery's tag (a slug, or a list of slugs of which all or
+    any must match) and full-text search filters. Sorted by relevance, the
+    search is left to ``sort_gallery()``, whose ranking keeps only matches.
+    """
+    if isinstance(tag_filter, str):
+        tag_filter = [tag_filter]
+    if tag_filter:
+        photos = facets.matching_photos(photos, tag_filter, match)
+    if search_query and not (sort == 'relevance' and search.ranks(search_query)):
+        photos = search.search_photos(photos, search_query)
+    return photos
+
+
+def sort_gallery(photos, sort=None, search_query=None):
+    """
+    Return the photos and the keyset ordering for a ``sort`` value
+    ('new', 'trending', 'top' or 'relevance' to ``search_query``; unknown
+    values, and relevance without a query, sort by date).
+    """
+    ordering = GALLERY_SORTS.get(sort, GALLERY_ORDERING)
+    if sort == 'relevance':
+        photos = search.rank_photos(photos, search_query or '')
+        if search.RANK not in photos.query.annotations:
+            # Nothing to rank by without query terms or a search index
+            ordering = GALLERY_ORDERING
+    elif ordering is not GALLERY_ORDERING:
+        # An inner join lets the database start from the score index; the
+        # cursor is built from the last photo's score
+        photos = photos.filter(score__isnull=False).select_related('score')
+    return photos, ordering
+
+
+def _with_tags(params, slugs):
+    """
+    Query string of ``params`` with the ``tag`` parameters replaced.
+    """
+    params = params.copy()
+    params.setlist('tag', slugs)
+    return params.urlencode()
+
+
+@query_budget(queries=10, duplicates=2)
 def home(request):
     """
     Display the photo gallery homepage with optional tag filtering.
+    Several ``tag`` parameters narrow the gallery to photos with all of
+    them, or any of them with ``match=any``; the facet list shows how many
+    photos each further tag would leave. Only the first
+    ``PICME_TAG_FACET_MAX_SELECTED`` tags are used, and no further tags are
+    offered once that many are selected.
+    Results are sorted by date, by score with ``sort=trending|top`` or, when
+    searching, by ``sort=relevance``, and paginated by keyset via the
+    ``cursor`` query parameter.
     """
-    photos = Photo.objects.all().prefetch_related('tags', 'interactions')
     tags = Tag.objects.all()
-    
-    tag_filter = request.GET.get('tag')
-    if tag_filter:
-        photos = photos.filter(tags__slug=tag_filter)
-    
+    tag_filter = list(dict.fromkeys(slug for slug in request.GET.getlist('tag') if slug))
+    tag_filter = tag_filter[:settings.PICME_TAG_FACET_MAX_SELECTED]
+    match = facets.MATCH_ANY if request.GET.get('match') == facets.MATCH_ANY else facets.MATCH_ALL
     search_query = request.GET.get('search')
-    if search_query:
-        photos = photos.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query)
+    sort = request.GET.get('sort')
+    photos = filter_gallery(Photo.objects.all(), tag_filter, search_query, match, sort)
+    photos, ordering = sort_gallery(photos, sort, search_query)
+    selected_tag = tag_filter[0] if len(tag_filter) == 1 else None
+    
+    try:
+        page = paginate_keyset(
+            photos,
+            ordering,
+            cursor=request.GET.get('cursor'),
+            page_size=settings.PICME_GALLERY_PAGE_SIZE,
         )
+    except InvalidCursor:
+        page = paginate_keyset(photos, ordering, page_size=settings.PICME_GALLERY_PAGE_SIZE)
+    
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    first_query = params.urlencode()
+    next_query = None
+    if page.has_next:
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    
+    selected_tags = sorted(Tag.objects.filter(slug__in=tag_filter), key=lambda tag: tag_filter.index(tag.slug))
+    if len(selected_tags) < len(tag_filter) and match == facets.MATCH_ALL:
+        # An unknown tag matches nothing, and nothing can be refined
+        facet_total, facet_tags = 0, []
+    else:
+        limit = settings.PICME_TAG_FACET_LIMIT if len(tag_filter) < settings.PICME_TAG_FACET_MAX_SELECTED else 0
+        facet_total, facet_tags = facets.facet_counts(selected_tags, match, limit=limit)
+    params.pop('cursor', None)
+    for tag in facet_tags:
+        tag.facet_query = _with_tags(params, [*tag_filter, tag.slug])
+    for tag in selected_tags:
+        tag.remove_query = _with_tags(params, [slug for slug in tag_filter if slug != tag.slug])
+    toggled = params.copy()
+    toggled['match'] = facets.MATCH_ALL if match == facets.MATCH_ANY else facets.MATCH_ANY
+    
+    # Look up every cached card and the tag dropdown in one round-trip and
+    # only load tags for the cards that have to be rendered
+    tags_version = fragments.get_version(fragments.TAGS_VERSION)
+    for photo in page.items:
+        photo.card_cache_key = fragments.photo_card_key(photo, tags_version)
+    tag_list_cache_key = fragments.tag_list_key(tags_version, selected_tag)
+    prefetched_fragments = fragments.get_many(
+        [photo.card_cache_key for photo in page.items] + [tag_list_cache_key]
+    )
+    prefetch_related_objects(
+        [photo for photo in page.items if photo.card_cache_key not in prefetched_fragments],
+        'tags',
+    )
     
     context = {
-        'photos': photos,
+        'photos': page.items,
         'tags': tags,
-        'selected_tag': tag_filter,
+        'selected_tag': selected_tag,
+        'selected_tags': selected_tags,
+        'match': match,
+        'match_toggle_query': toggled.urlencode(),
+        'facet_tags': facet_tags,
+        'facet_total': facet_total,
         'search_query': search_query,
+        'sort': sort,
+        'next_cursor': page.next_cursor,
+        'first_query': first_query,
+        'next_query': next_query,
+        'tag_list_cache_key': tag_list_cache_key,
+        'prefetched_fragments': prefetched_fragments,
     }
     return render(request, 'home.html', context)
 
 
+@query_budget(queries=10, duplicates=3)
 def photo_detail(request, id):
     """
-    Display detailed information for a specific photo.
+    Display detailed information for a specific photo and its
+    near-duplicates.
     """
-    photo = get_object_or_404(Photo, id=id)
+    photo = get_object_or_404(Photo.objects.select_related('uploaded_by__profile'), id=id)
     user_interaction = None
+    total_likes, total_dislikes = photo.like_count, photo.dislike_count
     
     if request.user.is_authenticated:
         user_interaction = PhotoInteraction.objects.filter(
             user=request.user, 
             photo=photo
         ).first()
+
+        # Show the user's own buffered click before it is flushed
+        found, state = writebehind.pending(request.user.pk, photo.pk)
+        if found:
+            stored = user_interaction.interaction_type if user_interaction else None
+            deltas = writebehind.pending_deltas(stored, state)
+            total_likes += deltas['like']
+            total_dislikes += deltas['dislike']
+            user_interaction = (
+                PhotoInteraction(user=request.user, photo=photo, interaction_type=state) if state else None
+            )
     
     context = {
         'photo': photo,
         'user_interaction': user_interaction,
-        'total_likes': photo.total_likes(),
-        'total_dislikes': photo.total_dislikes(),
+        'total_likes': total_likes,
+        'total_dislikes': total_dislikes,
+        'similar_photos': similarity.similar_photos(photo, limit=settings.PICME_SIMILAR_LIMIT),
     }
     return render(request, 'photo_detail.html', context)
 
@@ -155,20 +310,15 @@ def interact_photo(request, id):
             messages.error(request, 'Invalid interaction type.')
             return redirect('photo_detail', id=id)
         
-        interaction, created = PhotoInteraction.objects.get_or_create(
-            user=request.user,
-            photo=photo,
-            defaults={'interaction_type': interaction_type}
-        )
+        if writebehind.enabled():
+            result = writebehind.toggle(request.user.pk, photo.pk, interaction_type)
+        else:
+            result = PhotoInteraction.toggle(request.user, photo, interaction_type)
         
-        if not created:
-            if interaction.interaction_type == interaction_type:
-                interaction.delete()
-                messages.info(request, f'{interaction_type.capitalize()} removed.')
-            else:
-                interaction.interaction_type = interaction_type
-                interaction.save()
-                messages.success(request, f'Changed to {interaction_type}.')
+        if result == 'removed':
+            messages.info(request, f'{interaction_type.capitalize()} removed.')
+        elif result == 'changed':
+            messages.success(request, f'Changed to {interaction_type}.')
         else:
             messages.success(request, f'Photo {interaction_type}d!')
         
@@ -177,6 +327,286 @@ def interact_photo(request, id):
     return redirect('home')
 
 
+def interact_batch(request):
+    """
+    Apply many likes/dislikes in one request.
+
+    Expects a JSON body ``{"operations": [{"photo_id": 1, "interaction_type":
+    "like"}, ...]}``; operations on the same photo toggle in order, as with
+    ``interact_photo``. Responds with each photo's resulting interaction and
+    counts.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        operations = [
+            (operation['photo_id'], operation['interaction_type'])
+            for operation in json.loads(request.body)['operations']
+        ]
+    except (ValueError, KeyError, TypeError, OverflowError):
+        return JsonResponse({'error': 'Expected {"operations": [{"photo_id", "interaction_type"}, ...]}.'},
+                            status=400)
+    if len(operations) > INTERACTION_BATCH_LIMIT:
+        return JsonResponse({'error': f'At most {INTERACTION_BATCH_LIMIT} operations per request.'}, status=400)
+
+    try:
+        photos = interactions.apply_operations(request.user, operations)
+    except interactions.InvalidOperation as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({'photos': {str(pk): state for pk, state in photos.items()}})
+
+
+def _upload_error(message, status, **extra):
+    return JsonResponse({'error': message, **extra}, status=status)
+
+
+def _upload_status(session):
+    offset = uploads.received(session.pk)
+    response = JsonResponse({
+        'id': str(session.pk),
+        'filename': session.filename,
+        'size': session.size,
+        'offset': offset,
+    })
+    response['Upload-Offset'] = str(offset)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def upload_create(request):
+    """
+    Open a resumable upload session.
+
+    Expects ``filename`` and ``size`` (bytes), optionally ``content_type``
+    and the file's ``sha256``. The file is then sent with PATCH requests to
+    the returned URL.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not request.user.is_authenticated:
+        return _upload_error('Authentication required.', 401)
+
+    filename = os.path.basename(request.POST.get('filename', '').replace('\\', '/'))
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return _upload_error('A numeric size is required.', 400)
+    if not filename:
+        return _upload_error('A filename is required.', 400)
+    if size <= 0 or size > settings.PICME_UPLOAD_MAX_SIZE:
+        return _upload_error(f'Size must be between 1 and {settings.PICME_UPLOAD_MAX_SIZE} bytes.', 413)
+    try:
+        # Reject unsupported files before any data is sent
+        for validator in Photo._meta.get_field('image').validators:
+            validator(File(None, filename))
+    except ValidationError as exc:
+        return _upload_error(' '.join(exc.messages), 400)
+
+    session = UploadSession.objects.create(
+        user=request.user,
+        filename=filename,
+        content_type=request.POST.get('content_type', '')[:100],
+        size=size,
+        sha256=request.POST.get('sha256', '').lower()[:64],
+    )
+    response = _upload_status(session)
+    response.status_code = 201
+    response['Location'] = reverse('upload_session', args=[session.pk])
+    return response
+
+
+def upload_session(request, session_id):
+    """
+    Resumable upload session.
+
+    GET/HEAD report the number of bytes received (``Upload-Offset``), PATCH
+    appends the request body at the ``Upload-Offset`` it names, and DELETE
+    abandons the upload. The body is streamed to disk in fixed-size chunks.
+    """
+    if not request.user.is_authenticated:
+        return _upload_error('Authentication required.', 401)
+    session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+    if request.method in ('GET', 'HEAD'):
+        return _upload_status(session)
+    if request.method == 'DELETE':
+        uploads.discard(session.pk)
+        session.delete()
+        return HttpResponse(status=204)
+    if request.method != 'PATCH':
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'PATCH', 'DELETE'])
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return _upload_error('The Upload-Offset header is required.', 400)
+    try:
+        offset = uploads.append_chunk(session, offset, request)
+    except uploads.OffsetMismatch as exc:
+        return _upload_error(str(exc), 409, offset=exc.offset)
+    except uploads.UploadTooLarge as exc:
+        return _upload_error(str(exc), 413, offset=uploads.received(session.pk))
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+    response = HttpResponse(status=204)
+    response['Upload-Offset'] = str(offset)
+    return response
+
+
+def upload_complete(request, session_id):
+    """
+    Create the Photo from a fully received upload.
+
+    Takes the same fields as ``PhotoUploadForm`` (title, description, tags)
+    and validates the received file through it. On validation errors the
+    upload is kept, so the request can be repeated with corrected fields.
+    The response lists existing photos that look like the new one under
+    ``similar``.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not request.user.is_authenticated:
+        return _upload_error('Authentication required.', 401)
+    session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+    offset = uploads.received(session.pk)
+    if offset != session.size:
+        return _upload_error('The upload is incomplete.', 409, offset=offset)
+
+    upload = uploads.completed_file(session)
+    try:
+        if session.sha256 and upload.sha256 != session.sha256:
+            upload.close()
+            uploads.discard(session.pk)
+            session.delete()
+            return _upload_error('Checksum mismatch; the upload was discarded.', 400)
+
+        form = PhotoUploadForm(request.POST, {'image': upload})
+        if not form.is_valid():
+            return _upload_error('Invalid photo.', 400, errors=form.errors.get_json_data())
+        photo = form.save(commit=False)
+        photo.uploaded_by = request.user
+        photo.save()
+        form.save_m2m()
+        image_hash = similarity.ensure_hash(photo, upload)
+    finally:
+        upload.close()
+
+    uploads.discard(session.pk)
+    session.delete()
+    similar = []
+    if image_hash is not None:
+        similar = [
+            {'id': photo_id, 'url': reverse('photo_detail', args=[photo_id]), 'distance': bits}
+            for photo_id, bits in similarity.similar(image_hash, exclude=photo.pk, limit=settings.PICME_SIMILAR_LIMIT)
+        ]
+    url = reverse('photo_detail', args=[photo.pk])
+    response = JsonResponse({'id': photo.pk, 'url': url, 'similar': similar}, status=201)
+    response['Location'] = url
+    return response
+
+
+def identicon(request, seed, size):
+    """
+    Generated avatar for users without a picture (see ``pic_me.avatars``).
+    The seed and size in the URL fix the image, so it is cached forever.
+    """
+    size = int(size)
+    if size not in avatars.AVATAR_SIZES:
+        raise Http404('No such avatar size.')
+    response = HttpResponse(avatars.identicon(seed, size), content_type='image/png')
+    response['Cache-Control'] = media.IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@staff_member_required
+def metrics_view(request):
+    """
+    Expose this process's operational counters (e.g. cache hit rates) as JSON.
+    """
+    return JsonResponse(metrics.snapshot())
+
+
+async def serve_media(request, path):
+    """
+    Stream a file from MEDIA_ROOT.
+
+    Supports single byte ranges, strong content-hash ETags with
+    If-None-Match / If-Modified-Since (304) and If-Range, and long-lived
+    immutable caching for fingerprinted file names. Files are streamed in
+    chunks and never loaded into memory as a whole.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    full_path = media.resolve(path)
+    try:
+        file_stat = await asyncio.to_thread(os.stat, full_path)
+    except OSError:
+        raise Http404('File not found.')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('File not found.')
+
+    etag = await asyncio.to_thread(media.etag, full_path, file_stat)
+    last_modified = int(file_stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': media.cache_control(full_path),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    else:
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = if_modified_since is not None and last_modified <= if_modified_since
+    if not_modified:
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    size = file_stat.st_size
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and size and (not if_range or if_range == etag or
+                                  parse_http_date_safe(if_range) == last_modified):
+        try:
+            byte_range = media.parse_range(range_header, size)
+        except media.RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    length = end - start + 1 if size else 0
+    headers['Content-Length'] = str(length)
+    content_type = media.content_type(full_path)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type)
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            media.aiter_file(full_path, start, length), status=status, content_type=content_type
+        )
+    else:
+        # Under WSGI an async iterator would be consumed into memory first
+        response = StreamingHttpResponse(
+            media.iter_file(full_path, start, length), status=status, content_type=content_type
+        )
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
 # Password Reset Views
 class CustomPasswordResetView(PasswordResetView):
     template_name = 'password_reset.html'
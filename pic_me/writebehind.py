@@ -0,0 +1,313 @@
+"""
+Write-behind buffer for likes/dislikes (``PICME_INTERACTION_WRITE_BEHIND``).
+
+When a photo goes viral, every like is a write to the same photo row, and
+SQLite serializes all writers. In write-behind mode ``interact_photo``
+only records the user's resulting state for ``(user, photo)``. Repeated
+toggles by the same user coalesce into one entry. A background thread in
+each process writes the entries it recorded every
+``PICME_INTERACTION_FLUSH_INTERVAL`` seconds with
+``interactions.apply_states()``: a few bulk statements per batch, however
+many clicks it holds.
+
+The pending state of each pair lives in the shared
+``PICME_INTERACTION_CACHE_ALIAS`` cache as ``(sequence, state)``, so every
+process folds a toggle against the latest click and ``photo_detail`` shows
+the user's own click whichever process serves it. A flush holds the user
+rows locked (``interactions.lock_users()``) while it reads the shared
+states and writes them, so of two processes flushing the same pair the
+later one writes the newest state, never an older one. Written entries are
+kept for ``WRITTEN_TTL`` seconds: they equal the database then, so reading
+them is harmless.
+
+Entries are absolute states, not toggles, so writing one twice is harmless.
+Each entry is first appended to a journal segment (JSON lines) owned by the
+process. The process holds an exclusive ``flock`` on its segments while
+alive, and deletes a segment only after its entries have been written. A
+process that finds a segment it can lock therefore knows the owner died,
+and replays it, preferring the shared state where it is still cached.
+This happens when the flusher starts, or on demand with
+``manage.py flush_interactions``.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+
+from . import interactions
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds a shared entry is kept before and after it is written
+PENDING_TTL = 86400
+WRITTEN_TTL = 600
+
+_lock = threading.Lock()
+# (user_id, photo_id) -> (sequence, 'like', 'dislike' or None) recorded by
+# this process and not yet written
+_pending = {}
+# Journal segment receiving new entries, and older ones awaiting a flush
+_segment = None
+_sealed = []
+_segment_number = 0
+_flusher = None
+_wake = threading.Event()
+
+
+def enabled():
+    return settings.PICME_INTERACTION_WRITE_BEHIND
+
+
+def _shared():
+    return caches[settings.PICME_INTERACTION_CACHE_ALIAS]
+
+
+def _key(user_id, photo_id):
+    return f'picme:interaction:{user_id}:{photo_id}'
+
+
+def _journal_dir():
+    return settings.PICME_INTERACTION_JOURNAL_DIR
+
+
+def _open_segment():
+    global _segment_number
+    _segment_number += 1
+    os.makedirs(_journal_dir(), exist_ok=True)
+    name = f'{socket.gethostname()}-{os.getpid()}-{int(time.time())}-{_segment_number}.jsonl'
+    segment = open(os.path.join(_journal_dir(), name), 'a', encoding='utf-8')
+    fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return segment
+
+
+def start():
+    """
+    Start the flusher thread of this process (idempotent). It first replays
+    segments left behind by dead processes.
+    """
+    global _flusher
+    if not enabled() or _flusher is not None:
+        return
+    if fcntl is None:
+        raise ImproperlyConfigured('PICME_INTERACTION_WRITE_BEHIND needs fcntl (POSIX) for its journal.')
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_run, name='picme-interaction-flusher', daemon=True)
+        _flusher.start()
+    atexit.register(flush)
+
+
+def start_on_request(sender, **kwargs):
+    """``request_started`` receiver connected in ``PicMeConfig.ready()``."""
+    start()
+
+
+def toggle(user_id, photo_id, interaction_type):
+    """
+    Buffered ``PhotoInteraction.toggle()``: same semantics and return value
+    ('created', 'removed' or 'changed'), but nothing is written until the
+    next flush.
+    """
+    from .models import PhotoInteraction
+
+    entry = _shared().get(_key(user_id, photo_id))
+    if entry is not None:
+        sequence, current = entry
+    else:
+        sequence = 0
+        current = (
+            PhotoInteraction.objects
+            .filter(user_id=user_id, photo_id=photo_id)
+            .values_list('interaction_type', flat=True)
+            .first()
+        )
+    state = interactions.fold(current, [interaction_type])
+    record(user_id, photo_id, state, sequence + 1)
+    if current is None:
+        return 'created'
+    if state is None:
+        return 'removed'
+    return 'changed'
+
+
+def record(user_id, photo_id, state, sequence):
+    """
+    Buffer the final interaction state of a user on a photo, the
+    ``sequence``-th of the pair.
+    """
+    global _segment
+    start()
+    line = json.dumps({'u': user_id, 'p': photo_id, 's': state, 'n': sequence}) + '\n'
+    with _lock:
+        if _segment is None:
+            _segment = _open_segment()
+        _segment.write(line)
+        _segment.flush()
+        if settings.PICME_INTERACTION_JOURNAL_FSYNC:
+            os.fsync(_segment.fileno())
+        _pending[(user_id, photo_id)] = (sequence, state)
+        backlog = len(_pending)
+    _shared().set(_key(user_id, photo_id), (sequence, state), PENDING_TTL)
+    if backlog >= settings.PICME_INTERACTION_FLUSH_BATCH:
+        _wake.set()
+
+
+def pending(user_id, photo_id):
+    """
+    Return ``(True, state)`` if any process recorded a state for the pair
+    that may not be written yet, else ``(False, None)``.
+    """
+    entry = _shared().get(_key(user_id, photo_id))
+    if entry is not None:
+        return True, entry[1]
+    return False, None
+
+
+def _write(entries):
+    """
+    Write the states of the given pairs, dropping those of deleted photos or
+    users. ``entries`` maps pairs to the ``(sequence, state)`` recorded
+    locally, used where the shared entry is gone.
+    """
+    from django.contrib.auth import get_user_model
+
+    from .models import Photo
+
+    photo_ids = set(Photo.objects.filter(pk__in={p for _, p in entries}).values_list('pk', flat=True))
+    user_ids = set(
+        get_user_model().objects.filter(pk__in={u for u, _ in entries}).values_list('pk', flat=True)
+    )
+    items = [(key, entry) for key, entry in entries.items() if key[0] in user_ids and key[1] in photo_ids]
+    shared = _shared()
+    batch = settings.PICME_INTERACTION_FLUSH_BATCH
+    for start_index in range(0, len(items), batch):
+        chunk = dict(items[start_index:start_index + batch])
+        keys = {pair: _key(*pair) for pair in chunk}
+        with transaction.atomic():
+            # Read the newest states only once no other flush can write them
+            interactions.lock_users({user_id for user_id, _ in chunk})
+            current = shared.get_many(keys.values())
+            interactions.apply_states({
+                pair: current.get(keys[pair], entry)[1] for pair, entry in chunk.items()
+            })
+        for pair, key in keys.items():
+            if key in current:
+                shared.touch(key, WRITTEN_TTL)
+
+
+def flush():
+    """
+    Write everything buffered by this process. Returns the number of
+    entries written; on failure they stay buffered for the next attempt.
+    """
+    global _segment
+    with _lock:
+        if not _pending:
+            return 0
+        states = dict(_pending)
+        if _segment is not None:
+            _sealed.append(_segment)
+            _segment = None
+        sealed = list(_sealed)
+    try:
+        _write(states)
+    except Exception:
+        logger.exception('Could not write %d buffered interactions', len(states))
+        return 0
+
+    with _lock:
+        # Keep entries that changed again while we were writing
+        for key, entry in states.items():
+            if _pending.get(key) == entry:
+                del _pending[key]
+        for segment in sealed:
+            _sealed.remove(segment)
+    for segment in sealed:
+        # Unlink before closing so no other process can lock and replay it
+        os.remove(segment.name)
+        segment.close()
+    return len(states)
+
+
+def replay_orphans():
+    """
+    Replay the journal segments of dead processes. Returns the number of
+    replayed entries.
+    """
+    if fcntl is None:
+        raise ImproperlyConfigured('PICME_INTERACTION_WRITE_BEHIND needs fcntl (POSIX) for its journal.')
+    replayed = 0
+    with _lock:
+        own = {segment.name for segment in _sealed}
+        if _segment is not None:
+            own.add(_segment.name)
+    for path in sorted(glob.glob(os.path.join(_journal_dir(), '*.jsonl')), key=os.path.getmtime):
+        if path in own:
+            continue
+        try:
+            segment = open(path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with segment:
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Owner still alive
+            if not os.path.exists(path):
+                continue  # Flushed and removed while we waited
+            states = {}
+            for line in segment:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line of a crashed write
+                states[(entry['u'], entry['p'])] = (entry.get('n', 0), entry['s'])
+            _write(states)
+            os.remove(path)
+            replayed += len(states)
+            logger.info('Replayed %d interactions from %s', len(states), path)
+    return replayed
+
+
+def _run():
+    try:
+        replay_orphans()
+    except Exception:
+        logger.exception('Could not replay interaction journal')
+    while True:
+        _wake.wait(settings.PICME_INTERACTION_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        finally:
+            close_old_connections()
+
+
+def pending_deltas(stored_state, state):
+    """
+    Counter adjustments that turn counts including ``stored_state`` into
+    counts including the buffered ``state``. Returns ``{type: delta}``.
+    """
+    deltas = defaultdict(int)
+    if state != stored_state:
+        if stored_state:
+            deltas[stored_state] -= 1
+        if state:
+            deltas[state] += 1
+    return deltas
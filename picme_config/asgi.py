@@ -2,6 +2,9 @@
 ASGI config for picme_config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serving through it (e.g. ``gunicorn picme_config.asgi:application -k
+uvicorn.workers.UvicornWorker``) lets the async media view stream files
+from MEDIA_ROOT without tying up a worker per download.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
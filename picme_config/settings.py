@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 import os
 import dj_database_url
@@ -46,7 +47,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the queries of the session and auth middleware are counted
+    'pic_me.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Serves STATIC_ROOT before the session and auth middleware run
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -115,6 +120,31 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing (see pic_me/hashers.py)
+# Hasher for new and upgraded passwords: 'scrypt' (memory-hard) or 'pbkdf2'.
+# Hashes made with the other one, or with a different cost, are re-encoded on
+# the user's next successful login.
+PICME_PASSWORD_HASHER = config('PICME_PASSWORD_HASHER', default='scrypt')
+# scrypt cost: memory is 128 * N * r bytes (32 MiB with the defaults) per login
+PICME_SCRYPT_WORK_FACTOR = config('PICME_SCRYPT_WORK_FACTOR', default=2**15, cast=int)
+PICME_SCRYPT_BLOCK_SIZE = config('PICME_SCRYPT_BLOCK_SIZE', default=8, cast=int)
+PICME_SCRYPT_PARALLELISM = config('PICME_SCRYPT_PARALLELISM', default=1, cast=int)
+# 0 keeps Django's default iteration count
+PICME_PBKDF2_ITERATIONS = config('PICME_PBKDF2_ITERATIONS', default=0, cast=int)
+# Threads hashing passwords for async logins (0: the event loop's default executor)
+PICME_PASSWORD_HASH_THREADS = config('PICME_PASSWORD_HASH_THREADS', default=0, cast=int)
+
+_PASSWORD_HASHERS = {
+    'scrypt': 'pic_me.hashers.TunedScryptPasswordHasher',
+    'pbkdf2': 'pic_me.hashers.TunedPBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PICME_PASSWORD_HASHER],
+    *(path for name, path in _PASSWORD_HASHERS.items() if name != PICME_PASSWORD_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -135,6 +165,27 @@ STATICFILES_DIRS = [ os.path.join(BASE_DIR, 'static')]
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic names every file after a hash of its content, records the
+# names in staticfiles.json and writes gzip and Brotli variants next to them.
+# {% static %} resolves names from that manifest in memory, and WhiteNoise
+# indexes STATIC_ROOT once at startup (WHITENOISE_AUTOREFRESH and
+# WHITENOISE_USE_FINDERS follow DEBUG), so a request stats no files. Hashed
+# names are served with immutable far-future caching, the negotiated
+# compressed variant and a Vary: Accept-Encoding header.
+# STATIC_ROOT is not committed: run `manage.py collectstatic` on every deploy
+# and whenever a static file changes. Until it has run, pages link the plain
+# file names (see pic_me.storage.StaticStorage).
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'pic_me.storage.StaticStorage',
+    },
+}
+# Cache lifetime in seconds for static files requested by their unhashed name
+WHITENOISE_MAX_AGE = config('PICME_STATIC_MAX_AGE', default=3600, cast=int)
+
 # Custom user model
 AUTH_USER_MODEL = 'pic_me.CustomUser'
 
@@ -159,4 +210,148 @@ SERVER_EMAIL = 'server@picme.com'
 
 # Media files (user uploads)
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+# Serve MEDIA_ROOT from Django with the streaming async view; run under ASGI
+# (picme_config.asgi) so files are streamed without blocking a worker.
+PICME_SERVE_MEDIA = config('PICME_SERVE_MEDIA', default=True, cast=bool)
+# Cache lifetime in seconds for media files without a content fingerprint
+PICME_MEDIA_MAX_AGE = config('PICME_MEDIA_MAX_AGE', default=3600, cast=int)
+
+# Chunked uploads (see pic_me/uploads.py)
+# Directory for the part files of resumable uploads in progress
+PICME_UPLOAD_TEMP_DIR = config('PICME_UPLOAD_TEMP_DIR', default=str(BASE_DIR / 'uploads'))
+PICME_UPLOAD_MAX_SIZE = config('PICME_UPLOAD_MAX_SIZE', default=50 * 1024 * 1024, cast=int)
+# Seconds after the last chunk before `manage.py clean_uploads` drops a session
+PICME_UPLOAD_SESSION_TTL = config('PICME_UPLOAD_SESSION_TTL', default=86400, cast=int)
+
+# Image decoding limits (see pic_me/ingest.py)
+# Uploads over these are rejected before their pixels are decoded; a decode
+# then needs at most about 4 bytes per allowed pixel.
+PICME_IMAGE_MAX_BYTES = config('PICME_IMAGE_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+PICME_IMAGE_MAX_PIXELS = config('PICME_IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+PICME_IMAGE_MAX_FRAMES = config('PICME_IMAGE_MAX_FRAMES', default=200, cast=int)
+
+# Gallery
+# Number of photos per page of the keyset-paginated home gallery.
+PICME_GALLERY_PAGE_SIZE = config('PICME_GALLERY_PAGE_SIZE', default=24, cast=int)
+
+# Popularity scores (see pic_me/scores.py and `manage.py compact_scores`)
+# Hours after which a vote counts half as much in the trending gallery
+PICME_TRENDING_HALF_LIFE = config('PICME_TRENDING_HALF_LIFE', default=24.0, cast=float)
+
+# Tag facets (see pic_me/facets.py and `manage.py rebuild_tag_counts`)
+# Number of tags offered for refining the gallery selection
+PICME_TAG_FACET_LIMIT = config('PICME_TAG_FACET_LIMIT', default=20, cast=int)
+# Most tags a selection may combine; counting the refinements of a larger
+# selection reads the tags of every photo matching it
+PICME_TAG_FACET_MAX_SELECTED = config('PICME_TAG_FACET_MAX_SELECTED', default=3, cast=int)
+
+# Near-duplicate detection (see pic_me/similarity.py and `manage.py rebuild_photo_hashes`)
+# Most differing bits (of 64) between the perceptual hashes of near-duplicates
+PICME_SIMILAR_MAX_DISTANCE = config('PICME_SIMILAR_MAX_DISTANCE', default=6, cast=int)
+# Number of similar photos shown on the detail page and returned on upload
+PICME_SIMILAR_LIMIT = config('PICME_SIMILAR_LIMIT', default=6, cast=int)
+
+# Cache
+# Backend for cached gallery fragments: 'locmem', 'file' or 'redis'. Fragment
+# versions are stored in the database, so even a per-process locmem cache never
+# serves stale cards.
+PICME_FRAGMENT_CACHE = config('PICME_FRAGMENT_CACHE', default='locmem')
+PICME_FRAGMENT_CACHE_ALIAS = 'fragments'
+PICME_FRAGMENT_CACHE_TIMEOUT = config('PICME_FRAGMENT_CACHE_TIMEOUT', default=86400, cast=int)
+# Bump (e.g. to the release id) when the cached templates change
+PICME_FRAGMENT_VERSION = config('PICME_FRAGMENT_VERSION', default='1')
+# Backend holding sessions in front of the database (see Sessions below): 'file'
+# (shared by the processes of one host) or 'redis' (shared by all hosts). A
+# per-process 'locmem' cache would keep serving sessions that another process
+# has flushed on logout, so it is refused.
+PICME_SESSION_CACHE = config('PICME_SESSION_CACHE', default='file')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    PICME_FRAGMENT_CACHE_ALIAS: {
+        **CACHE_BACKENDS[PICME_FRAGMENT_CACHE],
+        'KEY_PREFIX': 'fragments',
+        'TIMEOUT': PICME_FRAGMENT_CACHE_TIMEOUT,
+    },
+    'sessions': {
+        **CACHE_BACKENDS[PICME_SESSION_CACHE],
+        'KEY_PREFIX': 'sessions',
+    },
+}
+
+# Sessions (see pic_me/sessions.py and `manage.py clean_sessions`)
+# Read from the 'sessions' cache and written through to the database, skipping
+# writes of unchanged sessions. 'django.contrib.sessions.backends.signed_cookies'
+# keeps sessions out of the server entirely.
+SESSION_ENGINE = config('PICME_SESSION_ENGINE', default='pic_me.sessions')
+SESSION_CACHE_ALIAS = 'sessions'
+if SESSION_ENGINE == 'pic_me.sessions' and PICME_SESSION_CACHE == 'locmem':
+    raise ImproperlyConfigured(
+        "PICME_SESSION_CACHE must be shared by all processes ('file' or 'redis'), not 'locmem'."
+    )
+# Expired sessions deleted per statement
+PICME_SESSION_CLEANUP_BATCH = config('PICME_SESSION_CLEANUP_BATCH', default=1000, cast=int)
+# Flash messages travel in a signed cookie, so showing one writes no session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# User cache (see pic_me/usercache.py)
+# Seconds a process reuses the user/profile loaded for a session; 0 disables.
+# Saves reach every process on its next request through the credentials
+# version kept in the shared cache below.
+PICME_USER_CACHE_TTL = config('PICME_USER_CACHE_TTL', default=30, cast=int)
+PICME_USER_CACHE_SIZE = config('PICME_USER_CACHE_SIZE', default=10000, cast=int)
+# Shared tier holding snapshots and credentials versions; a CACHES alias that
+# all processes share (the session cache is, see PICME_SESSION_CACHE)
+PICME_USER_CACHE_ALIAS = config('PICME_USER_CACHE_ALIAS', default='sessions')
+PICME_USER_CACHE_SHARED_TTL = config('PICME_USER_CACHE_SHARED_TTL', default=300, cast=int)
+
+# Interaction write-behind (see pic_me/writebehind.py)
+# When enabled, likes/dislikes are buffered and written in batches, absorbing
+# bursts on a single photo.
+PICME_INTERACTION_WRITE_BEHIND = config('PICME_INTERACTION_WRITE_BEHIND', default=False, cast=bool)
+# Cache alias holding clicks not yet written; every process folds new clicks
+# against it, so it must not be a per-process (locmem) cache
+PICME_INTERACTION_CACHE_ALIAS = config('PICME_INTERACTION_CACHE_ALIAS', default='sessions')
+# Journal replayed after a crash; must be shared by all processes of a host
+PICME_INTERACTION_JOURNAL_DIR = config('PICME_INTERACTION_JOURNAL_DIR', default=str(BASE_DIR / 'journal'))
+# fsync every journal append (survives power loss, not just process crashes)
+PICME_INTERACTION_JOURNAL_FSYNC = config('PICME_INTERACTION_JOURNAL_FSYNC', default=False, cast=bool)
+# Seconds between flushes, and the most interactions written per transaction
+PICME_INTERACTION_FLUSH_INTERVAL = config('PICME_INTERACTION_FLUSH_INTERVAL', default=1.0, cast=float)
+PICME_INTERACTION_FLUSH_BATCH = config('PICME_INTERACTION_FLUSH_BATCH', default=500, cast=int)
+
+# Query budgets (see pic_me/querybudget.py)
+# Most times one statement shape may run in a request before it is reported
+# as a likely N+1; views can declare stricter budgets with @query_budget.
+PICME_QUERY_DUPLICATE_LIMIT = config('PICME_QUERY_DUPLICATE_LIMIT', default=10, cast=int)
+# Raise QueryBudgetExceeded instead of logging a warning (enable in tests)
+PICME_QUERY_BUDGET_RAISE = config('PICME_QUERY_BUDGET_RAISE', default=False, cast=bool)
+
+# Background jobs (see pic_me/jobs.py and `manage.py run_worker`)
+# When enabled, uploaded images are validated, stripped of EXIF and turned into
+# renditions by the worker instead of during the request.
+PICME_ASYNC_IMAGE_PROCESSING = config('PICME_ASYNC_IMAGE_PROCESSING', default=True, cast=bool)
+PICME_JOB_MAX_ATTEMPTS = config('PICME_JOB_MAX_ATTEMPTS', default=5, cast=int)
+# Seconds a claimed job stays invisible to other workers before it is retried
+PICME_JOB_VISIBILITY_TIMEOUT = config('PICME_JOB_VISIBILITY_TIMEOUT', default=300, cast=int)
+# Base and maximum retry delay in seconds (exponential backoff)
+PICME_JOB_RETRY_BACKOFF = config('PICME_JOB_RETRY_BACKOFF', default=10, cast=int)
+PICME_JOB_MAX_BACKOFF = config('PICME_JOB_MAX_BACKOFF', default=3600, cast=int)
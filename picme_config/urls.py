@@ -16,15 +16,18 @@ Including another URLconf
 """
 from django.urls import include
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from pic_me.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
      path('', include('pic_me.urls')),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Serve media files through the streaming async view (see pic_me.views.serve_media).
+# Disable with PICME_SERVE_MEDIA=False when a web server or CDN serves MEDIA_ROOT.
+if settings.PICME_SERVE_MEDIA:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+    ]